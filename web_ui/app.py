@@ -1,9 +1,8 @@
-from flask import Flask, render_template, request, jsonify, session, send_from_directory
+from flask import Flask, Request, render_template, request, jsonify, session, send_from_directory, Response, stream_with_context
 import threading
 import json
+import heapq
 import os
-import base64
-import hashlib
 import mimetypes
 from datetime import datetime
 import uuid
@@ -30,15 +29,81 @@ from noiseprotocol.Implementation.noise_chat_client import NoiseChatClient
 
 # Import web adapter from current directory
 from noise_web_adapter import NoiseWebAdapter
+from message_store import RecentEvents
+from search_index import SearchIndex
+from file_index import FileIndex
+from upload_spool import UploadSpool
+from file_transfer import FileTransfers, FRAME_SIZE
+from blob_store import BlobStore, file_digest
+from at_rest import AtRestCipher
+import benchmark
+from file_response import send_stored_file
+from resumable_upload import UploadSessions, UploadError
+from state_backend import create_state
+from message_bus import create_bus
+from sticky_router import StickyRouter, serve_worker_socket, worker_socket_path
+from session_registry import SessionRegistry
+from timer_wheel import TimerWheel
+from event_stream import ChangeNotifier, format_event, encode_cursors, decode_cursors
+from chat_socket import (encode_frame, encode_json_frame, decode_frame, FrameError,
+                         FRAME_SEND, FRAME_PING, FRAME_MESSAGE, FRAME_ACK, FRAME_STATUS)
+
+# The WebSocket transport is optional, /stream and /send keep working without it
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
+
+class ChatRequest(Request):
+    """Request that streams uploaded files straight into the upload folder"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint == 'upload_file':
+            return UploadSpool(app.config['UPLOAD_FOLDER'], cipher=at_rest)
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
 
 # Initialize the app
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
+app.request_class = ChatRequest
+# Workers of a multi-process deployment must share the key to read each other's sessions
+app.secret_key = os.environ.get('NOISE_WEB_SECRET_KEY') or os.urandom(24)
+sock = Sock(app) if Sock else None
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Uploaded files are sealed at rest under a key kept outside the upload folder
+app.config['AT_REST_KEY_FILE'] = os.environ.get(
+    'NOISE_WEB_AT_REST_KEY_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'at_rest.key'))
+at_rest = AtRestCipher.from_key_file(app.config['AT_REST_KEY_FILE'])
+
+# Uploaded file contents, stored once per distinct content in sharded subdirectories
+app.config['BLOB_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'objects')
+blobs = BlobStore(app.config['BLOB_FOLDER'], cipher=at_rest)
+
+# Bytes of uploads kept; beyond that the least recently used files are evicted
+app.config['UPLOAD_QUOTA'] = int(os.environ.get('NOISE_WEB_UPLOAD_QUOTA', 10 * 1024 * 1024 * 1024))
+app.config['UPLOAD_GC_INTERVAL'] = 600  # Seconds between collections of orphaned and evicted files
+blobs.start_collector(quota=app.config['UPLOAD_QUOTA'], interval=app.config['UPLOAD_GC_INTERVAL'])
+
+# Benchmark results and the security test lock, kept out of the upload folder
+app.config['REPORT_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports')
+os.makedirs(app.config['REPORT_FOLDER'], exist_ok=True)
+
+# Largest performance test accepted, and the state of the current (or last) one
+app.config['PERFORMANCE_MAX_MESSAGES'] = 1000000
+performance_run = {'lock': threading.Lock(), 'status': 'idle', 'progress': 0, 'protocol': None, 'error': None}
+
+# Seconds between keep-alive comments (and status checks) on idle event streams
+app.config['STREAM_KEEPALIVE_SECONDS'] = 15
+
 # File upload settings
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # Limit uploads to 50MB
+app.config['RESUMABLE_UPLOAD_MAX_SIZE'] = 1024 * 1024 * 1024  # Files sent in chunks may be larger
+app.config['RESUMABLE_UPLOAD_TIMEOUT'] = 24 * 3600  # Seconds before an abandoned upload is deleted
+# Also stream uploaded files to the peer over the Noise channel (see file_transfer).
+# Transfers run on background workers, so uploads return once the file is stored
+app.config['NOISE_FILE_TRANSFER'] = os.environ.get('NOISE_WEB_FILE_TRANSFER', '1') == '1'
+app.config['NOISE_FILE_TRANSFER_WORKERS'] = 4  # Transfers sent at the same time
 app.config['ALLOWED_EXTENSIONS'] = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx', 'xls', 'xlsx', 'mp4', 'mp3', 'zip', 'rar', '7z'}
 
 # Helper function to check allowed file extensions
@@ -46,22 +111,209 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+# Messages kept in memory per room, older ones are dropped as new ones arrive
+app.config['MESSAGE_HISTORY_LIMIT'] = 100
+
+# Every message is also appended to a durable per-room log in this directory
+# (in-process state only). A process refuses to start on a directory another
+# one appends to; on a message bus each process keeps its copy of the history
+# in a subdirectory, named by NODE_ID or else the first free node-<n>. A room's
+# log is deleted with the room
+app.config['HISTORY_DIR'] = os.environ.get(
+    'NOISE_WEB_HISTORY_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history'))
+app.config['NODE_ID'] = os.environ.get('NOISE_WEB_NODE_ID')
+
+# Largest page of messages /history returns
+app.config['HISTORY_PAGE_LIMIT'] = 200
+
+# Most results /search returns
+app.config['SEARCH_RESULT_LIMIT'] = 50
+
+# Largest page of files /received_files returns
+app.config['FILE_PAGE_LIMIT'] = 100
+
+# Seconds without activity before a client is disconnected
+app.config['CLIENT_IDLE_TIMEOUT'] = 1800
+
+# Seconds an empty room (other than main) is kept before it is removed
+app.config['EMPTY_ROOM_TIMEOUT'] = 60
+
+# Carries room messages and membership changes to the other processes (or nodes):
+# 'memory' within this process, 'unix://<path>' or 'tcp://<host>:<port>' for a BusBroker
+app.config['MESSAGE_BUS'] = os.environ.get('NOISE_WEB_BUS', 'memory')
+# Shared secret authenticating bus frames; required for a TCP bus
+app.config['MESSAGE_BUS_SECRET'] = os.environ.get('NOISE_WEB_BUS_SECRET')
+
+# Rooms, membership, message logs and session owners live in the state backend:
+# 'memory' for a single process, 'sqlite:///<path>' to share them between workers
+app.config['STATE_BACKEND'] = os.environ.get('NOISE_WEB_STATE', 'memory')
+state = create_state(app.config['STATE_BACKEND'], history_limit=app.config['MESSAGE_HISTORY_LIMIT'],
+                     history_dir=app.config['HISTORY_DIR'], node_id=app.config['NODE_ID'],
+                     per_node=app.config['MESSAGE_BUS'] != 'memory')
+
+def release_trimmed_file(room_id, record):
+    """Drop the blob reference of a file message that fell out of a room's history"""
+    digest = file_digest(record.incoming)
+    if digest:
+        blobs.release(room_id, digest)
+
+state.on_trim(release_trimmed_file)
+
 # Initialize chat rooms
-app.config['CHAT_ROOMS'] = {
-    'main': {
-        'name': 'Main Room',
-        'description': 'Default chat room for all users',
-        'members': [],
-        'created_at': datetime.now().isoformat(),
-        'created_by': 'system'
+state.create_room('main', 'Main Room', 'Default chat room for all users', 'system')
+app.config['CHAT_ROOMS'] = state.rooms
+
+# Rooms that did not survive a restart no longer hold on to their uploads. With
+# a message bus each node only knows its own copy of the rooms, so none of them
+# can tell that a room is gone everywhere.
+if app.config['MESSAGE_BUS'] == 'memory':
+    blobs.release_unknown_rooms(lambda room_id: room_id in state.rooms)
+
+# Store active client connections, shared with the adapter
+clients = SessionRegistry()
+
+# Join/leave announcements already posted, keyed by (room_id, user_id, event_type)
+recent_room_events = RecentEvents(ttl=10)
+
+# Inverted index of room messages, filled as messages are posted
+search_index = SearchIndex()
+
+# Wakes up /stream responses when a user has something new
+notifier = ChangeNotifier()
+
+# Room events of the other processes arrive over the bus configured above
+bus = create_bus(app.config['MESSAGE_BUS'], secret=app.config['MESSAGE_BUS_SECRET'])
+
+# Users connected to other processes, learned from the bus: user_id -> username
+remote_usernames = {}
+
+# Idle timeouts for clients and empty rooms
+timers = TimerWheel()
+timers.start()
+
+# Resumable uploads in progress, kept next to the finished ones
+upload_sessions = UploadSessions(os.path.join(app.config['UPLOAD_FOLDER'], 'partial'), timers=timers,
+                                 timeout=app.config['RESUMABLE_UPLOAD_TIMEOUT'],
+                                 max_size=app.config['RESUMABLE_UPLOAD_MAX_SIZE'], cipher=at_rest)
+
+def notify_members(room_id):
+    """Wake up the event streams of every member of a room connected to this worker"""
+    room_data = app.config['CHAT_ROOMS'].get(room_id)
+    for member_id in list(room_data.get('members', ())) if room_data else ():
+        if member_id in clients:
+            notifier.notify(member_id)
+
+def file_recipients(room_id, record):
+    """Members connected to this worker who see a file record as received"""
+    room_data = app.config['CHAT_ROOMS'].get(room_id)
+    for member_id in list(room_data.get('members', ())) if room_data else ():
+        client_info = clients.get(member_id)
+        if member_id != record.sender_id and client_info is not None and \
+                client_info['room_cursors'].get(room_id, record.seq) < record.seq:
+            yield member_id
+
+def room_log(room_id):
+    """The message log of a room, or None if the room does not exist"""
+    room_data = app.config['CHAT_ROOMS'].get(room_id)
+    return room_data['log'] if room_data else None
+
+# Files shared in rooms, indexed per recipient as they are posted
+file_index = FileIndex(file_recipients, room_log)
+
+def visible_records(user_id, room_id, since=0):
+    """
+    Get the message records of a room a user can see, newer than `since`.
+    Members only see what was posted after they joined, which is where
+    their read cursor into the room log starts.
+    """
+    room_data = app.config['CHAT_ROOMS'].get(room_id)
+    joined_at = clients[user_id]['room_cursors'].get(room_id)
+    if room_data is None or joined_at is None:
+        return []
+    return room_data['log'].records_after(max(since, joined_at))
+
+def all_visible_records(user_id):
+    """Get the message records of all the user's rooms, interleaved by timestamp"""
+    room_records = [visible_records(user_id, room_id) for room_id in list(clients[user_id]['room_cursors'])]
+    return list(heapq.merge(*room_records, key=lambda r: r.incoming.get('timestamp', '')))
+
+def iter_new_messages(user_id, client_info, cursors):
+    """
+    Yield the pre-serialized JSON of messages newer than the per-room cursors,
+    advancing the cursors as we go.
+    """
+    for room_id, joined_at in list(client_info['room_cursors'].items()):
+        room_data = app.config['CHAT_ROOMS'].get(room_id)
+        if room_data is None:
+            continue
+        for record in room_data['log'].records_after(max(cursors.get(room_id, 0), joined_at)):
+            cursors[room_id] = record.seq
+            yield record.view_json(user_id)
+
+def stream_status(client_info):
+    """Connection status pushed to event streams whenever it changes"""
+    if client_info:
+        # An open stream counts as activity for the idle sweep
+        client_info['last_activity'] = time.time()
+    return {
+        'connected': bool(client_info and client_info['client'].connected),
+        'active_room': client_info.get('active_room', 'main') if client_info else None
     }
-}
 
-# Initialize the adapter
-adapter = NoiseWebAdapter()
+def json_with_messages(fragments, **fields):
+    """
+    Build a JSON response whose `messages` array is spliced together from
+    pre-serialized message fragments instead of being re-encoded.
+    """
+    body = b'{"messages":[' + b','.join(fragments) + b']'
+    if fields:
+        body += b',' + json.dumps(fields).encode('utf-8')[1:]
+    else:
+        body += b'}'
+    return Response(body, mimetype='application/json')
+
+def add_member(room_id, user_id):
+    """
+    Add a user to a room, keeping the reverse index in sync and starting
+    the member's read cursor at the current end of the room log.
+    """
+    room_data = app.config['CHAT_ROOMS'][room_id]
+    state.add_member(room_id, user_id)
+    clients[user_id]['room_cursors'][room_id] = room_data['log'].last_seq
+    bus.publish({'type': 'join', 'room_id': room_id, 'user_id': user_id,
+                 'username': clients[user_id]['username']})
+
+def remove_member(room_id, user_id):
+    """Remove a user from a room, its reverse index entry and read cursor"""
+    state.remove_member(room_id, user_id)
+    schedule_room_cleanup(room_id)
+    bus.publish({'type': 'leave', 'room_id': room_id, 'user_id': user_id})
+    if user_id in clients:
+        clients[user_id]['room_cursors'].pop(room_id, None)
+    file_index.forget_room(user_id, room_id)
+
+def schedule_room_cleanup(room_id):
+    """Remove a room once it has stayed empty for EMPTY_ROOM_TIMEOUT seconds"""
+    room_data = app.config['CHAT_ROOMS'].get(room_id)
+    # Don't remove the main room
+    if room_id == 'main' or not room_data or room_data['members']:
+        return
+    
+    def remove_if_empty():
+        # Someone may have joined since the room emptied
+        if room_id != 'main' and not app.config['CHAT_ROOMS'].get(room_id, {}).get('members', True):
+            if state.delete_room(room_id):
+                search_index.forget(room_id)
+                file_index.forget(room_id)
+                # The room's file messages are gone with it
+                blobs.release_room(room_id)
+                logger.info(f"Removed empty room: {room_id}")
+    
+    timers.schedule(('room', room_id), time.time() + app.config['EMPTY_ROOM_TIMEOUT'], remove_if_empty)
 
-# Store active client connections
-clients = {}
+# Rooms restored from the history have no members yet; they go unless someone joins
+for restored_room_id in list(app.config['CHAT_ROOMS']):
+    schedule_room_cleanup(restored_room_id)
 
 @app.route('/')
 def index():
@@ -95,33 +347,13 @@ def connect():
         connect_success = client.connect()
         
         if connect_success:
-            clients[user_id] = {
-                'client': client,
-                'username': username,
-                'messages': [],
-                'connected_at': datetime.now().isoformat(),
-                'server': f"{server_host}:{server_port}",
-                'active_room': 'main'  # Default active room
-            }
-            
-            # Add user to the main room
-            if 'CHAT_ROOMS' in app.config and 'main' in app.config['CHAT_ROOMS']:
-                if 'members' not in app.config['CHAT_ROOMS']['main']:
-                    app.config['CHAT_ROOMS']['main']['members'] = []
-                if user_id not in app.config['CHAT_ROOMS']['main']['members']:
-                    app.config['CHAT_ROOMS']['main']['members'].append(user_id)
-            
-            # Start a thread to receive messages
-            def message_receiver():
-                while client.connected:
-                    if len(clients[user_id]['messages']) > 100:
-                        # Limit stored messages
-                        clients[user_id]['messages'] = clients[user_id]['messages'][-100:]
-                    time.sleep(0.1)  # Prevent CPU overuse
-            
-            receiver_thread = threading.Thread(target=message_receiver)
-            receiver_thread.daemon = True
-            receiver_thread.start()
+            if not register_client(user_id, client, username, server_host, server_port):
+                # A concurrent request connected this user first
+                client.disconnect()
+                return jsonify({
+                    'success': False,
+                    'message': 'Already connected to a server'
+                })
             
             return jsonify({
                 'success': True,
@@ -139,72 +371,215 @@ def connect():
             'message': f'Connection error: {str(e)}'
         })
 
+def register_client(user_id, client, username, server_host, server_port):
+    """
+    Store a connected Noise client for a user and add the user to the main room.
+    
+    Returns:
+        bool: False if the user already had a session
+    """
+    if user_id in clients or not state.claim_session(user_id, username, os.getpid()):
+        return False
+    
+    if not clients.add(user_id, {
+        'client': client,
+        'username': username,
+        'room_cursors': {},  # room_id -> seq the user's view of the room log starts after
+        'connected_at': datetime.now().isoformat(),
+        'last_activity': time.time(),
+        'server': f"{server_host}:{server_port}",
+        'active_room': 'main'  # Default active room
+    }):
+        return False
+    
+    # Add user to the main room
+    if 'CHAT_ROOMS' in app.config and 'main' in app.config['CHAT_ROOMS']:
+        add_member('main', user_id)
+    adapter.watch_idle(user_id)
+    return True
+
+def release_session(user_id):
+    """Drop the room state of a user whose session was removed from the registry"""
+    # Remove user from all of their rooms
+    for room_id in state.remove_user(user_id):
+        schedule_room_cleanup(room_id)
+    state.release_session(user_id, os.getpid())
+    bus.publish({'type': 'disconnect', 'user_id': user_id})
+    file_index.forget_user(user_id)
+    
+    # Let open event streams report the disconnect and close
+    notifier.forget(user_id)
+
+def member_username(member_id):
+    """Username of a connected room member, who may be connected to another worker"""
+    client_info = clients.get(member_id)
+    if client_info is not None:
+        return client_info.get('username', 'Unknown')
+    return state.username(member_id) or remote_usernames.get(member_id)
+
+# The adapter's idle timers disconnect sessions through the shared registry
+adapter = NoiseWebAdapter(registry=clients, on_disconnect=release_session, timers=timers,
+                          idle_timeout=app.config['CLIENT_IDLE_TIMEOUT'])
+
+# Files being sent to the Noise peers in the background
+transfers = FileTransfers(max_workers=app.config['NOISE_FILE_TRANSFER_WORKERS'])
+
+if state.shared:
+    # Several workers share the state: serve this worker's private socket and
+    # send each user's requests to the worker holding their Noise client
+    app.config['WORKER_SOCKET_DIR'] = os.environ.get(
+        'NOISE_WEB_SOCKET_DIR', os.path.dirname(os.path.abspath(state.path)))
+    serve_worker_socket(app.wsgi_app, worker_socket_path(app.config['WORKER_SOCKET_DIR'], os.getpid()))
+    app.wsgi_app = StickyRouter(app.wsgi_app, app, state, app.config['WORKER_SOCKET_DIR'])
+    
+    if app.config['MESSAGE_BUS'] == 'memory':
+        # No bus between the workers: notice other workers' posts in the database
+        state.watch(notify_members)
+
 @app.route('/disconnect', methods=['POST'])
 def disconnect():
     """Disconnect from the Noise Protocol server"""
     user_id = session.get('user_id')
     
-    if user_id in clients:
+    # Popping first means only one of several concurrent requests does the teardown
+    client_info = clients.pop(user_id)
+    if client_info is not None:
         try:
-            # Remove user from all rooms
-            if 'CHAT_ROOMS' in app.config:
-                for room_id, room_data in app.config['CHAT_ROOMS'].items():
-                    if 'members' in room_data and user_id in room_data['members']:
-                        room_data['members'].remove(user_id)
-            
-            clients[user_id]['client'].disconnect()
-            del clients[user_id]
+            client_info['client'].disconnect()
             return jsonify({'success': True, 'message': 'Disconnected from server'})
         except Exception as e:
             return jsonify({'success': False, 'message': f'Error disconnecting: {str(e)}'})
+        finally:
+            release_session(user_id)
     else:
         return jsonify({'success': False, 'message': 'Not connected to any server'})
 
 @app.route('/messages', methods=['GET'])
 def get_messages():
-    """Get all messages for the current session"""
+    """
+    Get messages for the current session.
+    With `since=<seq>` only messages of the requested (or active) room newer
+    than that sequence number are returned, together with the new cursor.
+    Messages are complete and serialized when they are stored, so this is a
+    pure read that splices cached JSON fragments together.
+    """
     user_id = session.get('user_id')
     
     if user_id not in clients:
         return jsonify({'success': False, 'messages': [], 'connected': False})
+    # Polling for messages keeps the session alive just like sending does
+    clients.touch(user_id)
     
     # Get active room
     active_room = clients[user_id].get('active_room', 'main')
     
-    # Ensure all messages have both encryption and decryption metadata where available
-    messages = clients[user_id]['messages']
-    
-    # Filter messages by room if query parameter is provided
     room_filter = request.args.get('room')
-    if room_filter:
-        messages = [m for m in messages if m.get('room_id') == room_filter]
-    
-    for message in messages:
-        if 'decryption' not in message and 'type' in message and message['type'] == 'incoming':
-            # For received messages that don't have decryption info yet
-            message['decryption'] = message.get('decryption', {
-                'encrypted_hex': 'Data not captured',
-                'decrypted_size': len(message.get('content', '')),
-                'key_id': 'Not available'
-            })
-        
-        # Make sure room information is added
-        if 'room_id' not in message:
-            message['room_id'] = 'main'
-            message['room_name'] = 'Main Room'
-        elif message['room_id'] == 'main' and 'room_name' not in message:
-            message['room_name'] = 'Main Room'
-        elif message['room_id'] != 'main' and 'room_name' not in message and 'CHAT_ROOMS' in app.config:
-            # Try to get room name from app config
-            room_data = app.config['CHAT_ROOMS'].get(message['room_id'], {})
-            message['room_name'] = room_data.get('name', message['room_id'])
+    since = request.args.get('since', type=int)
+    cursor_room = room_filter or active_room
+    
+    if since is not None:
+        # A cursor ahead of the room means the room was recreated, start over
+        room_data = app.config['CHAT_ROOMS'].get(cursor_room)
+        if room_data is None or since > room_data['log'].last_seq:
+            since = 0
+        records = visible_records(user_id, cursor_room, since)
+    elif room_filter:
+        # Filter messages by room if query parameter is provided
+        records = visible_records(user_id, room_filter)
+    else:
+        records = all_visible_records(user_id)
+    
+    # The cursor only advances past messages the client actually received
+    cursor = since or 0
+    for record in records:
+        if record.incoming.get('room_id', 'main') == cursor_room:
+            cursor = max(cursor, record.seq)
+    
+    return json_with_messages(
+        [record.view_json(user_id) for record in records],
+        success=True,
+        connected=clients[user_id]['client'].connected,
+        active_room=active_room,
+        room_id=cursor_room,
+        cursor=cursor
+    )
+
+@app.route('/history', methods=['GET'])
+def get_history():
+    """
+    Page backwards through the history of a room the user belongs to, back
+    to when they joined (the same lower bound as /messages).
+    Returns up to `limit` messages older than `before` (the newest ones when
+    omitted), oldest first, plus the `before` value for the next page.
+    """
+    user_id = session.get('user_id')
     
-    return jsonify({
-        'success': True,
-        'messages': messages,
-        'connected': clients[user_id]['client'].connected,
-        'active_room': active_room
-    })
+    if user_id not in clients:
+        return jsonify({'success': False, 'message': 'Not connected to any server'})
+    
+    room_id = request.args.get('room') or clients[user_id].get('active_room', 'main')
+    before = request.args.get('before', type=int)
+    limit = request.args.get('limit', 50, type=int)
+    limit = max(1, min(limit, app.config['HISTORY_PAGE_LIMIT']))
+    
+    room_data = app.config['CHAT_ROOMS'].get(room_id)
+    if room_data is None or room_id not in clients[user_id]['room_cursors']:
+        return jsonify({'success': False, 'message': 'You are not a member of this room'})
+    
+    joined_at = clients[user_id]['room_cursors'][room_id]
+    try:
+        records = [record for record in room_data['log'].history(before, limit) if record.seq > joined_at]
+    except Exception as e:
+        logger.error(f"Error reading history of room {room_id}: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+    
+    return json_with_messages(
+        [record.view_json(user_id) for record in records],
+        success=True,
+        room_id=room_id,
+        before=records[0].seq if records else None,
+        has_more=bool(records) and records[0].seq > joined_at + 1
+    )
+
+@app.route('/search', methods=['GET'])
+def search_messages():
+    """
+    Full-text search in a room the user belongs to, over the messages posted
+    since they joined. Returns the messages containing every word of `q`,
+    best match first.
+    """
+    user_id = session.get('user_id')
+    
+    if user_id not in clients:
+        return jsonify({'success': False, 'message': 'Not connected to any server'})
+    
+    room_id = request.args.get('room') or clients[user_id].get('active_room', 'main')
+    query = request.args.get('q', '').strip()
+    limit = request.args.get('limit', 20, type=int)
+    limit = max(1, min(limit, app.config['SEARCH_RESULT_LIMIT']))
+    
+    if not query:
+        return jsonify({'success': False, 'message': 'Empty search query'})
+    
+    room_data = app.config['CHAT_ROOMS'].get(room_id)
+    if room_data is None or room_id not in clients[user_id]['room_cursors']:
+        return jsonify({'success': False, 'message': 'You are not a member of this room'})
+    
+    try:
+        log = room_data['log']
+        fragments = []
+        scores = []
+        joined_at = clients[user_id]['room_cursors'][room_id]
+        for score, seq in search_index.search(room_id, log, query, limit, after=joined_at):
+            records = log.history(seq + 1, 1)
+            if records and records[0].seq == seq:
+                fragments.append(records[0].view_json(user_id))
+                scores.append(round(score, 4))
+    except Exception as e:
+        logger.error(f"Error searching room {room_id}: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+    
+    return json_with_messages(fragments, success=True, room_id=room_id, query=query, scores=scores)
 
 @app.route('/status', methods=['GET'])
 def get_status():
@@ -227,6 +602,142 @@ def get_status():
         'active_room': client_info.get('active_room', 'main')
     })
 
+@app.route('/stream', methods=['GET'])
+def stream_events():
+    """
+    Push new messages and connection status changes as Server-Sent Events.
+    Event ids encode the per-room cursors, so a reconnecting browser resumes
+    from its Last-Event-ID instead of replaying the whole history.
+    """
+    user_id = session.get('user_id')
+    
+    if user_id not in clients:
+        return jsonify({'success': False, 'message': 'Not connected to any server'}), 409
+    
+    cursors = decode_cursors(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    keepalive = app.config['STREAM_KEEPALIVE_SECONDS']
+    
+    def generate():
+        last_status = None
+        yield format_event({'cursors': cursors}, event='ready', retry=3000)
+        
+        while True:
+            # Read the version before the state so no notification slips in between
+            version = notifier.version(user_id)
+            client_info = clients.get(user_id)
+            
+            status = stream_status(client_info)
+            if status != last_status:
+                yield format_event(status, event='status')
+                last_status = status
+            
+            if not status['connected']:
+                return
+            
+            sent = False
+            for message_json in iter_new_messages(user_id, client_info, cursors):
+                yield format_event(message_json, event='message', event_id=encode_cursors(cursors))
+                sent = True
+            
+            if notifier.wait(user_id, version, timeout=keepalive) == version and not sent:
+                # Comment lines keep proxies from closing an idle stream
+                yield ': keepalive\n\n'
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def chat_socket(ws):
+    """
+    Carry chat sends and deliveries over a single WebSocket.
+    Send frames go through send_chat() on a reader thread while this loop pushes
+    every message delivered to the user, so neither direction costs an HTTP request.
+    """
+    user_id = session.get('user_id')
+    
+    if user_id not in clients:
+        ws.send(encode_frame(FRAME_STATUS, {'connected': False, 'active_room': None}))
+        return
+    
+    cursors = decode_cursors(request.args.get('cursors'))
+    keepalive = app.config['STREAM_KEEPALIVE_SECONDS']
+    send_lock = threading.Lock()
+    closed = threading.Event()
+    
+    def send_raw_frame(frame):
+        # The reader thread sends acks while the main loop pushes messages
+        with send_lock:
+            ws.send(frame)
+    
+    def send_frame(kind, *fields):
+        send_raw_frame(encode_frame(kind, *fields))
+    
+    def reader():
+        try:
+            while not closed.is_set():
+                try:
+                    frame = decode_frame(ws.receive())
+                except FrameError as e:
+                    logger.warning(f"Dropping WebSocket frame from user {user_id}: {str(e)}")
+                    continue
+                
+                if frame[0] == FRAME_PING:
+                    send_frame(FRAME_PING)
+                    continue
+                
+                _, ref, room_id, message = frame
+                message = message.strip()
+                if user_id not in clients:
+                    break
+                if not message:
+                    send_frame(FRAME_ACK, ref, False, 'Empty message')
+                    continue
+                
+                try:
+                    success, error = send_chat(user_id, room_id or clients[user_id].get('active_room', 'main'), message)
+                except Exception as e:
+                    logger.error(f"Error sending message: {str(e)}")
+                    success, error = False, f'Error sending message: {str(e)}'
+                send_frame(FRAME_ACK, ref, success, error)
+        except Exception as e:
+            logger.debug(f"WebSocket reader for user {user_id} stopped: {str(e)}")
+        finally:
+            closed.set()
+            notifier.notify(user_id)
+    
+    reader_thread = threading.Thread(target=reader)
+    reader_thread.daemon = True
+    reader_thread.start()
+    
+    last_status = None
+    try:
+        while not closed.is_set():
+            # Read the version before the state so no notification slips in between
+            version = notifier.version(user_id)
+            client_info = clients.get(user_id)
+            
+            status = stream_status(client_info)
+            if status != last_status:
+                send_frame(FRAME_STATUS, status)
+                last_status = status
+            
+            if not status['connected']:
+                break
+            
+            for message_json in iter_new_messages(user_id, client_info, cursors):
+                send_raw_frame(encode_json_frame(FRAME_MESSAGE, message_json))
+            
+            notifier.wait(user_id, version, timeout=keepalive)
+    except Exception as e:
+        logger.debug(f"WebSocket for user {user_id} closed: {str(e)}")
+    finally:
+        closed.set()
+
+if sock:
+    sock.route('/ws')(chat_socket)
+
 @app.route('/users', methods=['GET'])
 def get_users():
     """Get a list of connected users (if the server provides this info)"""
@@ -290,90 +801,212 @@ def upload_file():
         # Secure the filename
         filename = secure_filename(file.filename)
         
-        # Generate unique filename
-        file_id = hashlib.md5((str(time.time()) + filename).encode()).hexdigest()[:10]
-        unique_filename = f"{file_id}_{filename}"
-        unique_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        
-        # Read file content for encryption details
-        file_content = file.read()
-        file_content_md5 = hashlib.md5(file_content).hexdigest()
-        file_content_hex = file_content[:64].hex() + "..." # First 64 bytes for preview
-        file_content_size = len(file_content)
-        
-        # Reset file pointer to beginning for saving
-        file.seek(0)
-        
-        # Save the file
-        try:
-            file.save(unique_path)
-            logger.info(f"File saved successfully to {unique_path}")
-        except Exception as e:
-            logger.error(f"Failed to save file: {str(e)}")
-            return jsonify({'success': False, 'message': f'Failed to save file: {str(e)}'})
-        
-        # Verify file was saved
-        if not os.path.exists(unique_path):
-            logger.error(f"File verification failed: {unique_path} does not exist")
-            return jsonify({'success': False, 'message': 'Server error: File was not saved properly'})
-        
-        # Get file metadata
-        file_size = os.path.getsize(unique_path)
-        mime_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
-        
-        # Generate encryption details for the file
+        # The form parser already streamed the file through an UploadSpool,
+        # which hashed it and wrote it to a temporary file in one pass
+        spool = file.stream
+        if not isinstance(spool, UploadSpool):
+            spool = UploadSpool.from_stream(file.stream, app.config['UPLOAD_FOLDER'], cipher=at_rest)
+        return store_uploaded_file(user_id, room_id, filename, spool)
+    except Exception as e:
+        logger.error(f"Exception during file upload: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error processing upload: {str(e)}'})
+
+def store_uploaded_file(user_id, room_id, filename, spool):
+    """
+    Store a spooled upload and post its file message to the room.
+    Shared by /upload and the resumable upload protocol.
+    """
+    # Store the content under its digest, unless it is stored already
+    try:
+        digest, duplicate = blobs.store(spool, room_id)
+        logger.info(f"File {'deduplicated' if duplicate else 'saved'} as blob {digest}")
+    except Exception as e:
+        logger.error(f"Failed to save file: {str(e)}")
+        spool.close()
+        return jsonify({'success': False, 'message': f'Failed to save file: {str(e)}'})
+    
+    # The download name travels after the digest
+    file_id = digest[:10]
+    unique_filename = f"{digest}_{filename}"
+    
+    # Get file metadata
+    file_size = spool.size
+    mime_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    
+    # Stream the file to the peer in frames on a background worker if enabled;
+    # the UI follows the transfer at /transfers/<transfer_id>
+    client = clients[user_id]['client']
+    if app.config['NOISE_FILE_TRANSFER'] and client.connected:
+        def send_to_peer(transfer_id, progress):
+            with blobs.open(digest) as f:
+                return adapter.send_file(user_id, f, filename, transfer_id=transfer_id, progress=progress)
+        
+        transfer = transfers.start(user_id, room_id, filename, file_size, FRAME_SIZE, send_to_peer)
         encryption_details = {
-            'key_id': f"file-{file_id}",
-            'encrypted_hex': file_content_hex,
-            'full_encrypted_hex': file_content_md5,
-            'original_size': file_content_size,
-            'encrypted_size': file_size,
-            'nonce': base64.b64encode(os.urandom(12)).decode('utf-8'),
-            'algorithm': 'ChaCha20-Poly1305',
+            'key_id': None,
+            'transfer_id': transfer['transfer_id'],
+            'status': 'sending',
+            'algorithm': 'Noise transport',
+            'sha256': digest,
+            'original_size': file_size,
+            'frames': transfer['frames'],
+            'frame_size': FRAME_SIZE,
             'timestamp': datetime.now().isoformat()
         }
-        
-        # Create file message
-        file_message = {
-            'type': 'file',
-            'content': f"Sent a file: {filename}",
-            'timestamp': datetime.now().isoformat(),
-            'sender': clients[user_id]['username'],
-            'room_id': room_id,
-            'file_info': {
-                'filename': filename,
-                'stored_filename': unique_filename,
-                'size': file_size,
-                'mime_type': mime_type,
-                'url': f"/files/{unique_filename}",
-                'public_url': f"/files/{unique_filename}",  # Ensure URL is accessible to all
-                'download_url': f"/files/{unique_filename}"  # Explicit download URL
-            },
-            'encryption': encryption_details,  # Add encryption details
-            'message_id': str(uuid.uuid4())  # Add unique message ID
+    else:
+        encryption_details = {
+            'key_id': None,
+            'algorithm': 'none (stored only, not sent over the Noise channel)',
+            'sha256': digest,
+            'original_size': file_size,
+            'encrypted_size': 0,
+            'timestamp': datetime.now().isoformat()
         }
-        
-        # Add to sender's message history
-        clients[user_id]['messages'].append({
-            **file_message,
-            'type': 'outgoing_file'
-        })
-        
-        # Forward to room members - make sure everyone gets a copy with download URL
-        forward_message_to_room(user_id, room_id, file_message)
-        
-        logger.info(f"File {filename} ({file_size} bytes) uploaded successfully by user {user_id}")
-        return jsonify({
-            'success': True, 
-            'message': f'File {filename} uploaded successfully',
-            'file_path': f"/files/{unique_filename}",
-            'file_info': file_message['file_info'],
-            'encryption': encryption_details  # Return encryption details to client
-        })
+    
+    # Create file message
+    file_message = {
+        'type': 'file',
+        'content': f"Sent a file: {filename}",
+        'timestamp': datetime.now().isoformat(),
+        'sender': clients[user_id]['username'],
+        'room_id': room_id,
+        'file_info': {
+            'filename': filename,
+            'stored_filename': unique_filename,
+            'size': file_size,
+            'mime_type': mime_type,
+            'url': f"/files/{unique_filename}",
+            'public_url': f"/files/{unique_filename}",  # Ensure URL is accessible to all
+            'download_url': f"/files/{unique_filename}"  # Explicit download URL
+        },
+        'encryption': encryption_details,  # Add encryption details
+        'message_id': str(uuid.uuid4())  # Add unique message ID
+    }
+    
+    # Post to the room log, the sender sees it as an outgoing file
+    forward_message_to_room(user_id, room_id, {
+        **file_message,
+        'type': 'outgoing_file'
+    })
+    
+    logger.info(f"File {filename} ({file_size} bytes) uploaded successfully by user {user_id}")
+    return jsonify({
+        'success': True, 
+        'message': f'File {filename} uploaded successfully',
+        'file_path': f"/files/{unique_filename}",
+        'file_info': file_message['file_info'],
+        'encryption': encryption_details  # Return encryption details to client
+    })
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """
+    Start a resumable upload. The client then PUTs chunk_size-byte chunks to
+    /uploads/<upload_id>?offset=<byte offset>, in any order and in parallel,
+    and POSTs /uploads/<upload_id>/complete once every chunk is in.
+    """
+    user_id = session.get('user_id')
+    
+    if user_id not in clients:
+        return jsonify({'success': False, 'message': 'Not connected to any server'})
+    
+    data = request.json or {}
+    filename = secure_filename(data.get('filename', ''))
+    room_id = data.get('room_id') or clients[user_id].get('active_room', 'main')
+    
+    if not filename or not allowed_file(filename):
+        return jsonify({'success': False, 'message': 'File type is not allowed'})
+    if room_id not in clients[user_id]['room_cursors']:
+        return jsonify({'success': False, 'message': 'You are not a member of this room'})
+    
+    try:
+        upload = upload_sessions.create(user_id, room_id, filename, int(data.get('size', -1)))
+    except (UploadError, ValueError) as e:
+        return jsonify({'success': False, 'message': str(e)})
+    except Exception as e:
+        logger.error(f"Error creating upload session: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+    
+    return jsonify({'success': True, **upload.status()})
+
+@app.route('/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+def resumable_upload(upload_id):
+    """Report the missing chunks of an upload, store one chunk, or abort the upload"""
+    user_id = session.get('user_id')
+    
+    if user_id not in clients:
+        return jsonify({'success': False, 'message': 'Not connected to any server'})
+    
+    upload = upload_sessions.get(upload_id, user_id)
+    if upload is None:
+        return jsonify({'success': False, 'message': 'Upload not found'}), 404
+    
+    if request.method == 'DELETE':
+        upload_sessions.discard(upload_id)
+        return jsonify({'success': True, 'message': 'Upload aborted'})
+    
+    if request.method == 'PUT':
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            return jsonify({'success': False, 'message': 'Missing chunk offset'})
+        try:
+            index = upload.write_chunk(offset, request.stream)
+        except UploadError as e:
+            return jsonify({'success': False, 'message': str(e)})
+        except Exception as e:
+            logger.error(f"Error writing chunk of upload {upload_id}: {str(e)}")
+            return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+        return jsonify({'success': True, 'chunk': index, 'received': len(upload.received),
+                        'chunk_count': upload.chunk_count})
+    
+    return jsonify({'success': True, **upload.status()})
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Assemble a fully received upload and post it to its room"""
+    user_id = session.get('user_id')
+    
+    if user_id not in clients:
+        return jsonify({'success': False, 'message': 'Not connected to any server'})
+    
+    upload = upload_sessions.get(upload_id, user_id)
+    if upload is None:
+        return jsonify({'success': False, 'message': 'Upload not found'}), 404
+    
+    try:
+        spool = upload_sessions.finalize(upload)
+    except UploadError as e:
+        return jsonify({'success': False, 'message': str(e), 'missing': upload.missing()})
+    except Exception as e:
+        logger.error(f"Error finalizing upload {upload_id}: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+    
+    # The user may have left the room, or the room may be gone, since the upload started
+    if upload.room_id not in app.config['CHAT_ROOMS'] or upload.room_id not in clients[user_id]['room_cursors']:
+        logger.warning(f"Dropping upload {upload_id} of user {user_id}: no longer a member of room {upload.room_id}")
+        spool.close()
+        return jsonify({'success': False, 'message': 'You are not a member of this room'})
+    
+    try:
+        return store_uploaded_file(user_id, upload.room_id, upload.filename, spool)
     except Exception as e:
         logger.error(f"Exception during file upload: {str(e)}")
+        spool.close()
         return jsonify({'success': False, 'message': f'Error processing upload: {str(e)}'})
 
+@app.route('/transfers/<transfer_id>')
+def transfer_status(transfer_id):
+    """Progress and result of a file transfer to the Noise peer"""
+    user_id = session.get('user_id')
+    transfer = transfers.get(transfer_id)
+    
+    # The sender and the members of the room the file was posted to may follow it
+    room_data = app.config['CHAT_ROOMS'].get(transfer['room_id']) if transfer else None
+    if transfer is None or (transfer.pop('owner') != user_id and
+                            (room_data is None or user_id not in room_data['members'])):
+        return jsonify({'success': False, 'message': 'Transfer not found'}), 404
+    return jsonify({'success': True, 'transfer': transfer})
+
 @app.route('/files/<filename>')
 def serve_file(filename):
     """Serve uploaded files to authenticated users"""
@@ -389,6 +1022,20 @@ def serve_file(filename):
         # Log the access
         logger.info(f"User {user_id} accessing file: {filename}")
         
+        # Content-addressed uploads are named <sha256>_<original name>; their
+        # digest is a strong ETag, and Range/If-None-Match requests are honored
+        prefix, _, download_name = filename.partition('_')
+        if len(prefix) == 64 and all(c in '0123456789abcdef' for c in prefix):
+            blobs.touch(prefix)
+            return send_stored_file(
+                request,
+                blobs.path(prefix),
+                etag=prefix,
+                download_name=download_name,
+                mimetype=mimetypes.guess_type(download_name)[0] or 'application/octet-stream',
+                cipher=blobs.cipher
+            )
+        
         # Set appropriate headers for download
         return send_from_directory(
             app.config['UPLOAD_FOLDER'], 
@@ -400,6 +1047,17 @@ def serve_file(filename):
         logger.error(f"Error serving file {filename}: {str(e)}")
         return jsonify({'error': 'File not found or access denied'}), 404
     
+@app.route('/reports/<path:filename>')
+def serve_report(filename):
+    """Serve benchmark result files to authenticated users"""
+    if not session.get('user_id'):
+        return jsonify({'error': 'Authentication required'}), 401
+    try:
+        return send_from_directory(app.config['REPORT_FOLDER'], filename, as_attachment=True)
+    except Exception as e:
+        logger.error(f"Error serving report {filename}: {str(e)}")
+        return jsonify({'error': 'File not found or access denied'}), 404
+
 @app.route('/message_details', methods=['GET'])
 def get_message_details():
     """Get full encryption details for a message"""
@@ -433,7 +1091,7 @@ def debug_info():
             'status': client_info['client'].connected,
             'username': client_info['username'],
             'handshake_complete': client_info['client'].handshake_complete,
-            'messages_count': len(client_info['messages']),
+            'messages_count': len(all_visible_records(session.get('user_id'))),
             'active_room': client_info.get('active_room', 'main')
         }
     })
@@ -480,18 +1138,15 @@ def create_room():
         return jsonify({'success': False, 'message': 'Room ID and name are required'})
     
     try:
-        # Check if room already exists
-        if room_id in app.config['CHAT_ROOMS']:
+        # Create the room, unless it already exists
+        if not state.create_room(room_id, room_name, description, user_id):
             return jsonify({'success': False, 'message': 'Room with this ID already exists'})
         
-        # Create the room
-        app.config['CHAT_ROOMS'][room_id] = {
-            'name': room_name,
-            'description': description,
-            'members': [user_id],  # Creator is automatically a member
-            'created_at': datetime.now().isoformat(),
-            'created_by': user_id
-        }
+        bus.publish({'type': 'room', 'room_id': room_id, 'name': room_name,
+                     'description': description, 'created_by': user_id})
+        
+        # Creator is automatically a member
+        add_member(room_id, user_id)
         
         logger.info(f"Room '{room_name}' (ID: {room_id}) created by user {user_id}")
         
@@ -547,7 +1202,7 @@ def join_room():
             })
         
         # Add user to room
-        app.config['CHAT_ROOMS'][room_id]['members'].append(user_id)
+        add_member(room_id, user_id)
         
         # Set active room for this user
         clients[user_id]['active_room'] = room_id
@@ -565,22 +1220,8 @@ def join_room():
             'message_id': str(uuid.uuid4())  # Add unique ID to prevent duplicates
         }
         
-        # Add system message to each member's message queue (including the new member)
-        for member_id in app.config['CHAT_ROOMS'][room_id]['members']:
-            if member_id in clients:
-                # Check if a similar message already exists
-                duplicate_exists = False
-                for msg in clients[member_id]['messages']:
-                    if (msg.get('type') == 'system' and 
-                        'joined the room' in msg.get('content', '') and
-                        username in msg.get('content', '') and
-                        msg.get('room_id') == room_id and
-                        (datetime.now() - datetime.fromisoformat(msg.get('timestamp', datetime.now().isoformat()))).total_seconds() < 10):
-                        duplicate_exists = True
-                        break
-                
-                if not duplicate_exists:
-                    clients[member_id]['messages'].append(system_message)
+        # Post the system message to the room (the new member sees it as well)
+        post_system_message(room_id, system_message, 'join', user_id)
         
         return jsonify({
             'success': True, 
@@ -628,14 +1269,14 @@ def leave_room():
         username = clients[user_id]['username']
         
         # Remove user from room
-        app.config['CHAT_ROOMS'][room_id]['members'].remove(user_id)
+        remove_member(room_id, user_id)
         
         # Set active room back to main
         clients[user_id]['active_room'] = 'main'
         
         # Make sure user is in main room
         if user_id not in app.config['CHAT_ROOMS']['main']['members']:
-            app.config['CHAT_ROOMS']['main']['members'].append(user_id)
+            add_member('main', user_id)
         
         room_name = app.config['CHAT_ROOMS'][room_id]['name']
         logger.info(f"User {user_id} left room '{room_name}' (ID: {room_id})")
@@ -651,22 +1292,8 @@ def leave_room():
                 'message_id': str(uuid.uuid4())  # Add unique ID to prevent duplicates
             }
             
-            # Add system message to each remaining member's message queue
-            for member_id in app.config['CHAT_ROOMS'][room_id]['members']:
-                if member_id in clients:
-                    # Check if a similar message already exists
-                    duplicate_exists = False
-                    for msg in clients[member_id]['messages']:
-                        if (msg.get('type') == 'system' and 
-                            'left the room' in msg.get('content', '') and
-                            username in msg.get('content', '') and
-                            msg.get('room_id') == room_id and
-                            (datetime.now() - datetime.fromisoformat(msg.get('timestamp', datetime.now().isoformat()))).total_seconds() < 10):
-                            duplicate_exists = True
-                            break
-                    
-                    if not duplicate_exists:
-                        clients[member_id]['messages'].append(system_message)
+            # Post the system message for the remaining members
+            post_system_message(room_id, system_message, 'leave', user_id)
         
         return jsonify({
             'success': True, 
@@ -691,15 +1318,16 @@ def get_room_members():
     try:
         # Get room members
         if room_id in app.config['CHAT_ROOMS']:
-            member_ids = app.config['CHAT_ROOMS'][room_id].get('members', [])
+            member_ids = list(app.config['CHAT_ROOMS'][room_id].get('members', ()))
             
             # Get username for each member
             members = []
             for member_id in member_ids:
-                if member_id in clients:
+                username = member_username(member_id)
+                if username is not None:
                     members.append({
                         'id': member_id,
-                        'username': clients[member_id].get('username', 'Unknown')
+                        'username': username
                     })
             
             return jsonify({
@@ -734,48 +1362,88 @@ def send_message():
         return jsonify({'success': False, 'message': 'Empty message'})
     
     try:
-        client = clients[user_id]['client']
-        
-        # Check if the user is a member of this room
-        if room_id in app.config['CHAT_ROOMS']:
-            if user_id not in app.config['CHAT_ROOMS'][room_id].get('members', []):
-                return jsonify({'success': False, 'message': f'Not a member of room {room_id}'})
-        
-        # Use regular send_chat_message function
-        success = client.send_chat_message(message)
+        success, error = send_chat(user_id, room_id, message)
         
-        if isinstance(success, dict) and success.get('success', False):
-            # Add message to local history with metadata
-            message_data = {
-                'type': 'outgoing',
-                'content': message,
-                'timestamp': datetime.now().isoformat(),
-                'sender': clients[user_id]['username'],
-                'room_id': room_id,
-                'room_name': app.config['CHAT_ROOMS'][room_id]['name'],
-                'encryption': success.get('metadata', {})
-            }
-            
-            clients[user_id]['messages'].append(message_data)
-            
-            # Forward the message to all other members of the room
-            forward_message_to_room(user_id, room_id, message_data)
-            
+        if success:
             return jsonify({
                 'success': True, 
                 'message': 'Message sent',
                 'room_id': room_id
             })
         else:
-            return jsonify({'success': False, 'message': 'Failed to send message'})
+            return jsonify({'success': False, 'message': error})
     
     except Exception as e:
         logger.error(f"Error sending message: {str(e)}")
         return jsonify({'success': False, 'message': f'Error sending message: {str(e)}'})
 
+def send_chat(user_id, room_id, message):
+    """
+    Encrypt a chat message with the user's Noise client and fan it out to the room.
+    Shared by the /send endpoint and the WebSocket transport.
+    
+    Returns:
+        tuple: (success, error message or None)
+    """
+    client = clients[user_id]['client']
+    clients.touch(user_id)
+    
+    # Check if the user is a member of this room
+    if room_id in app.config['CHAT_ROOMS']:
+        if user_id not in app.config['CHAT_ROOMS'][room_id].get('members', ()):
+            return False, f'Not a member of room {room_id}'
+    
+    # Use regular send_chat_message function
+    success = client.send_chat_message(message)
+    
+    if isinstance(success, dict) and success.get('success', False):
+        # Add message to local history with metadata
+        message_data = {
+            'type': 'outgoing',
+            'content': message,
+            'timestamp': datetime.now().isoformat(),
+            'sender': clients[user_id]['username'],
+            'room_id': room_id,
+            'room_name': app.config['CHAT_ROOMS'][room_id]['name'],
+            'encryption': success.get('metadata', {})
+        }
+        
+        # Post the message to the room log for the sender and all other members
+        forward_message_to_room(user_id, room_id, message_data)
+        return True, None
+    
+    return False, 'Failed to send message'
+
+def normalize_message(message, room_id):
+    """
+    Fill in the metadata every stored message carries. This runs once when a
+    message is posted, so read paths never have to patch messages up.
+    """
+    # Add room information to the message
+    message['room_id'] = room_id
+    if 'room_name' not in message:
+        room_data = app.config['CHAT_ROOMS'].get(room_id, {})
+        message['room_name'] = room_data.get('name', room_id)
+    
+    # Ensure message has a unique ID
+    if 'message_id' not in message:
+        message['message_id'] = str(uuid.uuid4())
+    
+    if message.get('type') == 'incoming' and 'decryption' not in message:
+        # For received messages that don't have decryption info yet
+        message['decryption'] = {
+            'encrypted_hex': 'Data not captured',
+            'decrypted_size': len(message.get('content', '')),
+            'key_id': 'Not available'
+        }
+    
+    return message
+
 def forward_message_to_room(sender_id, room_id, message_data):
     """
-    Forward a message to all other users in the same room.
+    Post a message to a room's shared log and wake up its members.
+    `message_data` is the sender's view; the view for the other members is
+    derived from it once, instead of copying the message for every member.
     This simulates room messaging in the absence of protocol-level support.
     """
     try:
@@ -784,9 +1452,10 @@ def forward_message_to_room(sender_id, room_id, message_data):
             logger.warning(f"Cannot forward message to non-existent room: {room_id}")
             return
         
-        # Get room members
-        room_members = app.config['CHAT_ROOMS'][room_id].get('members', [])
-        logger.info(f"Forwarding message to {len(room_members)} members in room {room_id}")
+        room_data = app.config['CHAT_ROOMS'][room_id]
+        logger.info(f"Forwarding message to {len(room_data.get('members', []))} members in room {room_id}")
+        
+        normalize_message(message_data, room_id)
         
         # Prepare message for other members
         incoming_message = message_data.copy()
@@ -798,68 +1467,83 @@ def forward_message_to_room(sender_id, room_id, message_data):
             # For file messages, ensure proper type for recipients
             incoming_message['type'] = 'file'
         
-        # Add room information to the message
-        incoming_message['room_id'] = room_id
-        incoming_message['room_name'] = app.config['CHAT_ROOMS'][room_id].get('name', room_id)
-        
-        # Ensure message has a unique ID
-        if 'message_id' not in incoming_message:
-            incoming_message['message_id'] = str(uuid.uuid4())
-        
-        # Add to each member's message queue
-        for member_id in room_members:
-            if member_id != sender_id and member_id in clients:
-                # Make a copy specific to this member
-                member_message = incoming_message.copy()
-                
-                # For file messages, ensure download links are accessible
-                if 'file_info' in member_message:
-                    file_info = member_message['file_info'].copy()
-                    # Ensure URLs are absolute and accessible to all members
-                    if 'url' in file_info and not file_info['url'].startswith('/files/'):
-                        file_info['url'] = f"/files/{file_info['stored_filename']}"
-                    # Add explicit download URL
-                    file_info['download_url'] = f"/files/{file_info['stored_filename']}"
-                    member_message['file_info'] = file_info
-                
-                # Add to the member's message queue
-                clients[member_id]['messages'].append(member_message)
-                logger.debug(f"Message forwarded to member {member_id}")
+        # For file messages, ensure download links are accessible
+        if 'file_info' in incoming_message:
+            file_info = incoming_message['file_info'].copy()
+            # Ensure URLs are absolute and accessible to all members
+            if 'url' in file_info and not file_info['url'].startswith('/files/'):
+                file_info['url'] = f"/files/{file_info['stored_filename']}"
+            # Add explicit download URL
+            file_info['download_url'] = f"/files/{file_info['stored_filename']}"
+            incoming_message['file_info'] = file_info
+        
+        normalize_message(incoming_message, room_id)
+        
+        # One shared record, members read it through their cursors
+        record = room_data['log'].append(sender_id, message_data, incoming_message)
+        notify_members(room_id)
+        search_index.add(room_id, room_data['log'], record)
+        file_index.add(room_id, room_data['log'], record)
+        bus.publish({'type': 'message', 'room_id': room_id, 'sender_id': sender_id,
+                     'outgoing': message_data, 'incoming': incoming_message})
     
     except Exception as e:
         logger.error(f"Error forwarding message: {str(e)}")
 
-# Add a periodic cleanup function for inactive rooms
-def cleanup_inactive_rooms():
-    """Remove empty rooms except for the main room."""
-    while True:
-        try:
-            time.sleep(300)  # Check every 5 minutes
-            
-            if 'CHAT_ROOMS' in app.config:
-                rooms_to_remove = []
-                
-                for room_id, room_data in app.config['CHAT_ROOMS'].items():
-                    # Don't remove the main room
-                    if room_id == 'main':
-                        continue
-                    
-                    # Check if the room is empty
-                    if not room_data.get('members'):
-                        rooms_to_remove.append(room_id)
-                
-                # Remove empty rooms
-                for room_id in rooms_to_remove:
-                    del app.config['CHAT_ROOMS'][room_id]
-                    logger.info(f"Removed empty room: {room_id}")
-        
-        except Exception as e:
-            logger.error(f"Error in cleanup_inactive_rooms: {e}")
+def post_system_message(room_id, system_message, event_type, user_id):
+    """
+    Post a join/leave system message to a room's shared log, unless the same
+    event for the same user was already posted in the last 10 seconds.
+    """
+    if not recent_room_events.record((room_id, user_id, event_type)):
+        return
+    
+    log = app.config['CHAT_ROOMS'][room_id]['log']
+    record = log.append(None, normalize_message(system_message, room_id))
+    notify_members(room_id)
+    search_index.add(room_id, log, record)
+    bus.publish({'type': 'message', 'room_id': room_id, 'sender_id': None, 'outgoing': system_message})
 
-# Start the cleanup thread
-cleanup_thread = threading.Thread(target=cleanup_inactive_rooms)
-cleanup_thread.daemon = True
-cleanup_thread.start()
+def apply_bus_event(event):
+    """
+    Apply a room event published by another process and wake the local members.
+    With a shared state backend the publisher already stored the change, so
+    only the wake-up is left to do.
+    """
+    event_type = event.get('type')
+    room_id = event.get('room_id')
+    
+    if not state.shared:
+        if event_type == 'room':
+            state.create_room(room_id, event.get('name', room_id), event.get('description', ''), event.get('created_by'))
+        elif event_type == 'join':
+            remote_usernames[event['user_id']] = event.get('username', 'Unknown')
+            if room_id in app.config['CHAT_ROOMS']:
+                state.add_member(room_id, event['user_id'])
+        elif event_type == 'leave':
+            state.remove_member(room_id, event['user_id'])
+            schedule_room_cleanup(room_id)
+        elif event_type == 'disconnect':
+            remote_usernames.pop(event['user_id'], None)
+            for left_room in state.remove_user(event['user_id']):
+                schedule_room_cleanup(left_room)
+        elif event_type == 'message':
+            outgoing = event['outgoing']
+            # The room may predate this process joining the bus
+            state.create_room(room_id, outgoing.get('room_name', room_id), '', event.get('sender_id'))
+            digest = file_digest(outgoing)
+            if digest:
+                # This process's copy of the file message is released on its own
+                blobs.retain(room_id, digest)
+            log = app.config['CHAT_ROOMS'][room_id]['log']
+            record = log.append(event.get('sender_id'), outgoing, event.get('incoming'))
+            search_index.add(room_id, log, record)
+            file_index.add(room_id, log, record)
+    
+    if event_type == 'message':
+        notify_members(room_id)
+
+bus.subscribe(apply_bus_event)
 
 # Endpoint for security testing
 @app.route('/security_test', methods=['POST'])
@@ -883,7 +1567,7 @@ def run_security_test():
         script_path = os.path.join(implementation_path, 'security_test_script.py')
         
         # Create lock file to indicate tests are running
-        lock_file = os.path.join(app.config['UPLOAD_FOLDER'], 'security_test.lock')
+        lock_file = os.path.join(app.config['REPORT_FOLDER'], 'security_test.lock')
         with open(lock_file, 'w') as f:
             f.write(f"Security test started at {datetime.now().isoformat()}")
         
@@ -971,7 +1655,7 @@ def run_security_test():
     except Exception as e:
         logger.error(f"Error running security tests: {str(e)}")
         # Remove lock file if an error occurs
-        lock_file = os.path.join(app.config['UPLOAD_FOLDER'], 'security_test.lock')
+        lock_file = os.path.join(app.config['REPORT_FOLDER'], 'security_test.lock')
         if os.path.exists(lock_file):
             os.remove(lock_file)
         return jsonify({'success': False, 'message': f'Error running security tests: {str(e)}'})
@@ -995,7 +1679,7 @@ def get_security_test_status():
     
     # Get the results from the actual security test run
     # Use a lock file to indicate if security tests are running
-    lock_file = os.path.join(app.config['UPLOAD_FOLDER'], 'security_test.lock')
+    lock_file = os.path.join(app.config['REPORT_FOLDER'], 'security_test.lock')
     if os.path.exists(lock_file):
         # Test is still running
         status = 'running'
@@ -1063,61 +1747,71 @@ def run_performance_test():
     output_format = data.get('output_format', 'text')
     
     try:
-        # Import the performance test script dynamically
-        import sys
-        import importlib.util
+        num_messages = int(num_messages)
+        message_size = int(message_size)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'num_messages and message_size must be numbers'})
+    if not 1 <= num_messages <= app.config['PERFORMANCE_MAX_MESSAGES'] or not 1 <= message_size <= 60000:
+        return jsonify({'success': False, 'message': f"num_messages must be 1-{app.config['PERFORMANCE_MAX_MESSAGES']} "
+                                                     f"and message_size 1-60000 bytes"})
+    if not isinstance(protocols, list) or not protocols or \
+            any(p != 'all' and p not in benchmark.PROTOCOLS for p in protocols):
+        return jsonify({'success': False, 'message': 'Unknown protocol'})
+    
+    with performance_run['lock']:
+        if performance_run['status'] == 'running':
+            return jsonify({'success': False, 'message': 'A performance test is already running'})
+        performance_run.update(status='running', progress=0, protocol=None, error=None)
+    
+    try:
         import subprocess
         
-        # Instead of running within the Flask process (which can cause GUI issues),
-        # run the performance test as a separate process
-        script_path = os.path.join(implementation_path, 'performance_comparision.py')
-        
-        # Build the command to run the script
-        command = [sys.executable, script_path]
-        
-        # Add arguments
-        command.append('--format')
-        command.append(output_format)
-        command.append('--messages')
-        command.append(str(num_messages))
-        command.append('--size')
-        command.append(str(message_size))
-        command.append('--protocols')
-        
-        # Add selected protocols
-        if 'all' in protocols:
-            command.append('all')
-        else:
-            # Ensure we add each protocol individually
-            for protocol in protocols:
-                command.append(protocol)
+        # Earlier results must not be mistaken for this run's
+        for name in ('performance_comparison.json', 'performance_comparison.csv'):
+            try:
+                os.remove(os.path.join(app.config['REPORT_FOLDER'], name))
+            except FileNotFoundError:
+                pass
+        
+        # The benchmark runs in its own process, so its CPU and memory
+        # figures are not mixed up with this server's
+        command = [sys.executable, benchmark.__file__,
+                   '--messages', str(num_messages),
+                   '--size', str(message_size),
+                   '--output', app.config['REPORT_FOLDER'],
+                   '--implementation', implementation_path,
+                   '--protocols'] + protocols
         
-        # Create a new thread to run the command
         def run_benchmark():
             try:
-                # Run the command
-                process = subprocess.Popen(
-                    command, 
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    cwd=implementation_path,  # Set working directory to avoid path issues
-                    text=True
-                )
-                stdout, stderr = process.communicate()
-                
-                # Log output for debugging
-                logger.info(f"Performance test stdout: {stdout}")
-                if stderr:
-                    logger.error(f"Performance test stderr: {stderr}")
-                
-                # Generate mock results for the web UI
-                # This ensures that even if the external process fails, the UI gets data
-                generate_mock_results(protocols)
+                process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+                error = None
+                # Progress comes as one JSON object per line; anything else is noise from the clients
+                for line in process.stdout:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    if not isinstance(event, dict):
+                        continue
+                    if 'progress' in event:
+                        performance_run.update(progress=event['progress'], protocol=event.get('protocol'))
+                    error = event.get('error', error)
+                    for protocol, message in (event.get('errors') or {}).items():
+                        logger.warning(f"Performance test of {protocol} failed: {message}")
+                stderr = process.stderr.read()
+                process.wait()
                 
+                if process.returncode == 0:
+                    performance_run.update(status='completed', progress=100)
+                    logger.info("Performance test completed")
+                else:
+                    performance_run.update(status='failed', error=error or f'Benchmark exited with status {process.returncode}')
+                    logger.error(f"Performance test failed: {performance_run['error']} {stderr[-2000:]}")
+            
             except Exception as e:
                 logger.error(f"Error in performance test thread: {str(e)}")
-                # Generate mock results as fallback
-                generate_mock_results(protocols)
+                performance_run.update(status='failed', error=str(e))
         
         thread = threading.Thread(target=run_benchmark)
         thread.daemon = True
@@ -1137,328 +1831,58 @@ def run_performance_test():
     
     except Exception as e:
         logger.error(f"Error running performance tests: {str(e)}")
+        performance_run.update(status='failed', error=str(e))
         return jsonify({'success': False, 'message': f'Error running performance tests: {str(e)}'})
 
-def generate_mock_results(protocols):
-    """Generate mock performance test results for the web UI"""
-    import random
-    import json
-    
-    # Create a results dictionary with random but realistic values
-    results = {}
-    
-    # Select which protocols to include
-    test_protocols = []
-    if 'all' in protocols:
-        test_protocols = ['noise', 'tls13', 'plain_tls', 'unencrypted']
-    else:
-        test_protocols = protocols
-    
-    # Nice protocol names for display
-    protocol_names = {
-        'noise': 'Noise Protocol',
-        'tls13': 'TLS 1.3',
-        'plain_tls': 'TLS 1.2',
-        'unencrypted': 'Unencrypted'
-    }
-    
-    # Generate mock data for each protocol
-    for protocol in test_protocols:
-        if protocol in protocol_names:
-            # Base values that make sense for comparison
-            base_values = {
-                'noise': {
-                    'handshake_time': 0.035,
-                    'avg_latency': 0.0010,        # Best latency
-                    'min_latency': 0.0008,        # Best min latency
-                    'max_latency': 0.0018,        # Best max latency
-                    'throughput': 575,           # Best throughput of secure protocols
-                    'cpu_usage': 2.5,
-                    'memory_usage': 2.8          # Best memory usage
-                },
-                'tls13': {
-                    'handshake_time': 0.068,
-                    'avg_latency': 0.0018,
-                    'min_latency': 0.0014,
-                    'max_latency': 0.0032,
-                    'throughput': 510,
-                    'cpu_usage': 3.1,
-                    'memory_usage': 5.2
-                },
-                'plain_tls': {
-                    'handshake_time': 0.057,
-                    'avg_latency': 0.0019,
-                    'min_latency': 0.0015,
-                    'max_latency': 0.0035,
-                    'throughput': 495,
-                    'cpu_usage': 2.8,
-                    'memory_usage': 4.9
-                },
-                'unencrypted': {
-                    'handshake_time': 0.002,
-                    'avg_latency': 0.0011,        # Slightly worse than Noise Protocol
-                    'min_latency': 0.0009,        # Slightly worse than Noise Protocol
-                    'max_latency': 0.0019,        # Slightly worse than Noise Protocol
-                    'throughput': 890,           # Still highest due to no encryption
-                    'cpu_usage': 1.2,
-                    'memory_usage': 3.1
-                }
-            }
-            
-            # Add some randomness for realism
-            base = base_values.get(protocol, base_values['noise'])
-            results[protocol] = {
-                'handshake_time': base['handshake_time'] * random.uniform(0.9, 1.1),
-                'avg_latency': base['avg_latency'] * random.uniform(0.9, 1.1),
-                'min_latency': base['min_latency'] * random.uniform(0.9, 1.1),
-                'max_latency': base['max_latency'] * random.uniform(0.9, 1.1),
-                'throughput': base['throughput'] * random.uniform(0.9, 1.1),
-                'cpu_usage': base['cpu_usage'] * random.uniform(0.9, 1.1),
-                'memory_usage': base['memory_usage'] * random.uniform(0.9, 1.1)
-            }
-    
-    # Save results to files for the web UI to access
-    try:
-        # Create CSV file
-        csv_data = "Protocol,HandshakeTime,Latency,Throughput,CPUUsage,MemoryUsage\n"
-        for p in test_protocols:
-            if p in results:
-                result = results[p]
-                name = protocol_names.get(p, p)
-                handshake_time = result.get('handshake_time', 0)
-                latency = result.get('avg_latency', 0) * 1000  # Convert to ms
-                throughput = result.get('throughput', 0)
-                cpu_usage = result.get('cpu_usage', 0)
-                memory_usage = result.get('memory_usage', 0)
-                
-                csv_data += f"{name},{handshake_time},{latency},{throughput},{cpu_usage},{memory_usage}\n"
-        
-        csv_path = os.path.join(app.config['UPLOAD_FOLDER'], 'performance_comparison.csv')
-        with open(csv_path, 'w') as f:
-            f.write(csv_data)
-        
-        # Create JSON file
-        json_data = {
-            "protocols": [protocol_names.get(p, p) for p in test_protocols if p in results],
-            "metrics": {
-                "handshake_time": {
-                    "label": "Handshake Time (s)",
-                    "values": [results[p].get('handshake_time', 0) for p in test_protocols if p in results],
-                    "better": "lower"
-                },
-                "latency": {
-                    "label": "Average Latency (ms)",
-                    "values": [results[p].get('avg_latency', 0) * 1000 for p in test_protocols if p in results],
-                    "better": "lower"
-                },
-                "throughput": {
-                    "label": "Throughput (msg/s)",
-                    "values": [results[p].get('throughput', 0) for p in test_protocols if p in results],
-                    "better": "higher"
-                },
-                "cpu_usage": {
-                    "label": "CPU Usage (%)",
-                    "values": [results[p].get('cpu_usage', 0) for p in test_protocols if p in results],
-                    "better": "lower"
-                },
-                "memory_usage": {
-                    "label": "Memory Usage (MB)",
-                    "values": [results[p].get('memory_usage', 0) for p in test_protocols if p in results],
-                    "better": "lower"
-                }
-            }
-        }
-        
-        json_path = os.path.join(app.config['UPLOAD_FOLDER'], 'performance_comparison.json')
-        with open(json_path, 'w') as f:
-            json.dump(json_data, f, indent=2)
-        
-        logger.info("Generated mock performance test results")
-    except Exception as e:
-        logger.error(f"Error generating mock performance results: {str(e)}")
-
 # Endpoint to get performance test status and results
 @app.route('/performance_test_status', methods=['GET'])
 def get_performance_test_status():
     """Get the status of running performance tests and results if available"""
-    import json
-    import os
-    import random
-    
     output_format = request.args.get('format', 'text')
     
-    # For now, we'll randomly decide if the test is complete based on the passage of time
-    # In a real implementation, you would track the actual progress
-    progress = random.randint(80, 100)  # Bias toward completion for better UX
-    
-    # We'll consider the test complete if either:
-    # 1. The progress value is 100
-    # 2. The result files exist
-    json_path = os.path.join(app.config['UPLOAD_FOLDER'], 'performance_comparison.json')
-    csv_path = os.path.join(app.config['UPLOAD_FOLDER'], 'performance_comparison.csv')
+    json_path = os.path.join(app.config['REPORT_FOLDER'], 'performance_comparison.json')
+    csv_path = os.path.join(app.config['REPORT_FOLDER'], 'performance_comparison.csv')
     
     files_exist = os.path.exists(json_path) and os.path.exists(csv_path)
-    status = 'completed' if progress >= 100 or files_exist else 'running'
+    status = performance_run['status']
+    if status == 'idle':
+        # Results of a run made before this process started
+        status = 'completed' if files_exist else 'idle'
+    progress = 100 if status == 'completed' else performance_run['progress']
     
     # If completed and files exist, read the JSON data
     results = None
     chart_data = None
     
-    if status == 'completed':
-        progress = 100  # Ensure progress shows 100% when complete
-        
-        if files_exist:
-            try:
-                # Read JSON data
-                with open(json_path, 'r') as f:
-                    chart_data = json.load(f)
-                
-                # Convert chart data to result format for API compatibility
-                if "protocols" in chart_data and "metrics" in chart_data:
-                    results = {}
-                    protocols = chart_data["protocols"]
-                    
-                    # Map protocol names back to keys
-                    protocol_keys = {
-                        'Noise Protocol': 'noise',
-                        'TLS 1.3': 'tls13',
-                        'TLS 1.2': 'plain_tls',
-                        'Unencrypted': 'unencrypted'
-                    }
-                    
-                    for i, protocol_name in enumerate(protocols):
-                        key = protocol_keys.get(protocol_name, protocol_name.lower().replace(' ', '_'))
-                        results[key] = {
-                            'handshake_time': chart_data["metrics"]["handshake_time"]["values"][i],
-                            'avg_latency': chart_data["metrics"]["latency"]["values"][i] / 1000,  # Convert ms to s
-                            'min_latency': chart_data["metrics"]["latency"]["values"][i] * 0.8 / 1000,  # Estimate
-                            'max_latency': chart_data["metrics"]["latency"]["values"][i] * 1.2 / 1000,  # Estimate
-                            'throughput': chart_data["metrics"]["throughput"]["values"][i],
-                            'cpu_usage': chart_data["metrics"]["cpu_usage"]["values"][i],
-                            'memory_usage': chart_data["metrics"]["memory_usage"]["values"][i]
-                        }
-            except Exception as e:
-                logger.error(f"Error reading performance test results: {str(e)}")
-                # Fall back to mock data
-                generate_mock_results(['noise', 'tls13', 'plain_tls', 'unencrypted'])
-                status = 'completed'
-                progress = 100
-                
-                # Try to read the files again
-                try:
-                    with open(json_path, 'r') as f:
-                        chart_data = json.load(f)
-                except:
-                    pass
-    
-    # If no results were loaded, use mock data
-    if results is None and status == 'completed':
-        # Generate mock results using the same format as the real results
-        results = {
-            'noise': {
-                'handshake_time': 0.0352,
-                'avg_latency': 0.0021,
-                'min_latency': 0.0017,
-                'max_latency': 0.0046,
-                'throughput': 456.78,
-                'cpu_usage': 2.5,
-                'memory_usage': 4.8
-            },
-            'tls13': {
-                'handshake_time': 0.0678,
-                'avg_latency': 0.0018,
-                'min_latency': 0.0014,
-                'max_latency': 0.0032,
-                'throughput': 512.34,
-                'cpu_usage': 3.1,
-                'memory_usage': 5.2
-            },
-            'plain_tls': {
-                'handshake_time': 0.0573,
-                'avg_latency': 0.0019,
-                'min_latency': 0.0015,
-                'max_latency': 0.0035,
-                'throughput': 498.12,
-                'cpu_usage': 2.8,
-                'memory_usage': 4.9
-            },
-            'unencrypted': {
-                'handshake_time': 0.0021,
-                'avg_latency': 0.0008,
-                'min_latency': 0.0006,
-                'max_latency': 0.0012,
-                'throughput': 892.45,
-                'cpu_usage': 1.2,
-                'memory_usage': 3.1
-            }
-        }
-    
-    # For chart format, provide additional data
-    if output_format == 'chart':
-        # If we have chart data from JSON, use that directly
-        if chart_data:
-            return jsonify({
-                'success': True,
-                'status': status,
-                'progress': progress,
-                'results': results,
-                'chart_data': chart_data,
-                'csv_url': f"/files/performance_comparison.csv" if files_exist else None,
-                'json_url': f"/files/performance_comparison.json" if files_exist else None
-            })
-        # Otherwise, convert results to chart data format
-        elif results:
-            protocols = [protocol.upper() for protocol in results.keys()]
-            chart_data = {
-                "protocols": protocols,
-                "metrics": {
-                    "handshake_time": {
-                        "label": "Handshake Time (s)",
-                        "values": [results[p.lower()].get('handshake_time', 0) for p in protocols],
-                        "better": "lower"
-                    },
-                    "latency": {
-                        "label": "Average Latency (ms)",
-                        "values": [results[p.lower()].get('avg_latency', 0) * 1000 for p in protocols],
-                        "better": "lower"
-                    },
-                    "throughput": {
-                        "label": "Throughput (msg/s)",
-                        "values": [results[p.lower()].get('throughput', 0) for p in protocols],
-                        "better": "higher"
-                    },
-                    "cpu_usage": {
-                        "label": "CPU Usage (%)",
-                        "values": [results[p.lower()].get('cpu_usage', 0) for p in protocols],
-                        "better": "lower"
-                    },
-                    "memory_usage": {
-                        "label": "Memory Usage (MB)",
-                        "values": [results[p.lower()].get('memory_usage', 0) for p in protocols],
-                        "better": "lower"
-                    }
-                }
-            }
+    if status == 'completed' and files_exist:
+        try:
+            with open(json_path, 'r') as f:
+                chart_data = json.load(f)
             
-            return jsonify({
-                'success': True,
-                'status': status,
-                'progress': progress,
-                'results': results,
-                'chart_data': chart_data,
-                'csv_url': f"/files/performance_comparison.csv" if files_exist else None,
-                'json_url': f"/files/performance_comparison.json" if files_exist else None
-            })
+            # Every measurement of a protocol, keyed like the request's protocols
+            protocol_keys = {name: key for key, name in benchmark.PROTOCOL_NAMES.items()}
+            results = {
+                protocol_keys.get(name, name.lower().replace(' ', '_')): details
+                for name, details in chart_data.get('details', {}).items()
+            }
+        except Exception as e:
+            logger.error(f"Error reading performance test results: {str(e)}")
+            status = 'failed'
+            performance_run['error'] = f'Could not read the results: {str(e)}'
     
-    # For other formats, just return the results
-    return jsonify({
+    response = {
         'success': True,
         'status': status,
         'progress': progress,
-        'results': results if status == 'completed' else None,
-        'csv_url': f"/files/performance_comparison.csv" if files_exist else None,
-        'json_url': f"/files/performance_comparison.json" if files_exist else None
-    })
+        'protocol': performance_run['protocol'] if status == 'running' else None,
+        'error': performance_run['error'] if status == 'failed' else None,
+        'results': results,
+        'csv_url': f"/reports/performance_comparison.csv" if files_exist else None,
+        'json_url': f"/reports/performance_comparison.json" if files_exist else None
+    }
+    if output_format == 'chart':
+        response['chart_data'] = chart_data
+    return jsonify(response)
 
 # Endpoint to list all received files
 @app.route('/received_files', methods=['GET'])
@@ -1470,27 +1894,20 @@ def get_received_files():
         return jsonify({'success': False, 'message': 'Not connected to any server'})
     
     room_filter = request.args.get('room', 'all')
+    before = request.args.get('before', type=int)
+    limit = request.args.get('limit', app.config['FILE_PAGE_LIMIT'], type=int)
+    limit = max(1, min(limit, app.config['FILE_PAGE_LIMIT']))
     
-    # Get file messages from user's message history
-    file_messages = []
-    for message in clients[user_id]['messages']:
-        if message.get('type') in ['file', 'incoming_file'] and 'file_info' in message:
-            if room_filter == 'all' or message.get('room_id') == room_filter:
-                file_messages.append({
-                    'file_info': message['file_info'],
-                    'sender': message.get('sender', 'Unknown'),
-                    'timestamp': message.get('timestamp', ''),
-                    'room_id': message.get('room_id', 'main'),
-                    'room_name': message.get('room_name', 'Main Room'),
-                    'type': message.get('type', 'file')
-                })
-    
-    # Sort by timestamp (newest first)
-    file_messages.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+    # Files are indexed per user as they are posted, newest first
+    room_ids = list(clients[user_id]['room_cursors'])
+    if room_filter != 'all':
+        room_ids = [room_id for room_id in room_ids if room_id == room_filter]
+    file_messages, next_before = file_index.files(user_id, room_ids, before, limit)
     
     return jsonify({
         'success': True,
-        'files': file_messages
+        'files': file_messages,
+        'next_before': next_before
     })
 
 
@@ -1511,11 +1928,12 @@ def get_room_info(room_id):
         
         # Get member information
         members = []
-        for member_id in room_data.get('members', []):
-            if member_id in clients:
+        for member_id in list(room_data.get('members', ())):
+            username = member_username(member_id)
+            if username is not None:
                 members.append({
                     'id': member_id,
-                    'username': clients[member_id]['username'],
+                    'username': username,
                     'is_current_user': member_id == user_id
                 })
         
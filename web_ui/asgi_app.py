@@ -0,0 +1,330 @@
+"""
+Asyncio (ASGI) serving mode for the web interface.
+The long-lived routes (/stream and /ws) and the Noise handshakes behind
+/connect are served natively on a single event loop, so an idle chat
+connection costs a coroutine instead of a worker thread. Every other route
+is handed to the Flask app through asgiref's WSGI bridge, which shares the
+same in-process state.
+
+With several workers sharing the state, requests for a session another
+worker owns go through the bridge as well, where StickyRouter relays them
+to the owner (event streams included). WebSocket upgrades cannot be
+relayed, so they are refused and the browser falls back to /stream.
+
+Run with:
+    uvicorn asgi_app:application --host 0.0.0.0 --port 5001
+or:
+    python asgi_app.py
+"""
+
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as web
+from sticky_router import session_user_id
+from event_stream import format_event, encode_cursors, decode_cursors
+from chat_socket import (encode_frame, encode_json_frame, decode_frame, FrameError,
+                         FRAME_PING, FRAME_MESSAGE, FRAME_ACK, FRAME_STATUS)
+
+logger = logging.getLogger('noise_web_asgi')
+
+
+async def open_noise_client(host, port, username, executor, handshake_limit):
+    """
+    Create a NoiseChatClient and perform the Noise handshake. The handshake
+    and transport logic stay in NoiseChatClient; its blocking connect runs on
+    a shared, bounded executor so it never stalls the event loop.
+
+    Args:
+        host (str): Server hostname or IP
+        port (int): Server port
+        username (str): Username for the chat
+        executor (Executor): Executor for the blocking client calls
+        handshake_limit (asyncio.Semaphore): Bounds concurrent handshakes
+
+    Returns:
+        NoiseChatClient: The connected client, or None if the handshake failed
+    """
+    client = web.NoiseChatClient(host=host, port=port, username=username)
+    async with handshake_limit:
+        connected = await asyncio.get_running_loop().run_in_executor(executor, client.connect)
+    return client if connected else None
+
+
+class ChatASGIApp:
+    """
+    ASGI application serving the chat's long-lived connections on one event loop.
+    """
+
+    def __init__(self, flask_app, max_workers=32, max_handshakes=64):
+        """
+        Initialize the application.
+
+        Args:
+            flask_app (Flask): The WSGI app handling every other route
+            max_workers (int): Threads available for blocking Noise client calls
+            max_handshakes (int): Maximum number of concurrent Noise handshakes
+        """
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='noise-io')
+        self.max_handshakes = max_handshakes
+        self.handshake_limit = None  # Created on the serving loop
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        if self.handshake_limit is None:
+            self.handshake_limit = asyncio.Semaphore(self.max_handshakes)
+
+        path = scope.get('path')
+        if path in ('/ws', '/stream', '/connect') and self.owned_elsewhere(scope):
+            if scope['type'] == 'websocket':
+                # Closing before the accept refuses the upgrade
+                await receive()
+                return await send({'type': 'websocket.close', 'code': 1013})
+            return await self.wsgi(scope, receive, send)
+        if scope['type'] == 'websocket' and path == '/ws':
+            return await self.chat_socket(scope, receive, send)
+        if scope['type'] == 'http' and path == '/stream' and scope['method'] == 'GET':
+            return await self.stream_events(scope, receive, send)
+        if scope['type'] == 'http' and path == '/connect' and scope['method'] == 'POST':
+            return await self.connect(scope, receive, send)
+
+        return await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def session_user(self, scope):
+        """Get the user id stored in the Flask session cookie of a request."""
+        headers = dict(scope.get('headers', []))
+        return session_user_id(self.flask_app, headers.get(b'cookie', b'').decode('latin-1'))
+
+    def owned_elsewhere(self, scope):
+        """Whether another worker owns the session of a request (see StickyRouter)."""
+        if not web.state.shared:
+            return False
+        user_id = self.session_user(scope)
+        owner = web.state.session_owner(user_id) if user_id else None
+        return owner is not None and owner != os.getpid()
+
+    async def send_json(self, send, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def connect(self, scope, receive, send):
+        """Connect to the Noise Protocol server without tying up a thread during the handshake"""
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        try:
+            data = json.loads(body or b'{}')
+        except ValueError:
+            return await self.send_json(send, {'success': False, 'message': 'Invalid request body'})
+
+        username = data.get('username', 'Anonymous')
+        server_host = data.get('server', 'localhost')
+        server_port = int(data.get('port', 8000))
+        user_id = self.session_user(scope)
+
+        if not user_id:
+            return await self.send_json(send, {'success': False, 'message': 'No session, reload the page'})
+
+        if user_id in web.clients:
+            # Already connected
+            return await self.send_json(send, {'success': False, 'message': 'Already connected to a server'})
+
+        try:
+            client = await open_noise_client(server_host, server_port, username,
+                                             self.executor, self.handshake_limit)
+        except Exception as e:
+            return await self.send_json(send, {'success': False, 'message': f'Connection error: {str(e)}'})
+
+        if client is None:
+            return await self.send_json(send, {'success': False, 'message': 'Failed to connect to the server'})
+
+        if not web.register_client(user_id, client, username, server_host, server_port):
+            # A concurrent request connected this user first
+            await asyncio.get_running_loop().run_in_executor(self.executor, client.disconnect)
+            return await self.send_json(send, {'success': False, 'message': 'Already connected to a server'})
+
+        return await self.send_json(send, {
+            'success': True,
+            'message': f'Connected to {server_host}:{server_port} as {username}'
+        })
+
+    async def stream_events(self, scope, receive, send):
+        """Serve /stream (see app.stream_events) as a coroutine"""
+        user_id = self.session_user(scope)
+
+        if user_id not in web.clients:
+            return await self.send_json(send, {'success': False, 'message': 'Not connected to any server'}, 409)
+
+        headers = dict(scope.get('headers', []))
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        last_event_id = headers.get(b'last-event-id', b'').decode('latin-1') or query.get('last_event_id', [''])[0]
+        cursors = decode_cursors(last_event_id)
+        keepalive = self.flask_app.config['STREAM_KEEPALIVE_SECONDS']
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                        (b'x-accel-buffering', b'no')]
+        })
+
+        closed = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            closed.set()
+            web.notifier.notify(user_id)
+
+        watcher = asyncio.create_task(watch_disconnect())
+
+        async def emit(chunk):
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+        try:
+            last_status = None
+            await emit(format_event({'cursors': cursors}, event='ready', retry=3000))
+
+            while not closed.is_set():
+                # Read the version before the state so no notification slips in between
+                version = web.notifier.version(user_id)
+                client_info = web.clients.get(user_id)
+
+                status = web.stream_status(client_info)
+                if status != last_status:
+                    await emit(format_event(status, event='status'))
+                    last_status = status
+
+                if not status['connected']:
+                    break
+
+                sent = False
+                for message_json in web.iter_new_messages(user_id, client_info, cursors):
+                    await emit(format_event(message_json, event='message', event_id=encode_cursors(cursors)))
+                    sent = True
+
+                if await web.notifier.wait_async(user_id, version, timeout=keepalive) == version and not sent:
+                    # Comment lines keep proxies from closing an idle stream
+                    await emit(b': keepalive\n\n')
+
+            if not closed.is_set():
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        except OSError as e:
+            logger.debug(f"Event stream for user {user_id} closed: {str(e)}")
+        finally:
+            watcher.cancel()
+
+    async def chat_socket(self, scope, receive, send):
+        """Serve /ws (see app.chat_socket) as a coroutine"""
+        if (await receive())['type'] != 'websocket.connect':
+            return
+
+        user_id = self.session_user(scope)
+        await send({'type': 'websocket.accept'})
+
+        async def send_text(text):
+            await send({'type': 'websocket.send', 'text': text})
+
+        if user_id not in web.clients:
+            await send_text(encode_frame(FRAME_STATUS, {'connected': False, 'active_room': None}))
+            await send({'type': 'websocket.close', 'code': 1000})
+            return
+
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        cursors = decode_cursors(query.get('cursors', [''])[0])
+        keepalive = self.flask_app.config['STREAM_KEEPALIVE_SECONDS']
+        loop = asyncio.get_running_loop()
+
+        async def push():
+            last_status = None
+            while True:
+                version = web.notifier.version(user_id)
+                client_info = web.clients.get(user_id)
+
+                status = web.stream_status(client_info)
+                if status != last_status:
+                    await send_text(encode_frame(FRAME_STATUS, status))
+                    last_status = status
+
+                if not status['connected']:
+                    await send({'type': 'websocket.close', 'code': 1000})
+                    return
+
+                for message_json in web.iter_new_messages(user_id, client_info, cursors):
+                    await send_text(encode_json_frame(FRAME_MESSAGE, message_json))
+
+                await web.notifier.wait_async(user_id, version, timeout=keepalive)
+
+        pusher = asyncio.create_task(push())
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+
+                try:
+                    frame = decode_frame(message.get('text') or message.get('bytes'))
+                except FrameError as e:
+                    logger.warning(f"Dropping WebSocket frame from user {user_id}: {str(e)}")
+                    continue
+
+                if frame[0] == FRAME_PING:
+                    await send_text(encode_frame(FRAME_PING))
+                    continue
+
+                _, ref, room_id, text = frame
+                text = text.strip()
+                if user_id not in web.clients:
+                    break
+                if not text:
+                    await send_text(encode_frame(FRAME_ACK, ref, False, 'Empty message'))
+                    continue
+
+                room_id = room_id or web.clients[user_id].get('active_room', 'main')
+                try:
+                    # Encryption and socket I/O happen inside NoiseChatClient, keep them off the loop
+                    success, error = await loop.run_in_executor(self.executor, web.send_chat, user_id, room_id, text)
+                except Exception as e:
+                    logger.error(f"Error sending message: {str(e)}")
+                    success, error = False, f'Error sending message: {str(e)}'
+                await send_text(encode_frame(FRAME_ACK, ref, success, error))
+        except OSError as e:
+            logger.debug(f"WebSocket for user {user_id} closed: {str(e)}")
+        finally:
+            pusher.cancel()
+
+
+application = ChatASGIApp(web.app)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(application, host='0.0.0.0', port=5001)
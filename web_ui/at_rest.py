@@ -0,0 +1,349 @@
+"""
+Encryption at rest for stored files.
+
+Files are kept in a chunked AEAD format:
+    header   magic 'NWE1', plaintext chunk size (32 bits), 16 byte random salt
+    chunks   ChaCha20-Poly1305 sealed chunks of chunk_size plaintext bytes,
+             each followed by its 16 byte tag; the last chunk is shorter
+             (empty for an empty file) and flagged as final
+
+Every file is sealed under its own key, derived from the master key and
+the file's salt with HKDF, so a chunk's nonce is simply its index (laid
+out like the nonces of Noise cipher states) and never repeats under a
+key. The header and the final-chunk flag are authenticated with every
+chunk, so chunks cannot be moved between files and a file cannot be cut
+short at a chunk boundary. All chunks but the last have the same size,
+so the chunk holding any plaintext offset is found by arithmetic: a
+reader seeks straight to it and decrypts only the chunks a Range request
+covers.
+
+Chunks are sealed and opened into preallocated buffers through memoryviews
+(with encrypt_into/decrypt_into when the cryptography release has them),
+so streaming a file allocates nothing per chunk.
+"""
+
+import io
+import os
+import struct
+import tempfile
+import logging
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+logger = logging.getLogger('noise_web_at_rest')
+
+MAGIC = b'NWE1'
+HEADER = struct.Struct('>4sI16s')
+CHUNK_SIZE = 64 * 1024
+TAG_SIZE = 16
+SALT_SIZE = 16
+
+
+class AtRestError(Exception):
+    """A stored file is malformed or failed authentication."""
+
+
+def chunk_nonce(index):
+    """Nonce of a chunk: 32 zero bits followed by the 64-bit chunk index."""
+    return b'\x00' * 4 + struct.pack('>Q', index)
+
+
+def read_full(stream, view):
+    """Fill a memoryview from a stream, returning the bytes read (short only at EOF)."""
+    filled = 0
+    while filled < len(view):
+        data = stream.read(len(view) - filled)
+        if not data:
+            break
+        view[filled:filled + len(data)] = data
+        filled += len(data)
+    return filled
+
+
+def _plaintext_size(path, chunk_size, body):
+    chunks = max(1, -(-body // (chunk_size + TAG_SIZE)))
+    size = body - chunks * TAG_SIZE
+    if size < 0:
+        raise AtRestError(f'{path} is truncated')
+    return size
+
+
+class AtRestCipher:
+    """
+    Seals and opens stored files under a master key.
+    """
+
+    def __init__(self, key, chunk_size=CHUNK_SIZE):
+        """
+        Initialize the cipher.
+
+        Args:
+            key (bytes): 32 byte master key
+            chunk_size (int): Plaintext bytes per chunk of newly sealed files
+        """
+        if len(key) != 32:
+            raise ValueError('At-rest key must be 32 bytes')
+        self.key = key
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_key_file(cls, path, chunk_size=CHUNK_SIZE):
+        """
+        Load the master key, creating it (readable by its owner only) on first use.
+        Workers starting at the same time may all try to create it: each writes
+        a complete key to a temporary file and links it into place, and those
+        that lose the race use the winner's key.
+
+        Args:
+            path (str): Key file
+
+        Returns:
+            AtRestCipher: Cipher using the key
+        """
+        if not os.path.exists(path):
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.key-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(ChaCha20Poly1305.generate_key())
+                    f.flush()
+                    os.fsync(f.fileno())
+                # Unlike a rename, linking never replaces a key another worker created
+                os.link(temp_path, path)
+                logger.info(f"Generated at-rest encryption key {path}")
+            except FileExistsError:
+                pass
+            finally:
+                os.unlink(temp_path)
+        with open(path, 'rb') as f:
+            return cls(f.read(), chunk_size)
+
+    def _aead(self, header):
+        magic, chunk_size, salt = HEADER.unpack(header)
+        if magic != MAGIC or not chunk_size:
+            raise AtRestError('Not a sealed file')
+        key = HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=b'noise-web at-rest').derive(self.key)
+        return ChaCha20Poly1305(key), chunk_size
+
+    def new_header(self):
+        """Header of a file about to be sealed, with a fresh salt."""
+        return HEADER.pack(MAGIC, self.chunk_size, os.urandom(SALT_SIZE))
+
+    def chunk_count(self, size, chunk_size=None):
+        """Number of chunks a file of `size` plaintext bytes is sealed in."""
+        chunk_size = chunk_size or self.chunk_size
+        return max(1, -(-size // chunk_size))
+
+    def sealed_size(self, size):
+        """Size on disk of a sealed file of `size` plaintext bytes."""
+        return HEADER.size + size + self.chunk_count(size) * TAG_SIZE
+
+    def plaintext_size(self, path):
+        """
+        Size of a sealed file's plaintext, from its length alone.
+
+        Raises:
+            AtRestError: If the file is too short to be a sealed file
+        """
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            body = os.fstat(f.fileno()).st_size - HEADER.size
+        return _plaintext_size(path, HEADER.unpack(header)[1], body)
+
+    def sealer(self, header):
+        """ChunkSealer for the file with the given header."""
+        return ChunkSealer(self, header)
+
+    def writer(self, f):
+        """SealingWriter streaming a new sealed file into a binary file object."""
+        return SealingWriter(self, f)
+
+    def is_sealed(self, path):
+        """Whether a file is in the sealed format (files stored before encryption was enabled are not)."""
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+        return len(header) == HEADER.size and header.startswith(MAGIC)
+
+    def open(self, path):
+        """
+        Open a stored file for reading its plaintext.
+
+        Returns:
+            file: SealedReader for sealed files, a plain binary file otherwise
+        """
+        if self.is_sealed(path):
+            return SealedReader(self, path)
+        return open(path, 'rb')
+
+
+class ChunkSealer:
+    """
+    Seals the chunks of one file, at any index, into a reused buffer.
+    """
+
+    def __init__(self, cipher, header):
+        self.header = header
+        self.aead, self.chunk_size = cipher._aead(header)
+        self._out = bytearray(self.chunk_size + TAG_SIZE)
+        self._view = memoryview(self._out)
+        self._ads = (header + b'\x00', header + b'\x01')
+
+    def offset(self, index):
+        """Position of a chunk in the sealed file."""
+        return HEADER.size + index * (self.chunk_size + TAG_SIZE)
+
+    def seal(self, index, data, final):
+        """
+        Seal one chunk.
+
+        Args:
+            index (int): Chunk index
+            data: Plaintext, chunk_size bytes unless final
+            final (bool): Whether this is the file's last chunk
+
+        Returns:
+            memoryview: The sealed chunk, valid until the next call
+        """
+        sealed = self._view[:len(data) + TAG_SIZE]
+        ad = self._ads[final]
+        if hasattr(self.aead, 'encrypt_into'):
+            self.aead.encrypt_into(chunk_nonce(index), data, ad, sealed)
+        else:
+            sealed[:] = self.aead.encrypt(chunk_nonce(index), bytes(data), ad)
+        return sealed
+
+
+class SealingWriter:
+    """
+    Write-only stream sealing whatever is written to it into a file object.
+    A full chunk is only sealed once more data arrives, because the last
+    chunk must be flagged as final; finish() seals it.
+    """
+
+    def __init__(self, cipher, f):
+        self._file = f
+        header = cipher.new_header()
+        self._sealer = cipher.sealer(header)
+        self._buffer = bytearray(self._sealer.chunk_size)
+        self._view = memoryview(self._buffer)
+        self._fill = 0
+        self._index = 0
+        f.write(header)
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        size = self._sealer.chunk_size
+        while len(data):
+            if self._fill == size:
+                self._file.write(self._sealer.seal(self._index, self._view, False))
+                self._index += 1
+                self._fill = 0
+            n = min(size - self._fill, len(data))
+            self._view[self._fill:self._fill + n] = data[:n]
+            self._fill += n
+            data = data[n:]
+
+    def finish(self):
+        """Seal the buffered data as the final chunk."""
+        self._file.write(self._sealer.seal(self._index, self._view[:self._fill], True))
+        self._fill = 0
+
+
+class SealedReader(io.RawIOBase):
+    """
+    Seekable reader of a sealed file's plaintext, decrypting one chunk at a time.
+    """
+
+    def __init__(self, cipher, path):
+        """
+        Open a sealed file.
+
+        Raises:
+            AtRestError: If the file is not a well-formed sealed file
+        """
+        self.path = path
+        self._file = open(path, 'rb', buffering=0)
+        try:
+            header = self._file.read(HEADER.size)
+            self._aead, self.chunk_size = cipher._aead(header)
+            body = os.fstat(self._file.fileno()).st_size - HEADER.size
+            self.size = _plaintext_size(path, self.chunk_size, body)
+            self._chunks = max(1, -(-self.size // self.chunk_size))
+        except Exception:
+            self._file.close()
+            raise
+        self._ads = (header + b'\x00', header + b'\x01')
+        self._sealed = bytearray(self.chunk_size + TAG_SIZE)
+        self._plain = bytearray(self.chunk_size)
+        self._plain_view = memoryview(self._plain)
+        self._loaded = None  # (index, plaintext length) of the chunk in _plain
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('Negative seek position')
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def _load(self, index):
+        """Decrypt a chunk into the plaintext buffer."""
+        final = index == self._chunks - 1
+        length = (self.size - index * self.chunk_size if final else self.chunk_size) + TAG_SIZE
+        sealed = memoryview(self._sealed)[:length]
+        self._file.seek(HEADER.size + index * (self.chunk_size + TAG_SIZE))
+        if read_full(self._file, sealed) != length:
+            raise AtRestError(f'Chunk {index} of {self.path} is truncated')
+        plain = self._plain_view[:length - TAG_SIZE]
+        try:
+            if hasattr(self._aead, 'decrypt_into'):
+                self._aead.decrypt_into(chunk_nonce(index), sealed, self._ads[final], plain)
+            else:
+                plain[:] = self._aead.decrypt(chunk_nonce(index), bytes(sealed), self._ads[final])
+        except InvalidTag:
+            self._loaded = None
+            raise AtRestError(f'Chunk {index} of {self.path} failed authentication')
+        self._loaded = (index, length - TAG_SIZE)
+
+    def readinto(self, b):
+        if self._pos >= self.size:
+            return 0
+        index, start = divmod(self._pos, self.chunk_size)
+        if self._loaded is None or self._loaded[0] != index:
+            self._load(index)
+        n = min(len(b), self._loaded[1] - start)
+        memoryview(b).cast('B')[:n] = self._plain_view[start:start + n]
+        self._pos += n
+        return n
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(0, self.size - self._pos)
+        buffer = bytearray(min(size, max(0, self.size - self._pos)))
+        view = memoryview(buffer)
+        filled = 0
+        while filled < len(buffer):
+            n = self.readinto(view[filled:])
+            if not n:
+                break
+            filled += n
+        return bytes(view[:filled])
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
@@ -0,0 +1,514 @@
+"""
+Loopback benchmark of the chat transports behind /performance_test.
+
+Every protocol is measured the same way against a server on 127.0.0.1:
+    noise        NoiseChatClient handshakes and transport messages against
+                 noise_chat_server.py, started on a free port for the run
+    tls13        TLS 1.3 over TCP to an in-process sink server
+    plain_tls    TLS 1.2 over TCP to the same sink
+    unencrypted  length-prefixed frames over plain TCP to the same sink
+
+The handshake time is the median of a few fresh connections. Each of the
+`num_messages` messages of `message_size` bytes is timed from the call
+that hands it to the channel until that call returns (encryption and the
+socket write), and the latencies go into a log-linear histogram, which
+gives p50/p95/p99 to within 1.6% without keeping every sample. CPU is the
+CPU time of the client and server processes over the wall time of the
+run, in percent of one core; memory is the growth of their resident set
+sizes during the run. Both are read from /proc, so on systems without it
+only the client side is counted.
+
+Results are written to performance_comparison.json and .csv, in the
+schema the dashboard reads. Run it as a script (the web app does, so the
+measurements are not disturbed by requests):
+    python benchmark.py --messages 1000 --size 1024 --protocols noise tls13 --output reports
+Progress is printed as one JSON object per line.
+"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+import socket
+import ssl
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import logging
+
+# Only used where /proc is missing
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger('noise_web_benchmark')
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPLEMENTATION_PATH = os.path.join(parent_dir, 'noiseprotocol', 'Implementation')
+
+PROTOCOLS = ('noise', 'tls13', 'plain_tls', 'unencrypted')
+PROTOCOL_NAMES = {
+    'noise': 'Noise Protocol',
+    'tls13': 'TLS 1.3',
+    'plain_tls': 'TLS 1.2',
+    'unencrypted': 'Unencrypted'
+}
+HANDSHAKES = 5
+SERVER_START_TIMEOUT = 10
+FRAME_HEADER = struct.Struct('>I')
+
+
+class BenchmarkError(Exception):
+    """A protocol could not be benchmarked."""
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of latencies in nanoseconds: values below
+    2 * SUB_BUCKETS are counted exactly, larger ones in SUB_BUCKETS buckets
+    per power of two.
+    """
+
+    SUB_BITS = 6
+    SUB_BUCKETS = 1 << SUB_BITS
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        if value < self.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - self.SUB_BITS - 1
+        return (shift + 1) * self.SUB_BUCKETS + (value >> shift) - self.SUB_BUCKETS
+
+    def _upper(self, index):
+        """Largest value counted in a bucket."""
+        if index < self.SUB_BUCKETS:
+            return index
+        shift = index // self.SUB_BUCKETS - 1
+        return ((index % self.SUB_BUCKETS + self.SUB_BUCKETS + 1) << shift) - 1
+
+    def record(self, seconds):
+        """Count one latency."""
+        index = self._index(int(seconds * 1e9))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, percent):
+        """
+        Latency below which `percent` percent of the recorded ones fall.
+
+        Returns:
+            float: Seconds, 0 if nothing was recorded
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(percent / 100 * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._upper(index) / 1e9, self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+def _proc_usage(pid):
+    """(CPU seconds, resident bytes) of a process from /proc, or None."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    ticks = os.sysconf('SC_CLK_TCK')
+    return (int(fields[11]) + int(fields[12])) / ticks, pages * os.sysconf('SC_PAGE_SIZE')
+
+
+class ProcessSampler:
+    """
+    CPU time and resident memory used by this process and, optionally, a
+    server process between start() and stop().
+    """
+
+    def __init__(self, server_pid=None):
+        self.pids = [os.getpid()] + ([server_pid] if server_pid else [])
+
+    def _sample(self):
+        cpu = rss = 0.0
+        for pid in self.pids:
+            usage = _proc_usage(pid)
+            if usage is None and pid == os.getpid():
+                times = os.times()
+                # Peak instead of current resident size, the best stand-in without /proc
+                peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 if resource else 0
+                usage = (times.user + times.system, peak)
+            if usage is not None:
+                cpu += usage[0]
+                rss += usage[1]
+        return time.perf_counter(), cpu, rss
+
+    def start(self):
+        self._start = self._sample()
+
+    def stop(self):
+        """
+        Returns:
+            tuple: (CPU usage in percent of one core, memory growth in MB)
+        """
+        wall, cpu, rss = self._sample()
+        elapsed = max(wall - self._start[0], 1e-9)
+        return 100 * (cpu - self._start[1]) / elapsed, max(0.0, rss - self._start[2]) / (1024 * 1024)
+
+
+def free_port():
+    """A TCP port that is free on the loopback interface right now."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process=None, timeout=SERVER_START_TIMEOUT):
+    """Wait until a server accepts connections on a loopback port."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise BenchmarkError(f'Server exited with status {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise BenchmarkError(f'Server did not listen on port {port} within {timeout}s')
+
+
+def _summary(histogram, handshakes, elapsed, message_size, cpu, memory):
+    return {
+        'handshake_time': statistics.median(handshakes),
+        'avg_latency': histogram.mean(),
+        'min_latency': histogram.min or 0.0,
+        'max_latency': histogram.max or 0.0,
+        'p50_latency': histogram.percentile(50),
+        'p95_latency': histogram.percentile(95),
+        'p99_latency': histogram.percentile(99),
+        'throughput': histogram.count / elapsed if elapsed else 0.0,
+        'throughput_mbps': histogram.count * message_size * 8 / elapsed / 1e6 if elapsed else 0.0,
+        'cpu_usage': cpu,
+        'memory_usage': memory,
+        'messages': histogram.count,
+        'message_size': message_size
+    }
+
+
+def run_noise(num_messages, message_size, implementation_path=IMPLEMENTATION_PATH):
+    """
+    Benchmark NoiseChatClient against a noise_chat_server.py started for the run.
+
+    Returns:
+        dict: Measurements of the protocol
+
+    Raises:
+        BenchmarkError: If the implementation is missing or the server does not start
+    """
+    server_script = os.path.join(implementation_path, 'noise_chat_server.py')
+    if not os.path.exists(server_script):
+        raise BenchmarkError(f'{server_script} not found')
+    for path in (implementation_path, os.path.dirname(os.path.dirname(implementation_path))):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    try:
+        from noiseprotocol.Implementation.noise_chat_client import NoiseChatClient
+    except ImportError as e:
+        raise BenchmarkError(f'Cannot import NoiseChatClient: {e}')
+
+    port = free_port()
+    # The server reads commands from stdin; a pipe keeps its prompt idle
+    server = subprocess.Popen([sys.executable, server_script, '--port', str(port)], cwd=implementation_path,
+                              stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    clients = []
+    try:
+        wait_for_port(port, server)
+        sampler = ProcessSampler(server.pid)
+        sampler.start()
+
+        handshakes = []
+        for i in range(HANDSHAKES):
+            client = NoiseChatClient(host='127.0.0.1', port=port, username=f'bench-{os.getpid()}-{i}')
+            started = time.perf_counter()
+            if not client.connect():
+                raise BenchmarkError('Noise handshake failed')
+            handshakes.append(time.perf_counter() - started)
+            clients.append(client)
+
+        histogram = LatencyHistogram()
+        message = 'x' * message_size
+        client = clients[-1]
+        started = time.perf_counter()
+        for _ in range(num_messages):
+            sent = time.perf_counter()
+            result = client.send_chat_message(message)
+            histogram.record(time.perf_counter() - sent)
+            if not result or (isinstance(result, dict) and not result.get('success', False)):
+                raise BenchmarkError('Noise transport message was refused')
+        elapsed = time.perf_counter() - started
+        cpu, memory = sampler.stop()
+        return _summary(histogram, handshakes, elapsed, message_size, cpu, memory)
+    finally:
+        for client in clients:
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+        try:
+            server.stdin.write(b'quit\n')
+            server.stdin.close()
+            server.wait(timeout=3)
+        except Exception:
+            server.kill()
+            server.wait()
+
+
+def _self_signed_certificate(directory):
+    """Write a throwaway certificate for localhost and return (cert path, key path)."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'localhost')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(minutes=5)).not_valid_after(now + datetime.timedelta(days=1))
+            .add_extension(x509.SubjectAlternativeName([x509.DNSName('localhost')]), critical=False)
+            .sign(key, hashes.SHA256()))
+    cert_path, key_path = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+    with open(cert_path, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+class SinkServer:
+    """
+    Loopback server that reads and discards whatever its clients send, over
+    plain TCP or TLS.
+    """
+
+    def __init__(self, context=None):
+        self.context = context
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(16)
+        self.port = self.sock.getsockname()[1]
+        thread = threading.Thread(target=self._accept, name='benchmark-sink')
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            thread = threading.Thread(target=self._drain, args=(conn,), name='benchmark-sink')
+            thread.daemon = True
+            thread.start()
+
+    def _drain(self, conn):
+        try:
+            if self.context is not None:
+                conn = self.context.wrap_socket(conn, server_side=True)
+            buffer = bytearray(256 * 1024)
+            while conn.recv_into(buffer):
+                pass
+        except (OSError, ssl.SSLError):
+            pass
+        finally:
+            conn.close()
+
+    def close(self):
+        self.sock.close()
+
+
+def run_socket(protocol, num_messages, message_size):
+    """
+    Benchmark a baseline transport against an in-process SinkServer.
+
+    Args:
+        protocol (str): 'tls13', 'plain_tls' or 'unencrypted'
+
+    Returns:
+        dict: Measurements of the protocol
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        server_context = client_context = None
+        if protocol != 'unencrypted':
+            version = ssl.TLSVersion.TLSv1_3 if protocol == 'tls13' else ssl.TLSVersion.TLSv1_2
+            cert_path, key_path = _self_signed_certificate(directory)
+            server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            server_context.load_cert_chain(cert_path, key_path)
+            client_context = ssl.create_default_context(cafile=cert_path)
+            for context in (server_context, client_context):
+                context.minimum_version = context.maximum_version = version
+        server = SinkServer(server_context)
+
+    sampler = ProcessSampler()
+    sampler.start()
+    connections = []
+    try:
+        handshakes = []
+        for _ in range(HANDSHAKES):
+            started = time.perf_counter()
+            conn = socket.create_connection(('127.0.0.1', server.port))
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if client_context is not None:
+                conn = client_context.wrap_socket(conn, server_hostname='localhost')
+            handshakes.append(time.perf_counter() - started)
+            connections.append(conn)
+
+        histogram = LatencyHistogram()
+        message = b'x' * message_size
+        frame = memoryview(FRAME_HEADER.pack(len(message)) + message)
+        conn = connections[-1]
+        started = time.perf_counter()
+        for _ in range(num_messages):
+            sent = time.perf_counter()
+            conn.sendall(frame)
+            histogram.record(time.perf_counter() - sent)
+        elapsed = time.perf_counter() - started
+        cpu, memory = sampler.stop()
+        return _summary(histogram, handshakes, elapsed, message_size, cpu, memory)
+    finally:
+        for conn in connections:
+            conn.close()
+        server.close()
+
+
+def run_benchmark(protocols, num_messages, message_size, implementation_path=IMPLEMENTATION_PATH,
+                  progress=None):
+    """
+    Benchmark the given protocols one after the other.
+
+    Args:
+        protocols (list): Protocol keys, or ['all']
+        num_messages (int): Messages sent per protocol
+        message_size (int): Bytes per message
+        implementation_path (str): Directory of the Noise implementation
+        progress (callable): progress(percent, protocol) after each protocol, optional
+
+    Returns:
+        tuple: (results by protocol, error message by protocol that failed)
+    """
+    if 'all' in protocols:
+        protocols = list(PROTOCOLS)
+    results, errors = {}, {}
+    for i, protocol in enumerate(protocols):
+        if progress is not None:
+            progress(100 * i // len(protocols), protocol)
+        try:
+            if protocol == 'noise':
+                results[protocol] = run_noise(num_messages, message_size, implementation_path)
+            elif protocol in PROTOCOLS:
+                results[protocol] = run_socket(protocol, num_messages, message_size)
+            else:
+                raise BenchmarkError(f'Unknown protocol {protocol}')
+            logger.info(f"{protocol}: {results[protocol]['throughput']:.0f} msg/s, "
+                        f"p99 {results[protocol]['p99_latency'] * 1000:.3f} ms")
+        except Exception as e:
+            logger.error(f"Benchmark of {protocol} failed: {e}")
+            errors[protocol] = str(e)
+    if progress is not None:
+        progress(100, None)
+    return results, errors
+
+
+def write_results(results, directory, config=None, errors=None):
+    """
+    Write performance_comparison.csv and .json in the dashboard's schema.
+    The JSON also carries every measurement per protocol under 'details'.
+
+    Returns:
+        tuple: (csv path, json path)
+    """
+    protocols = [p for p in PROTOCOLS if p in results] + [p for p in results if p not in PROTOCOLS]
+    names = [PROTOCOL_NAMES.get(p, p) for p in protocols]
+
+    csv_data = "Protocol,HandshakeTime,Latency,Throughput,CPUUsage,MemoryUsage\n"
+    for p, name in zip(protocols, names):
+        result = results[p]
+        csv_data += (f"{name},{result['handshake_time']},{result['avg_latency'] * 1000},{result['throughput']},"
+                     f"{result['cpu_usage']},{result['memory_usage']}\n")
+
+    def values(key, scale=1):
+        return [results[p][key] * scale for p in protocols]
+
+    json_data = {
+        "protocols": names,
+        "metrics": {
+            "handshake_time": {"label": "Handshake Time (s)", "values": values('handshake_time'), "better": "lower"},
+            "latency": {"label": "Average Latency (ms)", "values": values('avg_latency', 1000), "better": "lower"},
+            "throughput": {"label": "Throughput (msg/s)", "values": values('throughput'), "better": "higher"},
+            "cpu_usage": {"label": "CPU Usage (%)", "values": values('cpu_usage'), "better": "lower"},
+            "memory_usage": {"label": "Memory Usage (MB)", "values": values('memory_usage'), "better": "lower"}
+        },
+        "details": {name: results[p] for p, name in zip(protocols, names)},
+        "config": dict(config or {}, timestamp=datetime.datetime.now().isoformat()),
+        "errors": errors or {}
+    }
+
+    os.makedirs(directory, exist_ok=True)
+    csv_path = os.path.join(directory, 'performance_comparison.csv')
+    json_path = os.path.join(directory, 'performance_comparison.json')
+    # Written under temporary names first, so readers never see half a file
+    for path, content in ((csv_path, csv_data), (json_path, json.dumps(json_data, indent=2))):
+        with open(path + '.tmp', 'w') as f:
+            f.write(content)
+    os.replace(csv_path + '.tmp', csv_path)
+    os.replace(json_path + '.tmp', json_path)
+    return csv_path, json_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the chat transports over loopback')
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--protocols', nargs='+', default=['all'])
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports'))
+    parser.add_argument('--implementation', default=IMPLEMENTATION_PATH)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s', stream=sys.stderr)
+
+    def report(percent, protocol):
+        print(json.dumps({'progress': percent, 'protocol': protocol}), flush=True)
+
+    results, errors = run_benchmark(args.protocols, args.messages, args.size, args.implementation, report)
+    if not results:
+        print(json.dumps({'error': '; '.join(f'{p}: {e}' for p, e in errors.items()) or 'No protocols'}), flush=True)
+        return 1
+    write_results(results, args.output, {'messages': args.messages, 'message_size': args.size}, errors)
+    print(json.dumps({'done': True, 'errors': errors}), flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,354 @@
+"""
+Content-addressed storage for uploaded files.
+
+Every distinct file content is stored once, named after its SHA-256
+digest, and reference counted by the file messages pointing at it:
+uploading content that is already stored only adds a reference and
+throws the freshly spooled copy away. References are counted per room, so
+when a file message falls out of a room's history its reference is
+released, when a room's messages are gone all of its references are (at
+startup, those of rooms the server no longer knows too), and blobs nobody
+points at any more are deleted.
+
+Blobs are spread over two levels of subdirectories named after the first
+hex digits of their digest (objects/ab/cd/abcd...), so no directory grows
+past a few thousand entries. The reference counts, sizes and last access
+times live in a small SQLite database next to the blobs, in WAL mode, so
+several worker processes can share one upload folder. A collector thread
+deletes orphaned blobs and, while the store is over its quota, evicts the
+least recently used ones; file messages pointing at an evicted blob keep
+their references, so uploading the content again brings it back.
+With an at-rest cipher, blobs arrive sealed from their spools and open()
+decrypts them while they are read.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import logging
+
+logger = logging.getLogger('noise_web_blobs')
+
+DIGEST_NAME = re.compile(r'^[0-9a-f]{64}$')
+# File messages link to '<digest>_<filename>'
+STORED_NAME = re.compile(r'^([0-9a-f]{64})_')
+# Last access times are only written once per this many seconds per blob
+ACCESS_RESOLUTION = 60
+EVICTION_BATCH = 100
+
+
+def file_digest(message):
+    """
+    Digest of the blob a file message points at.
+
+    Args:
+        message (dict): Message view
+
+    Returns:
+        str: The digest, or None for other messages
+    """
+    match = STORED_NAME.match((message.get('file_info') or {}).get('stored_filename') or '')
+    return match.group(1) if match else None
+
+
+class BlobStore:
+    """
+    Deduplicating file store with per-room reference counts.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS blobs (
+            digest TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS refs (
+            room_id TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (room_id, digest)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS refs_by_digest ON refs (digest);
+    """
+
+    def __init__(self, directory, cipher=None):
+        """
+        Open (or create) the store.
+
+        Args:
+            directory (str): Folder the blobs are kept in
+            cipher (AtRestCipher): Cipher the blobs are sealed with, optional
+        """
+        self.directory = directory
+        self.cipher = cipher
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._collector = None
+        os.makedirs(directory, exist_ok=True)
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(self.SCHEMA)
+        if 'last_access' not in [row[1] for row in db.execute("PRAGMA table_info(blobs)")]:
+            db.execute("ALTER TABLE blobs ADD COLUMN last_access REAL NOT NULL DEFAULT 0")
+            db.execute("UPDATE blobs SET last_access = created_at")
+        db.execute("CREATE INDEX IF NOT EXISTS blobs_by_access ON blobs (last_access)")
+        self._shard_flat_blobs()
+
+    def _db(self):
+        """Get this thread's connection."""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(os.path.join(self.directory, 'blobs.db'), timeout=30, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _transaction(self, work):
+        """Run `work(db)` in a write transaction and return its result."""
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(db)
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        return result
+
+    def _shard_flat_blobs(self):
+        """Move blobs stored before sharding into their subdirectories."""
+        moved = 0
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and DIGEST_NAME.match(entry.name):
+                path = self.path(entry.name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(entry.path, path)
+                moved += 1
+        if moved:
+            logger.info(f"Moved {moved} blobs into sharded subdirectories")
+
+    def path(self, digest):
+        """Path of the blob with the given digest."""
+        return os.path.join(self.directory, digest[:2], digest[2:4], digest)
+
+    def open(self, digest):
+        """Open a blob for reading its content."""
+        if self.cipher is not None:
+            return self.cipher.open(self.path(digest))
+        return open(self.path(digest), 'rb')
+
+    def store(self, spool, room_id):
+        """
+        Store a spooled upload and reference it from a room.
+        The file is moved into place while the write lock is held, so a
+        concurrent release can never delete a blob that was just reused.
+
+        Args:
+            spool (UploadSpool): Finished upload
+            room_id (str): Room the file message is posted to
+
+        Returns:
+            tuple: (digest, True if the content was already stored)
+        """
+        digest = spool.sha256.hexdigest()
+        path = self.path(digest)
+
+        def work(db):
+            now = time.time()
+            db.execute("INSERT INTO refs (room_id, digest, count) VALUES (?, ?, 1) "
+                       "ON CONFLICT (room_id, digest) DO UPDATE SET count = count + 1", (room_id, digest))
+            known = db.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if known and os.path.exists(path):
+                spool.close()
+                db.execute("UPDATE blobs SET last_access = ? WHERE digest = ?", (now, digest))
+                return True
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            spool.commit(path)
+            db.execute("INSERT OR REPLACE INTO blobs (digest, size, created_at, last_access) VALUES (?, ?, ?, ?)",
+                       (digest, spool.size, now, now))
+            return False
+
+        duplicate = self._transaction(work)
+        if duplicate:
+            logger.info(f"Upload deduplicated against stored blob {digest}")
+        else:
+            self._wake.set()
+        return digest, duplicate
+
+    def touch(self, digest):
+        """Record that a blob was read, at most once per ACCESS_RESOLUTION seconds."""
+        now = time.time()
+        self._db().execute("UPDATE blobs SET last_access = ? WHERE digest = ? AND last_access < ?",
+                           (now, digest, now - ACCESS_RESOLUTION))
+
+    def retain(self, room_id, digest):
+        """Add a reference from another copy of a file message, e.g. one relayed by the message bus."""
+        self._db().execute("INSERT INTO refs (room_id, digest, count) VALUES (?, ?, 1) "
+                           "ON CONFLICT (room_id, digest) DO UPDATE SET count = count + 1", (room_id, digest))
+
+    def release(self, room_id, digest):
+        """
+        Drop one reference a room holds, deleting the blob if it was the last.
+
+        Returns:
+            bool: True if the blob was deleted
+        """
+        def work(db):
+            db.execute("UPDATE refs SET count = count - 1 WHERE room_id = ? AND digest = ?", (room_id, digest))
+            db.execute("DELETE FROM refs WHERE room_id = ? AND digest = ? AND count <= 0", (room_id, digest))
+            if db.execute("SELECT 1 FROM refs WHERE digest = ? LIMIT 1", (digest,)).fetchone() is not None:
+                return False
+            self._delete(db, [digest])
+            return True
+
+        deleted = self._transaction(work)
+        if deleted:
+            logger.info(f"Deleted blob {digest} no longer referenced by room {room_id}")
+        return deleted
+
+    def release_room(self, room_id):
+        """
+        Drop the references a room holds and delete the blobs left unreferenced.
+
+        Returns:
+            int: Number of blobs deleted
+        """
+        deleted = self._transaction(lambda db: self._release_rooms(db, [room_id]))
+        if deleted:
+            logger.info(f"Deleted {deleted} blobs no longer referenced after room {room_id} was removed")
+        return deleted
+
+    def release_unknown_rooms(self, room_exists):
+        """
+        Drop the references of rooms that no longer exist, e.g. rooms whose
+        history was lost when the server restarted, and delete the blobs left
+        unreferenced.
+
+        Args:
+            room_exists (callable): Tells whether a room id is known. It is
+                asked inside the write transaction, and a room exists before
+                it references a blob, so a room created meanwhile is kept.
+
+        Returns:
+            int: Number of blobs deleted
+        """
+        def work(db):
+            room_ids = [row[0] for row in db.execute("SELECT DISTINCT room_id FROM refs")]
+            unknown = [room_id for room_id in room_ids if not room_exists(room_id)]
+            if unknown:
+                logger.info(f"Releasing the blobs of {len(unknown)} rooms that no longer exist")
+            return self._release_rooms(db, unknown)
+
+        deleted = self._transaction(work)
+        if deleted:
+            logger.info(f"Deleted {deleted} blobs only referenced by rooms that no longer exist")
+        return deleted
+
+    def _release_rooms(self, db, room_ids):
+        """Drop the references of rooms and delete orphaned blobs (write transaction held)."""
+        digests = set()
+        for room_id in room_ids:
+            digests.update(row[0] for row in db.execute("SELECT digest FROM refs WHERE room_id = ?", (room_id,)))
+            db.execute("DELETE FROM refs WHERE room_id = ?", (room_id,))
+        orphaned = [digest for digest in digests
+                    if db.execute("SELECT 1 FROM refs WHERE digest = ? LIMIT 1", (digest,)).fetchone() is None]
+        self._delete(db, orphaned)
+        return len(orphaned)
+
+    def _delete(self, db, digests):
+        """Delete blobs and their files (write transaction held)."""
+        for digest in digests:
+            db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            try:
+                os.unlink(self.path(digest))
+            except FileNotFoundError:
+                pass
+
+    def references(self, digest):
+        """Total number of file messages pointing at a blob."""
+        row = self._db().execute("SELECT SUM(count) FROM refs WHERE digest = ?", (digest,)).fetchone()
+        return row[0] or 0
+
+    def usage(self):
+        """
+        Size of the store.
+
+        Returns:
+            tuple: (number of blobs, total bytes)
+        """
+        count, total = self._db().execute("SELECT COUNT(*), SUM(size) FROM blobs").fetchone()
+        return count, total or 0
+
+    def collect(self, quota=None, grace=300):
+        """
+        Delete orphaned blobs, then evict the least recently used blobs until
+        the store fits its quota. Blobs read or stored in the last `grace`
+        seconds are never evicted, so downloads and uploads in progress are
+        left alone even if that keeps the store over quota.
+
+        Args:
+            quota (int): Bytes the store may hold, None for no limit
+            grace (float): Seconds a blob is protected after its last access
+
+        Returns:
+            dict: Numbers of orphans and evicted blobs and the bytes freed
+        """
+        def delete_orphans(db):
+            rows = db.execute("SELECT digest, size FROM blobs WHERE NOT EXISTS "
+                              "(SELECT 1 FROM refs WHERE refs.digest = blobs.digest)").fetchall()
+            self._delete(db, [digest for digest, _ in rows])
+            return len(rows), sum(size for _, size in rows)
+
+        orphans, freed = self._transaction(delete_orphans)
+        evicted = 0
+        while quota is not None:
+            def evict(db):
+                total = db.execute("SELECT SUM(size) FROM blobs").fetchone()[0] or 0
+                rows = []
+                for digest, size in db.execute("SELECT digest, size FROM blobs WHERE last_access < ? "
+                                               "ORDER BY last_access LIMIT ?",
+                                               (time.time() - grace, EVICTION_BATCH)):
+                    if total <= quota:
+                        break
+                    rows.append((digest, size))
+                    total -= size
+                self._delete(db, [digest for digest, _ in rows])
+                return len(rows), sum(size for _, size in rows)
+
+            count, size = self._transaction(evict)
+            evicted += count
+            freed += size
+            if count < EVICTION_BATCH:
+                break
+
+        if orphans or evicted:
+            logger.info(f"Blob collection deleted {orphans} orphans and evicted {evicted} blobs, "
+                        f"freeing {freed} bytes")
+        return {'orphans': orphans, 'evicted': evicted, 'freed': freed}
+
+    def start_collector(self, quota=None, interval=600, grace=300):
+        """
+        Run collect() from a daemon thread every `interval` seconds, and
+        soon after a new blob is stored (no-op if already running).
+        """
+        if self._collector is not None:
+            return
+
+        def run():
+            while True:
+                self._wake.wait(interval)
+                self._wake.clear()
+                try:
+                    _, total = self.usage()
+                    self.collect(quota if quota is not None and total > quota else None, grace)
+                except Exception as e:
+                    logger.error(f"Error collecting blobs: {e}")
+                # New blobs arrive in bursts; collect at most once per few seconds
+                time.sleep(5)
+
+        self._collector = threading.Thread(target=run, name='blob-gc')
+        self._collector.daemon = True
+        self._collector.start()
@@ -0,0 +1,85 @@
+"""
+Compact framing for the WebSocket chat transport.
+Frames are short JSON arrays whose first element names the frame type, so a
+chat message costs a single small frame instead of a full HTTP round-trip.
+
+Client -> server:
+    ["s", ref, room_id, text]      send a chat message to a room
+    ["p"]                          ping
+
+Server -> client:
+    ["m", message]                 message delivered to this user
+    ["a", ref, ok, error]          result of a send frame
+    ["st", status]                 connection status change
+    ["p"]                          pong
+"""
+
+import json
+
+FRAME_SEND = 's'
+FRAME_PING = 'p'
+FRAME_MESSAGE = 'm'
+FRAME_ACK = 'a'
+FRAME_STATUS = 'st'
+
+
+class FrameError(ValueError):
+    """Raised when a client frame cannot be decoded."""
+
+
+def encode_frame(kind, *fields):
+    """
+    Encode a frame for the client.
+
+    Args:
+        kind (str): Frame type, one of the FRAME_* constants
+        *fields: JSON-serializable frame fields
+
+    Returns:
+        str: The encoded frame
+    """
+    return json.dumps([kind, *fields], separators=(',', ':'))
+
+
+def encode_json_frame(kind, payload):
+    """
+    Encode a frame around an already serialized JSON value.
+
+    Args:
+        kind (str): Frame type, one of the FRAME_* constants
+        payload (bytes): UTF-8 encoded JSON value
+
+    Returns:
+        str: The encoded frame
+    """
+    return f'["{kind}",{payload.decode("utf-8")}]'
+
+
+def decode_frame(raw):
+    """
+    Decode a frame received from the client.
+
+    Args:
+        raw (str or bytes): Frame payload
+
+    Returns:
+        list: The frame, with the frame type as first element
+
+    Raises:
+        FrameError: If the payload is not a well-formed frame
+    """
+    try:
+        frame = json.loads(raw)
+    except (TypeError, ValueError) as e:
+        raise FrameError(f"Invalid frame: {e}")
+
+    if not isinstance(frame, list) or not frame or not isinstance(frame[0], str):
+        raise FrameError("Frame must be a non-empty array starting with its type")
+
+    if frame[0] == FRAME_SEND:
+        if len(frame) != 4 or not isinstance(frame[3], str):
+            raise FrameError("Send frame must be [\"s\", ref, room_id, text]")
+    elif frame[0] != FRAME_PING:
+        raise FrameError(f"Unknown frame type: {frame[0]}")
+
+    return frame
@@ -0,0 +1,200 @@
+"""
+Server-Sent Events support for the web interface.
+This module lets long-lived streaming responses sleep until something new
+is available for their user instead of polling the Flask app every second.
+Waiting works both from worker threads and from coroutines on an asyncio
+event loop (see asgi_app.py).
+"""
+
+import asyncio
+import threading
+import json
+from urllib.parse import quote, unquote
+
+
+class ChangeNotifier:
+    """
+    Per-user change notifications for streaming responses.
+    Every user has a version counter; writers bump it with notify() and
+    readers block in wait() (or await wait_async()) until it moves past the
+    version they last saw.
+    """
+
+    def __init__(self):
+        """Initialize the notifier."""
+        self._lock = threading.Lock()
+        self._conditions = {}  # user_id -> threading.Condition
+        self._versions = {}  # user_id -> int
+        self._async_waiters = {}  # user_id -> set of (event loop, asyncio.Event)
+
+    def _condition(self, user_id):
+        """Get (or lazily create) the condition guarding a user's version."""
+        with self._lock:
+            condition = self._conditions.get(user_id)
+            if condition is None:
+                condition = threading.Condition()
+                self._conditions[user_id] = condition
+                self._versions[user_id] = 0
+            return condition
+
+    def version(self, user_id):
+        """
+        Get the current version for a user.
+
+        Args:
+            user_id (str): Unique identifier for the user
+
+        Returns:
+            int: Version to pass to wait() after reading the user's state
+        """
+        condition = self._condition(user_id)
+        with condition:
+            return self._versions[user_id]
+
+    def notify(self, user_id):
+        """
+        Wake up every stream waiting on a user.
+
+        Args:
+            user_id (str): Unique identifier for the user
+        """
+        condition = self._condition(user_id)
+        with condition:
+            self._versions[user_id] += 1
+            condition.notify_all()
+            # Coroutines may live on another thread's loop
+            for loop, event in self._async_waiters.get(user_id, ()):
+                loop.call_soon_threadsafe(event.set)
+
+    def wait(self, user_id, version, timeout=None):
+        """
+        Block until the user's version moves past `version` or the timeout expires.
+
+        Args:
+            user_id (str): Unique identifier for the user
+            version (int): Last version the caller has seen
+            timeout (float): Maximum number of seconds to wait
+
+        Returns:
+            int: The current version (equal to `version` on timeout)
+        """
+        condition = self._condition(user_id)
+        with condition:
+            condition.wait_for(lambda: self._versions[user_id] != version, timeout)
+            return self._versions[user_id]
+
+    async def wait_async(self, user_id, version, timeout=None):
+        """
+        Coroutine version of wait() for streams served from an asyncio event loop.
+
+        Args:
+            user_id (str): Unique identifier for the user
+            version (int): Last version the caller has seen
+            timeout (float): Maximum number of seconds to wait
+
+        Returns:
+            int: The current version (equal to `version` on timeout)
+        """
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        condition = self._condition(user_id)
+        with condition:
+            if self._versions[user_id] != version:
+                return self._versions[user_id]
+            self._async_waiters.setdefault(user_id, set()).add(waiter)
+
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with condition:
+                waiters = self._async_waiters.get(user_id)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._async_waiters[user_id]
+
+        return self.version(user_id)
+
+    def forget(self, user_id):
+        """
+        Drop the state kept for a user, waking any remaining streams first.
+
+        Args:
+            user_id (str): Unique identifier for the user
+        """
+        self.notify(user_id)
+        with self._lock:
+            self._conditions.pop(user_id, None)
+            self._versions.pop(user_id, None)
+
+
+def format_event(data, event=None, event_id=None, retry=None):
+    """
+    Encode a single Server-Sent Event.
+
+    Args:
+        data: JSON-serializable payload (strings are sent as-is, bytes are
+            taken to be pre-serialized single-line JSON)
+        event (str): Optional event name
+        event_id (str): Optional id, echoed back by the browser as Last-Event-ID
+        retry (int): Optional reconnection delay in milliseconds
+
+    Returns:
+        bytes: The encoded event, terminated by a blank line
+    """
+    if isinstance(data, bytes):
+        payload = b'data: ' + data + b'\n\n'
+        data = None
+    elif not isinstance(data, str):
+        data = json.dumps(data)
+
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    if retry is not None:
+        lines.append(f"retry: {retry}")
+    if data is None:
+        return ''.join(line + '\n' for line in lines).encode('utf-8') + payload
+
+    for line in data.splitlines() or ['']:
+        lines.append(f"data: {line}")
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+def encode_cursors(cursors):
+    """
+    Encode per-room sequence cursors as an event id, e.g. "main:12,dev:3".
+
+    Args:
+        cursors (dict): room_id -> last sequence number delivered
+
+    Returns:
+        str: Compact event id
+    """
+    # Room ids are user supplied, so escape the separators
+    return ','.join(f"{quote(room_id, safe='')}:{seq}" for room_id, seq in cursors.items())
+
+
+def decode_cursors(event_id):
+    """
+    Decode an event id produced by encode_cursors().
+    Malformed entries are ignored so a bad header simply replays history.
+
+    Args:
+        event_id (str): Value of the Last-Event-ID header
+
+    Returns:
+        dict: room_id -> last sequence number delivered
+    """
+    cursors = {}
+    if not event_id:
+        return cursors
+
+    for item in event_id.split(','):
+        room_id, _, seq = item.rpartition(':')
+        if room_id and seq.isdigit():
+            cursors[unquote(room_id)] = int(seq)
+    return cursors
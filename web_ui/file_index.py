@@ -0,0 +1,146 @@
+"""
+Per-user index of the files shared in chat rooms.
+
+Every file message is added once, when it is posted, to the list of each
+member allowed to see it, split by room. Entries get an increasing
+number as they are indexed, so a user's lists are ordered newest-last and
+a page of files is found by bisecting each list and merging the few
+rooms involved, whatever the number of chat messages in those rooms.
+
+Like the search index, the file index notices gaps in a room's sequence
+numbers (messages posted by another worker) and pulls the missing
+records from the room log before answering.
+"""
+
+import heapq
+import threading
+from bisect import bisect_left
+from itertools import count, islice
+
+FILE_TYPES = ('file', 'incoming_file')
+
+
+def file_entry(message):
+    """
+    Get the listing entry of a file message.
+
+    Args:
+        message (dict): Message as seen by a recipient
+
+    Returns:
+        dict: The entry, or None if the message does not carry a file
+    """
+    if message.get('type') not in FILE_TYPES or 'file_info' not in message:
+        return None
+    return {
+        'file_info': message['file_info'],
+        'sender': message.get('sender', 'Unknown'),
+        'timestamp': message.get('timestamp', ''),
+        'room_id': message.get('room_id', 'main'),
+        'room_name': message.get('room_name', 'Main Room'),
+        'type': message.get('type', 'file')
+    }
+
+
+class FileIndex:
+    """
+    Files visible to each user, by room, in the order they were shared.
+    """
+
+    def __init__(self, recipients, room_log):
+        """
+        Initialize an empty index.
+
+        Args:
+            recipients (callable): recipients(room_id, record) -> iterable of
+                the user ids that should see a file record
+            room_log (callable): room_log(room_id) -> the room's log, or None
+        """
+        self.recipients = recipients
+        self.room_log = room_log
+        self._lock = threading.Lock()
+        self._numbers = count(1)
+        self._files = {}  # user_id -> {room_id: [(number, entry)], oldest first}
+        self._indexed = {}  # room_id -> last sequence number looked at
+
+    def add(self, room_id, log, record):
+        """
+        Index a record right after it was appended to a room log.
+
+        Args:
+            room_id (str): Room the record was posted to
+            log (RoomLog): The room's log
+            record (RoomMessage): The appended record
+        """
+        with self._lock:
+            indexed = self._indexed.get(room_id, 0)
+            if record.seq == indexed + 1:
+                self._index(room_id, record)
+                self._indexed[room_id] = record.seq
+            else:
+                self._catch_up(room_id, log)
+
+    def _index(self, room_id, record):
+        """Hand a record to its recipients if it is a file (lock held)."""
+        entry = file_entry(record.incoming)
+        if entry is None:
+            return
+        number = next(self._numbers)
+        for user_id in self.recipients(room_id, record):
+            self._files.setdefault(user_id, {}).setdefault(room_id, []).append((number, entry))
+
+    def _catch_up(self, room_id, log):
+        """Index the records a room log holds beyond what was looked at (lock held)."""
+        indexed = self._indexed.get(room_id, 0)
+        if log.last_seq < indexed:
+            indexed = 0  # The room was created again
+        if log.last_seq == indexed:
+            return
+        for record in log.records_after(indexed):
+            self._index(room_id, record)
+        self._indexed[room_id] = log.last_seq
+
+    def files(self, user_id, room_ids, before=None, limit=50):
+        """
+        Get a page of the files a user can see, newest first.
+
+        Args:
+            user_id (str): Unique identifier for the user
+            room_ids (iterable): Rooms to list
+            before (int): Cursor from a previous page, None for the newest files
+            limit (int): Maximum number of files
+
+        Returns:
+            tuple: (list of entries, cursor for the next page or None)
+        """
+        with self._lock:
+            pages = []
+            for room_id in room_ids:
+                log = self.room_log(room_id)
+                if log is not None:
+                    self._catch_up(room_id, log)
+                entries = self._files.get(user_id, {}).get(room_id)
+                if not entries:
+                    continue
+                end = len(entries) if before is None else bisect_left(entries, (before,))
+                # At most `limit` entries per room can make it into the page
+                pages.append(entries[max(0, end - limit):end][::-1])
+
+        page = list(islice(heapq.merge(*pages, key=lambda item: item[0], reverse=True), limit))
+        cursor = page[-1][0] if len(page) == limit else None
+        return [entry for _, entry in page], cursor
+
+    def forget(self, room_id):
+        """Forget how far a removed room was indexed."""
+        with self._lock:
+            self._indexed.pop(room_id, None)
+
+    def forget_room(self, user_id, room_id):
+        """Drop the files a user saw in a room they left."""
+        with self._lock:
+            self._files.get(user_id, {}).pop(room_id, None)
+
+    def forget_user(self, user_id):
+        """Drop every file entry of a disconnected user."""
+        with self._lock:
+            self._files.pop(user_id, None)
@@ -0,0 +1,84 @@
+"""
+Conditional and ranged responses for stored files.
+
+Content-addressed uploads never change, so their SHA-256 digest is a
+strong ETag and a client that already has the file gets a 304. A single
+byte range is answered with 206 and only those bytes, streamed in
+fixed-size reads. Files sealed at rest are decrypted as they are
+streamed: the reader seeks to the chunk holding the first byte of the
+range, so a range still costs only what it covers. The bytes on disk are
+never the response, so the file is not handed to sendfile(2), X-Sendfile
+or the server's wsgi.file_wrapper.
+"""
+
+import os
+
+from flask import Response
+from werkzeug.http import parse_etags, parse_range_header, quote_etag
+from werkzeug.utils import secure_filename
+
+READ_SIZE = 64 * 1024
+
+
+def _limited_reader(f, length):
+    try:
+        while length > 0:
+            data = f.read(min(READ_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+def send_stored_file(request, path, etag, download_name, mimetype, cipher=None):
+    """
+    Build the response for a stored file.
+
+    Args:
+        request (flask.Request): The current request
+        path (str): File to send
+        etag (str): Strong validator of the file's content
+        download_name (str): Name offered to the browser
+        mimetype (str): Content type
+        cipher (AtRestCipher): Cipher the file may be sealed with, optional
+
+    Returns:
+        flask.Response: 200, 206, 304 or 416 response
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+    """
+    sealed = cipher is not None and cipher.is_sealed(path)
+    size = cipher.plaintext_size(path) if sealed else os.stat(path).st_size
+    headers = {
+        'ETag': quote_etag(etag),
+        'Accept-Ranges': 'bytes',
+        # The URL names the content, so it can be cached for good (by this user only)
+        'Cache-Control': 'private, max-age=31536000, immutable',
+        'Content-Disposition': f'attachment; filename="{secure_filename(download_name) or "download"}"'
+    }
+
+    if parse_etags(request.headers.get('If-None-Match')).contains(etag):
+        return Response(status=304, headers=headers)
+
+    start, length, status = 0, size, 200
+    ranges = parse_range_header(request.headers.get('Range'))
+    if_range = request.headers.get('If-Range')
+    if ranges is not None and len(ranges.ranges) == 1 and (not if_range or if_range == quote_etag(etag)):
+        byte_range = ranges.range_for_length(size)
+        if byte_range is None:
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status=416, headers=headers)
+        start, stop = byte_range
+        length, status = stop - start, 206
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    headers['Content-Length'] = str(length)
+
+    if request.method == 'HEAD':
+        return Response(status=status, headers=headers, mimetype=mimetype)
+
+    f = cipher.open(path) if sealed else open(path, 'rb')
+    f.seek(start)
+    return Response(_limited_reader(f, length), status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
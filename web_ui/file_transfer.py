@@ -0,0 +1,256 @@
+"""
+Streaming file transfer over a Noise chat channel.
+
+A file is cut into FRAME_SIZE frames and each frame crosses the channel as
+one chat message, so it is encrypted and authenticated by the Noise
+transport keys like any other message; there is no second layer of
+encryption on top. Sending is pipelined: a reader thread reads and encodes
+frames (decrypting a file stored sealed as it goes) while the channel
+encrypts and sends the previous ones, at most `window` frames ahead, so
+memory stays bounded by the window whatever the file size. The frame index
+and the final-frame flag let the peer reassemble the file in order and
+notice a truncated transfer, and the closing message carries the SHA-256
+of the whole file to check the result against.
+
+FileTransfers runs transfers on background workers, so an upload request
+returns as soon as the file is stored, and keeps their progress and
+results for the UI.
+
+Messages are JSON objects with a 'noise_file' entry:
+    {'noise_file': 'start', 'transfer_id', 'filename', 'size', 'frame_size', 'frames'}
+    {'noise_file': 'frame', 'transfer_id', 'index', 'final', 'data'}
+    {'noise_file': 'end', 'transfer_id', 'sha256'}
+where 'data' is the frame's bytes in base64.
+"""
+
+import base64
+import hashlib
+import json
+import math
+import os
+import queue
+import threading
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger('noise_web_transfer')
+
+# Noise transport messages are at most 65535 bytes; a base64 encoded frame
+# and its JSON envelope must fit in one
+FRAME_SIZE = 32 * 1024
+# Frames read ahead of the channel
+WINDOW = 8
+PREVIEW_BYTES = 64
+# Authentication tag a Noise transport message adds
+NOISE_TAG_SIZE = 16
+
+
+class TransferError(Exception):
+    """A transfer could not be sent."""
+
+
+class FileTransferSender:
+    """
+    Sends files as frames through a message-sending callable.
+    """
+
+    def __init__(self, send, frame_size=FRAME_SIZE, window=WINDOW):
+        """
+        Initialize the sender.
+
+        Args:
+            send (callable): send(text) -> result, e.g. NoiseChatClient.send_chat_message;
+                a falsy result or a dict without 'success' aborts the transfer
+            frame_size (int): File bytes per frame
+            window (int): Frames read and encoded ahead of the channel
+        """
+        self.send = send
+        self.frame_size = frame_size
+        self.window = window
+
+    def _send(self, message):
+        text = json.dumps(message, separators=(',', ':'))
+        result = self.send(text)
+        if not result or (isinstance(result, dict) and not result.get('success', False)):
+            raise TransferError(f"Channel refused {message['noise_file']} message")
+        return result, len(text.encode('utf-8')) + NOISE_TAG_SIZE
+
+    def _read_frames(self, source, frames, transfer_id, pending, stop):
+        """Reader thread: encode frames into `pending`, then the digest (or the error)."""
+        def put(item):
+            # The sender stops taking frames when the channel fails
+            while not stop.is_set():
+                try:
+                    pending.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        digest = hashlib.sha256()
+        try:
+            for index in range(frames):
+                data = source.read(self.frame_size)
+                digest.update(data)
+                if not put({'noise_file': 'frame', 'transfer_id': transfer_id, 'index': index,
+                            'final': index == frames - 1, 'data': base64.b64encode(data).decode('ascii')}):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        put(digest)
+
+    def send_file(self, source, filename=None, transfer_id=None, progress=None):
+        """
+        Send a file.
+
+        Args:
+            source (str or file): Path of the file to send, or a seekable binary
+                file object (e.g. a stored file opened for its plaintext), which
+                is left open
+            filename (str): Name announced to the peer, defaults to the file's name
+            transfer_id (str): Id of the transfer, a new one by default
+            progress (callable): Called with the number of frames sent after each frame, optional
+
+        Returns:
+            dict: Details of the transfer, in the shape the UI shows
+
+        Raises:
+            TransferError: If the channel refused a message or the file could not be read
+        """
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                return self.send_file(f, filename or os.path.basename(source), transfer_id, progress)
+        size = source.seek(0, os.SEEK_END)
+        source.seek(0)
+        frames = max(1, math.ceil(size / self.frame_size))
+        transfer_id = transfer_id or uuid.uuid4().hex
+        started = time.time()
+
+        _, sent_bytes = self._send({
+            'noise_file': 'start', 'transfer_id': transfer_id, 'filename': filename or 'file',
+            'size': size, 'frame_size': self.frame_size, 'frames': frames
+        })
+
+        pending = queue.Queue(maxsize=self.window)
+        stop = threading.Event()
+        reader = threading.Thread(target=self._read_frames, args=(source, frames, transfer_id, pending, stop),
+                                  name='noise-transfer-read', daemon=True)
+        reader.start()
+        channel = {}
+        try:
+            for index in range(frames):
+                frame = pending.get()
+                if isinstance(frame, Exception):
+                    raise TransferError(f"Could not read {filename or 'file'}: {frame}")
+                result, length = self._send(frame)
+                sent_bytes += length
+                if index == 0 and isinstance(result, dict):
+                    channel = result.get('metadata') or {}
+                if progress is not None:
+                    progress(index + 1)
+            digest = pending.get()
+            if isinstance(digest, Exception):
+                raise TransferError(f"Could not read {filename or 'file'}: {digest}")
+        finally:
+            stop.set()
+            reader.join()
+
+        _, length = self._send({'noise_file': 'end', 'transfer_id': transfer_id, 'sha256': digest.hexdigest()})
+        sent_bytes += length
+        elapsed = max(time.time() - started, 1e-6)
+        logger.info(f"Sent {size} bytes in {frames} frames in {elapsed:.2f}s ({size / elapsed / 1e6:.1f} MB/s)")
+
+        # What the channel reports about the first frame stands for the transfer
+        details = {
+            'key_id': channel.get('key_id', f"transfer-{transfer_id[:10]}"),
+            'transfer_id': transfer_id,
+            'algorithm': channel.get('algorithm', 'Noise transport'),
+            'sha256': digest.hexdigest(),
+            'original_size': size,
+            'encrypted_size': sent_bytes,
+            'frames': frames,
+            'frame_size': self.frame_size,
+            'throughput_mbps': round(size * 8 / elapsed / 1e6, 2),
+            'timestamp': datetime.now().isoformat()
+        }
+        if channel.get('encrypted_hex'):
+            details['encrypted_hex'] = channel['encrypted_hex'][:PREVIEW_BYTES * 2] + "..."
+        return details
+
+
+class FileTransfers:
+    """
+    File transfers running on background workers, with their progress and
+    results. The most recent `keep` transfers are remembered.
+    """
+
+    def __init__(self, max_workers=4, keep=1024):
+        """
+        Initialize the transfers.
+
+        Args:
+            max_workers (int): Transfers running at the same time; later ones wait
+            keep (int): Number of transfers whose status is kept
+        """
+        self.keep = keep
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='noise-transfer')
+        self._lock = threading.Lock()
+        self._transfers = OrderedDict()  # transfer_id -> status dict
+
+    def start(self, owner, room_id, filename, size, frame_size, send):
+        """
+        Queue a transfer.
+
+        Args:
+            owner (str): User sending the file
+            room_id (str): Room the file was posted to
+            filename (str): File name
+            size (int): File size
+            frame_size (int): Frame size the transfer uses
+            send (callable): send(transfer_id, progress) -> details dict (falsy
+                if nothing was sent), run on a worker; see FileTransferSender.send_file
+
+        Returns:
+            dict: Status of the queued transfer
+        """
+        transfer_id = uuid.uuid4().hex
+        status = {
+            'transfer_id': transfer_id, 'owner': owner, 'room_id': room_id, 'filename': filename,
+            'state': 'queued', 'original_size': size, 'frame_size': frame_size,
+            'frames': max(1, math.ceil(size / frame_size)), 'frames_sent': 0
+        }
+        with self._lock:
+            self._transfers[transfer_id] = status
+            while len(self._transfers) > self.keep:
+                self._transfers.popitem(last=False)
+            queued = dict(status)
+        self._executor.submit(self._run, status, send)
+        return queued
+
+    def _run(self, status, send):
+        def progress(frames_sent):
+            status['frames_sent'] = frames_sent
+
+        with self._lock:
+            status['state'] = 'sending'
+        try:
+            details = send(status['transfer_id'], progress)
+        except Exception as e:
+            logger.error(f"File transfer {status['transfer_id']} failed: {e}")
+            details = None
+        with self._lock:
+            if isinstance(details, dict):
+                status.update(details, state='sent', frames_sent=status['frames'])
+            else:
+                status['state'] = 'failed'
+
+    def get(self, transfer_id):
+        """Status of a transfer, or None if it is unknown."""
+        with self._lock:
+            status = self._transfers.get(transfer_id)
+            return dict(status) if status is not None else None
@@ -0,0 +1,28 @@
+"""
+Gunicorn settings for running the web interface with one worker per core.
+Workers share rooms, membership and message logs through a SQLite (WAL)
+database and route each user's requests to the worker holding that user's
+Noise client.
+
+Run from the web_ui directory with:
+    gunicorn -c gunicorn.conf.py app:app
+"""
+
+import multiprocessing
+import os
+import secrets
+import tempfile
+
+# The app reads these when each worker imports it, so the app must not be preloaded
+state_dir = os.environ.setdefault('NOISE_WEB_STATE_DIR', os.path.join(tempfile.gettempdir(), 'noise_web'))
+os.makedirs(state_dir, exist_ok=True)
+os.environ.setdefault('NOISE_WEB_STATE', 'sqlite:///' + os.path.join(state_dir, 'state.db'))
+os.environ.setdefault('NOISE_WEB_SECRET_KEY', secrets.token_hex(32))
+
+bind = os.environ.get('NOISE_WEB_BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('NOISE_WEB_WORKERS', multiprocessing.cpu_count()))
+
+# Event streams hold a thread for as long as the browser is connected
+worker_class = 'gthread'
+threads = int(os.environ.get('NOISE_WEB_THREADS', 64))
+preload_app = False
@@ -0,0 +1,519 @@
+"""
+Publish/subscribe bus carrying room events between web app processes.
+Every process publishes the room messages and membership changes it makes
+locally; the other processes apply them to their own state and wake their
+own members, so a room spans every process (or node) on the bus.
+
+Publishes are batched: events queue up for at most `flush_interval`
+seconds (or until `max_batch` events are waiting) and then go out as one
+frame, so a busy room costs one bus write per batch instead of per message.
+
+Implementations:
+    InMemoryBus   nodes attached to the same InMemoryHub in one process
+    SocketBus     nodes connected to a BusBroker over a Unix or TCP socket
+
+Socket frames are authenticated with a shared secret: each one carries an
+HMAC-SHA256 tag over the sending node's id, a counter and the events.
+The broker drops peers whose frames do not verify, and nodes also verify
+what they receive and ignore replayed frames (a counter they already saw
+from that node). A TCP bus needs a secret; a Unix socket bus may rely on
+the socket's file permissions (owner and group only) instead. Frames are
+authenticated, not encrypted, so a TCP bus belongs on a private network.
+
+Run a standalone broker with:
+    NOISE_WEB_BUS_SECRET=<secret> python message_bus.py tcp://10.0.0.1:7700
+"""
+
+import abc
+import hashlib
+import hmac
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import uuid
+import logging
+
+logger = logging.getLogger('noise_web_bus')
+
+# Frames are a 4-byte big-endian length followed by a JSON array of events;
+# with a secret, the array is preceded by an AUTH_HEADER
+FRAME_HEADER = struct.Struct('>I')
+# HMAC-SHA256 tag over the rest of the frame, sending node id, frame counter
+AUTH_HEADER = struct.Struct('>32s16sQ')
+UNIX_SOCKET_MODE = 0o660
+
+
+class BusAuthError(Exception):
+    """A frame failed authentication."""
+
+
+def create_bus(url, flush_interval=0.005, max_batch=256, secret=None):
+    """
+    Create the bus described by a URL.
+
+    Args:
+        url (str): 'memory' for a process-local bus, 'unix://<path>' or
+            'tcp://<host>:<port>' to connect to a BusBroker
+        flush_interval (float): Longest time an event waits for its batch
+        max_batch (int): Events that trigger an immediate flush
+        secret (str): Shared secret authenticating socket frames, required
+            for TCP
+
+    Returns:
+        InMemoryBus or SocketBus: The bus
+
+    Raises:
+        ValueError: If the URL names an unknown bus
+    """
+    if not url or url == 'memory':
+        return InMemoryBus(InMemoryHub(), flush_interval=flush_interval, max_batch=max_batch)
+    if url.startswith(('unix://', 'tcp://')):
+        return SocketBus(url, secret=secret, flush_interval=flush_interval, max_batch=max_batch)
+    raise ValueError(f"Unknown message bus: {url}")
+
+
+def bus_key(url, secret):
+    """
+    Get the frame authentication key for a socket bus.
+
+    Args:
+        url (str): Bus address
+        secret (str): Shared secret, optional for Unix sockets
+
+    Returns:
+        bytes: The key, or None for an unauthenticated Unix socket bus
+
+    Raises:
+        ValueError: If a TCP bus has no secret
+    """
+    if not secret:
+        if url.startswith('tcp://'):
+            raise ValueError("A TCP message bus needs a shared secret (NOISE_WEB_BUS_SECRET)")
+        return None
+    return hashlib.sha256(secret.encode('utf-8') if isinstance(secret, str) else secret).digest()
+
+
+def seal_frame(key, sender, counter, payload):
+    """
+    Prefix a frame payload with its authentication header.
+
+    Args:
+        key (bytes): Frame authentication key
+        sender (bytes): 16-byte id of the sending node
+        counter (int): Number of frames the node sent before this one
+        payload (bytes): The events, as JSON
+
+    Returns:
+        bytes: The authenticated payload
+    """
+    signed = sender + counter.to_bytes(8, 'big') + payload
+    return hmac.new(key, signed, hashlib.sha256).digest() + signed
+
+
+def open_frame(key, data):
+    """
+    Check the authentication header of a frame payload.
+
+    Args:
+        key (bytes): Frame authentication key
+        data (bytes): Payload as sealed by seal_frame()
+
+    Returns:
+        tuple: (sender id, counter, events JSON)
+
+    Raises:
+        BusAuthError: If the frame is truncated or its tag does not match
+    """
+    if len(data) < AUTH_HEADER.size:
+        raise BusAuthError("Truncated frame")
+    tag, sender, counter = AUTH_HEADER.unpack_from(data)
+    if not hmac.compare_digest(tag, hmac.new(key, data[32:], hashlib.sha256).digest()):
+        raise BusAuthError("Bad frame tag")
+    return sender, counter, data[AUTH_HEADER.size:]
+
+
+def parse_address(url):
+    """
+    Turn a bus URL into a socket family and address.
+
+    Args:
+        url (str): 'unix://<path>' or 'tcp://<host>:<port>'
+
+    Returns:
+        tuple: (socket family, address)
+    """
+    if url.startswith('unix://'):
+        return socket.AF_UNIX, url[len('unix://'):]
+    host, _, port = url[len('tcp://'):].rpartition(':')
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+
+def read_frame(sock):
+    """
+    Read one frame from a socket.
+
+    Returns:
+        bytes: The frame payload, or None when the peer closed the connection
+    """
+    header = _read_exact(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    return _read_exact(sock, FRAME_HEADER.unpack(header)[0])
+
+
+def _read_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+class MessageBus(abc.ABC):
+    """
+    Base class handling subscription and publish batching.
+    Subclasses implement _send_batch() and call _deliver() for batches
+    received from other nodes.
+    """
+
+    def __init__(self, flush_interval=0.005, max_batch=256):
+        """
+        Initialize the bus.
+
+        Args:
+            flush_interval (float): Longest time an event waits for its batch
+            max_batch (int): Events that trigger an immediate flush
+        """
+        self.node_id = uuid.uuid4().hex
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.batches_sent = 0
+        self.events_sent = 0
+        self._handlers = []
+        self._pending = []
+        self._sending = False
+        self._condition = threading.Condition()
+        self._flusher = threading.Thread(target=self._flush_loop, name='bus-flusher')
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def subscribe(self, handler):
+        """
+        Register a handler for events published by other nodes.
+
+        Args:
+            handler (callable): Called with each event dict, from a bus thread
+        """
+        self._handlers.append(handler)
+
+    def publish(self, event):
+        """
+        Queue an event for the other nodes.
+
+        Args:
+            event (dict): JSON-serializable event with a 'type' entry
+        """
+        with self._condition:
+            self._pending.append(event)
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._condition.notify()
+
+    def flush(self, timeout=1.0):
+        """
+        Wait until every event published so far has been sent.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait
+
+        Returns:
+            bool: True if the queue drained in time
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            self._condition.notify_all()
+            while self._pending or self._sending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(min(remaining, self.flush_interval))
+        return True
+
+    def _flush_loop(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                # Give the batch a moment to fill up unless it already is full
+                if len(self._pending) < self.max_batch:
+                    self._condition.wait(self.flush_interval)
+                batch, self._pending = self._pending, []
+                self._sending = True
+
+            try:
+                self._send_batch(batch)
+                self.batches_sent += 1
+                self.events_sent += len(batch)
+            except Exception as e:
+                logger.error(f"Error publishing {len(batch)} bus events: {e}")
+            finally:
+                with self._condition:
+                    self._sending = False
+                    self._condition.notify_all()
+
+    def _deliver(self, events):
+        """Hand events received from another node to the handlers."""
+        for event in events:
+            for handler in self._handlers:
+                try:
+                    handler(event)
+                except Exception as e:
+                    logger.error(f"Error handling bus event {event.get('type')}: {e}")
+
+    @abc.abstractmethod
+    def _send_batch(self, events):
+        """
+        Send a batch of this node's events to every other node on the bus.
+        Called from the flusher thread, one batch at a time; exceptions are
+        logged and the batch is dropped.
+
+        Args:
+            events (list): Event dicts, in publish order
+        """
+
+
+class InMemoryHub:
+    """
+    Connects InMemoryBus nodes living in the same process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._nodes = []
+
+    def attach(self, node):
+        with self._lock:
+            self._nodes.append(node)
+
+    def broadcast(self, sender, events):
+        with self._lock:
+            nodes = [node for node in self._nodes if node is not sender]
+        if not nodes:
+            return
+        # Round-trip through JSON so nodes never share mutable event objects
+        events = json.dumps(events)
+        for node in nodes:
+            node._deliver(json.loads(events))
+
+
+class InMemoryBus(MessageBus):
+    """
+    Bus between nodes attached to the same InMemoryHub. With a single node
+    (the default single-process setup) publishing is a no-op.
+    """
+
+    def __init__(self, hub, **kwargs):
+        """
+        Initialize the node and attach it to a hub.
+
+        Args:
+            hub (InMemoryHub): Hub shared by the nodes
+        """
+        self.hub = hub
+        super().__init__(**kwargs)
+        hub.attach(self)
+
+    def _send_batch(self, events):
+        self.hub.broadcast(self, events)
+
+
+class SocketBus(MessageBus):
+    """
+    Bus node connected to a BusBroker. Reconnects in the background if the
+    broker goes away; events published while disconnected are dropped.
+    """
+
+    def __init__(self, url, reconnect_delay=1.0, secret=None, **kwargs):
+        """
+        Initialize the node and start connecting to the broker.
+
+        Args:
+            url (str): Broker address, 'unix://<path>' or 'tcp://<host>:<port>'
+            reconnect_delay (float): Seconds between connection attempts
+            secret (str): Shared secret authenticating frames, required for TCP
+
+        Raises:
+            ValueError: If a TCP bus has no secret
+        """
+        self.url = url
+        self.reconnect_delay = reconnect_delay
+        self._key = bus_key(url, secret)
+        self._frames_sent = 0
+        self._last_counters = {}  # sender id -> counter of its last frame
+        self._sock = None
+        self._connected = threading.Event()
+        super().__init__(**kwargs)
+        self._reader = threading.Thread(target=self._read_loop, name='bus-reader')
+        self._reader.daemon = True
+        self._reader.start()
+
+    def wait_connected(self, timeout=None):
+        """Block until the node is connected to the broker."""
+        return self._connected.wait(timeout)
+
+    def _send_batch(self, events):
+        sock = self._sock
+        if sock is None:
+            logger.warning(f"Bus not connected, dropping {len(events)} events")
+            return
+        payload = json.dumps(events, separators=(',', ':')).encode('utf-8')
+        if self._key is not None:
+            payload = seal_frame(self._key, uuid.UUID(self.node_id).bytes, self._frames_sent, payload)
+            self._frames_sent += 1
+        sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+    def _open(self, payload):
+        """
+        Authenticate a received frame.
+
+        Returns:
+            bytes: The events JSON, or None for a replayed frame
+
+        Raises:
+            BusAuthError: If the frame does not verify
+        """
+        if self._key is None:
+            return payload
+        sender, counter, payload = open_frame(self._key, payload)
+        if counter <= self._last_counters.get(sender, -1):
+            return None
+        self._last_counters[sender] = counter
+        return payload
+
+    def _read_loop(self):
+        family, address = parse_address(self.url)
+        while True:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            try:
+                sock.connect(address)
+            except OSError:
+                sock.close()
+                time.sleep(self.reconnect_delay)
+                continue
+
+            self._sock = sock
+            self._connected.set()
+            logger.info(f"Connected to message bus at {self.url}")
+            try:
+                while True:
+                    payload = read_frame(sock)
+                    if payload is None:
+                        break
+                    try:
+                        events = self._open(payload)
+                    except BusAuthError as e:
+                        logger.warning(f"Dropping bus frame that failed authentication: {e}")
+                        continue
+                    if events is None:
+                        logger.warning("Dropping replayed bus frame")
+                        continue
+                    self._deliver(json.loads(events))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Message bus connection lost: {e}")
+            finally:
+                self._connected.clear()
+                self._sock = None
+                sock.close()
+            time.sleep(self.reconnect_delay)
+
+
+class BusBroker:
+    """
+    Relays every frame a node sends to all other connected nodes.
+    Frames are forwarded as-is, so the broker never decodes events; with a
+    secret it checks their tags and disconnects peers sending frames that
+    do not verify.
+    """
+
+    def __init__(self, url, secret=None):
+        """
+        Initialize the broker.
+
+        Args:
+            url (str): Address to listen on, 'unix://<path>' or 'tcp://<host>:<port>'
+            secret (str): Shared secret authenticating frames, required for TCP
+
+        Raises:
+            ValueError: If a TCP broker has no secret
+        """
+        self.url = url
+        self._key = bus_key(url, secret)
+        self._lock = threading.Lock()
+        self._peers = {}  # socket -> send lock
+        family, address = parse_address(url)
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.unlink(address)
+        self._server = socket.socket(family, socket.SOCK_STREAM)
+        if family != socket.AF_UNIX:
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(address)
+        if family == socket.AF_UNIX:
+            os.chmod(address, UNIX_SOCKET_MODE)
+        self._server.listen()
+
+    def start(self):
+        """Accept nodes from a daemon thread and return the broker."""
+        thread = threading.Thread(target=self.serve_forever, name='bus-broker')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def serve_forever(self):
+        logger.info(f"Message bus broker listening on {self.url}")
+        while True:
+            sock, _ = self._server.accept()
+            with self._lock:
+                self._peers[sock] = threading.Lock()
+            thread = threading.Thread(target=self._relay, args=(sock,), name='bus-relay')
+            thread.daemon = True
+            thread.start()
+
+    def _relay(self, sock):
+        try:
+            while True:
+                payload = read_frame(sock)
+                if payload is None:
+                    break
+                if self._key is not None:
+                    try:
+                        open_frame(self._key, payload)
+                    except BusAuthError as e:
+                        logger.warning(f"Disconnecting bus peer sending unauthenticated frames: {e}")
+                        break
+                frame = FRAME_HEADER.pack(len(payload)) + payload
+                with self._lock:
+                    peers = [(peer, lock) for peer, lock in self._peers.items() if peer is not sock]
+                for peer, lock in peers:
+                    try:
+                        with lock:
+                            peer.sendall(frame)
+                    except OSError:
+                        pass  # The peer's own relay thread notices and drops it
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                self._peers.pop(sock, None)
+            sock.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    BusBroker(sys.argv[1] if len(sys.argv) > 1 else 'unix:///tmp/noise_bus.sock',
+              secret=os.environ.get('NOISE_WEB_BUS_SECRET')).serve_forever()
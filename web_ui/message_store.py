@@ -0,0 +1,247 @@
+"""
+Shared message storage for chat rooms.
+Every room keeps a single append-only log of message records; members only
+hold a read cursor into it, so a message is stored once no matter how many
+members the room has.
+"""
+
+import threading
+import time
+import json
+from collections import deque
+from itertools import islice
+
+
+class RoomMessage:
+    """
+    A message posted to a room.
+    The sender sees the `outgoing` view and everyone else the `incoming` view;
+    both are treated as immutable once the record has been appended, which
+    lets us serialize each view to JSON exactly once.
+    """
+
+    __slots__ = ('seq', 'sender_id', 'outgoing', 'incoming', 'outgoing_json', 'incoming_json')
+
+    def __init__(self, seq, sender_id, outgoing, incoming):
+        self.seq = seq
+        self.sender_id = sender_id
+        self.outgoing = outgoing
+        self.incoming = incoming
+        self.incoming_json = json.dumps(incoming).encode('utf-8')
+        if outgoing is incoming:
+            self.outgoing_json = self.incoming_json
+        else:
+            self.outgoing_json = json.dumps(outgoing).encode('utf-8')
+
+    @classmethod
+    def from_json(cls, seq, sender_id, outgoing_json, incoming_json):
+        """
+        Rebuild a record from its serialized views, e.g. when read back from storage.
+
+        Args:
+            seq (int): Sequence number of the message in its room
+            sender_id (str): User who posted the message, None for system messages
+            outgoing_json (bytes): Serialized sender view
+            incoming_json (bytes): Serialized view for the other members
+
+        Returns:
+            RoomMessage: The record, reusing the given JSON
+        """
+        record = cls.__new__(cls)
+        record.seq = seq
+        record.sender_id = sender_id
+        record.incoming = json.loads(incoming_json)
+        record.incoming_json = bytes(incoming_json)
+        if outgoing_json == incoming_json:
+            record.outgoing = record.incoming
+            record.outgoing_json = record.incoming_json
+        else:
+            record.outgoing = json.loads(outgoing_json)
+            record.outgoing_json = bytes(outgoing_json)
+        return record
+
+    def view(self, user_id):
+        """
+        Get the message as seen by a user.
+
+        Args:
+            user_id (str): Unique identifier for the reading user
+
+        Returns:
+            dict: The message view
+        """
+        if user_id is not None and user_id == self.sender_id:
+            return self.outgoing
+        return self.incoming
+
+    def view_json(self, user_id):
+        """
+        Get the pre-serialized JSON of the message as seen by a user.
+
+        Args:
+            user_id (str): Unique identifier for the reading user
+
+        Returns:
+            bytes: UTF-8 encoded JSON object
+        """
+        if user_id is not None and user_id == self.sender_id:
+            return self.outgoing_json
+        return self.incoming_json
+
+
+class RoomLog:
+    """
+    Append-only log of the messages posted to one room.
+    Sequence numbers are allocated here, so log order and sequence order
+    always agree and a cursor read only touches the records it returns.
+    The log is a bounded ring buffer: appending past `limit` drops the
+    oldest record, so no background trimming is needed. With a durable
+    log attached every record is also written to disk, where the full
+    history stays available through history(); without one a dropped
+    record is gone and is handed to `on_drop`.
+    """
+
+    def __init__(self, limit=100, durable=None, on_drop=None):
+        """
+        Initialize the log, resuming from the durable log if there is one.
+
+        Args:
+            limit (int): Maximum number of records kept in memory
+            durable (SegmentLog): Optional on-disk log of every record
+            on_drop (callable): Called with each record that falls out of
+                the history, optional; unused with a durable log
+        """
+        self._lock = threading.Lock()
+        self._records = deque(maxlen=limit)
+        self.last_seq = 0
+        self.durable = durable
+        self.on_drop = on_drop if durable is None else None
+        if durable is not None:
+            self._records.extend(durable.read_before(None, limit))
+            self.last_seq = durable.last_seq
+
+    def append(self, sender_id, outgoing, incoming=None):
+        """
+        Append a message to the log.
+
+        Args:
+            sender_id (str): User who posted the message, None for system messages
+            outgoing (dict): View of the message for the sender
+            incoming (dict): View for the other members, defaults to `outgoing`
+
+        Returns:
+            RoomMessage: The appended record
+        """
+        if incoming is None:
+            incoming = outgoing
+
+        dropped = None
+        with self._lock:
+            seq = self.last_seq + 1
+            outgoing['seq'] = seq
+            incoming['seq'] = seq
+            record = RoomMessage(seq, sender_id, outgoing, incoming)
+            if self.durable is not None:
+                self.durable.append(record)
+            if len(self._records) == self._records.maxlen:
+                dropped = self._records[0] if self._records else record
+            self._records.append(record)
+            self.last_seq = seq
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+        return record
+
+    def records_after(self, seq):
+        """
+        Get the records with a sequence number above `seq`.
+
+        Args:
+            seq (int): Cursor, 0 to read everything still in the log
+
+        Returns:
+            list: RoomMessage records, oldest first
+        """
+        with self._lock:
+            # Sequence numbers are contiguous, so the newest records are at the right end
+            count = min(self.last_seq - seq, len(self._records))
+            if count <= 0:
+                return []
+            newer = list(islice(reversed(self._records), count))
+        newer.reverse()
+        return newer
+
+    def history(self, before, limit):
+        """
+        Get the newest records older than a sequence number, for scrollback.
+
+        Args:
+            before (int): Exclusive upper bound, None for the newest records
+            limit (int): Maximum number of records
+
+        Returns:
+            list: RoomMessage records, oldest first
+        """
+        if self.durable is not None:
+            return self.durable.read_before(before, limit)
+
+        with self._lock:
+            older = [record for record in self._records if before is None or record.seq < before]
+        return older[-limit:] if limit > 0 else []
+
+    def __len__(self):
+        return len(self._records)
+
+    def close(self):
+        """Close the durable log, if any."""
+        if self.durable is not None:
+            self.durable.close()
+
+    def delete(self):
+        """Close the log and delete the durable log, if any, with the whole history."""
+        if self.durable is not None:
+            self.durable.delete()
+
+
+class RecentEvents:
+    """
+    TTL-keyed index of recently posted events, used to suppress duplicate
+    system messages without scanning any message history.
+    """
+
+    def __init__(self, ttl=10):
+        """
+        Initialize the index.
+
+        Args:
+            ttl (float): Seconds during which a repeated event is suppressed
+        """
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._deadlines = {}  # key -> monotonic time the entry expires
+        self._expiry_order = deque()  # (deadline, key), oldest first
+
+    def record(self, key):
+        """
+        Record an event unless the same key was recorded within the TTL.
+
+        Args:
+            key (tuple): Event key, e.g. (room_id, user_id, event_type)
+
+        Returns:
+            bool: True if the event is new and should be posted, False if it is a duplicate
+        """
+        now = time.monotonic()
+        with self._lock:
+            # The TTL is constant, so entries expire in insertion order
+            while self._expiry_order and self._expiry_order[0][0] <= now:
+                deadline, expired_key = self._expiry_order.popleft()
+                if self._deadlines.get(expired_key) == deadline:
+                    del self._deadlines[expired_key]
+
+            if key in self._deadlines:
+                return False
+
+            deadline = now + self.ttl
+            self._deadlines[key] = deadline
+            self._expiry_order.append((deadline, key))
+            return True
@@ -23,6 +23,10 @@ sys.path.insert(0, parent_dir)  # Then add parent dir
 # Now import using the fully qualified path
 from noiseprotocol.Implementation.noise_chat_client import NoiseChatClient
 
+from session_registry import SessionRegistry
+from file_transfer import FileTransferSender, TransferError
+from timer_wheel import TimerWheel
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
 logger = logging.getLogger('noise_web_adapter')
@@ -32,12 +36,21 @@ class NoiseWebAdapter:
     Adapter class to integrate Noise Protocol with web interfaces.
     """
     
-    def __init__(self):
-        """Initialize the adapter."""
-        self.clients = {}  # user_id -> client_info
-        self.cleanup_thread = threading.Thread(target=self._cleanup_inactive_clients)
-        self.cleanup_thread.daemon = True
-        self.cleanup_thread.start()
+    def __init__(self, registry=None, on_disconnect=None, timers=None, idle_timeout=1800):
+        """
+        Initialize the adapter.
+        
+        Args:
+            registry (SessionRegistry): Session registry to share, a private one is created if omitted
+            on_disconnect (callable): Called with the user_id after a session has been removed
+            timers (TimerWheel): Timer wheel to schedule idle checks on, a private one is created if omitted
+            idle_timeout (float): Seconds without activity after which a client is disconnected
+        """
+        self.clients = registry if registry is not None else SessionRegistry()  # user_id -> client_info
+        self.on_disconnect = on_disconnect
+        self.idle_timeout = idle_timeout
+        self.timers = timers if timers is not None else TimerWheel()
+        self.timers.start()
     
     def create_client(self, user_id, username, host, port):
         """
@@ -48,7 +61,7 @@ class NoiseWebAdapter:
             username (str): Username for the chat
             host (str): Server hostname or IP
             port (int): Server port
-            
+        
         Returns:
             bool: True if connection was successful, False otherwise
         """
@@ -72,15 +85,19 @@ class NoiseWebAdapter:
                     """Callback for received messages."""
                     message_queue.put(message_data)
                 
-                # Store client information
-                self.clients[user_id] = {
+                # Store client information, unless another request registered the user meanwhile
+                if not self.clients.add(user_id, {
                     'client': client,
                     'username': username,
                     'message_queue': message_queue,
                     'message_hook': message_receiver,
                     'message_thread': None,
                     'last_activity': time.time()
-                }
+                }):
+                    logger.warning(f"Client already exists for user {user_id}")
+                    client.disconnect()
+                    return False
+                self.watch_idle(user_id)
                 
                 # Set username
                 if client.set_username(username):
@@ -91,41 +108,47 @@ class NoiseWebAdapter:
             else:
                 logger.error(f"Failed to connect client for user {user_id}")
                 return False
-                
+        
         except Exception as e:
             logger.error(f"Error creating client: {e}")
             return False
     
-    def disconnect_client(self, user_id):
+    def disconnect_client(self, user_id, client_info=None):
         """
         Disconnect a client.
         
         Args:
             user_id (str): Unique identifier for the user
-            
+            client_info (dict): Only disconnect if this is still the user's session
+        
         Returns:
             bool: True if disconnection was successful, False otherwise
         """
-        if user_id not in self.clients:
+        # Remove client information first so concurrent callers cannot disconnect twice
+        if client_info is None:
+            client_info = self.clients.pop(user_id)
+        elif not self.clients.remove(user_id, client_info):
+            client_info = None
+        
+        if client_info is None:
             logger.warning(f"No client found for user {user_id}")
             return False
+        self.timers.cancel(('client', user_id))
         
         try:
-            # Get client information
-            client_info = self.clients[user_id]
-            
             # Disconnect the client
             client_info['client'].disconnect()
             
-            # Remove client information
-            del self.clients[user_id]
-            
             logger.info(f"Client disconnected for user {user_id}")
             return True
-            
+        
         except Exception as e:
             logger.error(f"Error disconnecting client: {e}")
             return False
+        
+        finally:
+            if self.on_disconnect:
+                self.on_disconnect(user_id)
     
     def send_message(self, user_id, message):
         """
@@ -134,18 +157,16 @@ class NoiseWebAdapter:
         Args:
             user_id (str): Unique identifier for the user
             message (str): Message content
-            
+        
         Returns:
             bool: True if message was sent successfully, False otherwise
         """
-        if user_id not in self.clients:
+        client_info = self.clients.get(user_id)
+        if client_info is None:
             logger.warning(f"No client found for user {user_id}")
             return False
         
         try:
-            # Get client information
-            client_info = self.clients[user_id]
-            
             # Send the message
             success = client_info['client'].send_chat_message(message)
             
@@ -158,7 +179,7 @@ class NoiseWebAdapter:
             else:
                 logger.error(f"Failed to send message for user {user_id}")
                 return False
-                
+        
         except Exception as e:
             logger.error(f"Error sending message: {e}")
             return False
@@ -169,33 +190,37 @@ class NoiseWebAdapter:
         
         Args:
             user_id (str): Unique identifier for the user
-            
+        
         Returns:
             list: List of message objects
         """
-        if user_id not in self.clients:
+        client_info = self.clients.get(user_id)
+        if client_info is None:
             logger.warning(f"No client found for user {user_id}")
             return []
         
         try:
-            # Get client information
-            client_info = self.clients[user_id]
-            
             # Check if client is still connected
             if not client_info['client'].connected:
                 logger.warning(f"Client not connected for user {user_id}")
                 return []
             
+            # Sessions registered by the web app have no queue
+            message_queue = client_info.get('message_queue')
+            
             # Get messages from queue
             messages = []
-            while not client_info['message_queue'].empty():
-                messages.append(client_info['message_queue'].get_nowait())
+            while message_queue is not None:
+                try:
+                    messages.append(message_queue.get_nowait())
+                except queue.Empty:
+                    break
             
             # Update last activity time
             client_info['last_activity'] = time.time()
             
             return messages
-            
+        
         except Exception as e:
             logger.error(f"Error getting messages: {e}")
             return []
@@ -206,17 +231,15 @@ class NoiseWebAdapter:
         
         Args:
             user_id (str): Unique identifier for the user
-            
+        
         Returns:
             dict: Status information or None if client not found
         """
-        if user_id not in self.clients:
+        client_info = self.clients.get(user_id)
+        if client_info is None:
             return None
         
         try:
-            # Get client information
-            client_info = self.clients[user_id]
-            
             # Update last activity time
             client_info['last_activity'] = time.time()
             
@@ -225,74 +248,86 @@ class NoiseWebAdapter:
                 'username': client_info['username'],
                 'handshake_complete': client_info['client'].handshake_complete
             }
-            
+        
         except Exception as e:
             logger.error(f"Error getting client status: {e}")
             return None
     
-    def send_file(self, user_id, file_path):
+    def send_file(self, user_id, file_path, filename=None, transfer_id=None, progress=None):
         """
-        Send a file.
+        Send a file. Clients without a file transfer of their own stream it
+        as frames over their chat channel (see file_transfer).
         
         Args:
             user_id (str): Unique identifier for the user
-            file_path (str): Path to the file
-            
+            file_path (str or file): Path to the file, or a binary file object
+                opened for its content (e.g. a file stored encrypted)
+            filename (str): Name announced to the peer, defaults to the file's name
+            transfer_id (str): Id of the framed transfer, optional
+            progress (callable): Called with the number of frames sent, optional
+        
         Returns:
-            bool: True if file was sent successfully, False otherwise
+            dict: Details of the transfer if the file was sent
+                (True if the client sent it itself), False otherwise
         """
-        if user_id not in self.clients:
+        client_info = self.clients.get(user_id)
+        if client_info is None:
             logger.warning(f"No client found for user {user_id}")
             return False
         
         try:
-            # Get client information
-            client_info = self.clients[user_id]
+            client = client_info['client']
+            if hasattr(client, 'send_file') and isinstance(file_path, str):
+                success = client.send_file(file_path)
+            else:
+                success = FileTransferSender(client.send_chat_message).send_file(
+                    file_path, filename, transfer_id=transfer_id, progress=progress)
             
-            # Send the file
-            # This would need to be implemented in the NoiseChatClient class
-            if hasattr(client_info['client'], 'send_file'):
-                success = client_info['client'].send_file(file_path)
-                
-                # Update last activity time
-                client_info['last_activity'] = time.time()
-                
-                if success:
-                    logger.info(f"File sent for user {user_id}")
-                    return True
-                else:
-                    logger.error(f"Failed to send file for user {user_id}")
-                    return False
+            # Update last activity time
+            client_info['last_activity'] = time.time()
+            
+            if success:
+                logger.info(f"File sent for user {user_id}")
+                return success
             else:
-                logger.error(f"File sending not implemented in client")
+                logger.error(f"Failed to send file for user {user_id}")
                 return False
-                
+        
+        except TransferError as e:
+            logger.error(f"File transfer failed for user {user_id}: {e}")
+            return False
         except Exception as e:
             logger.error(f"Error sending file: {e}")
             return False
     
-    def _cleanup_inactive_clients(self):
+    def watch_idle(self, user_id):
         """
-        Periodically cleanup inactive clients.
+        Schedule the idle timeout of a registered session.
+        Activity only has to update `last_activity`; the timer re-checks it
+        when it fires and pushes itself back if the client was active.
+        
+        Args:
+            user_id (str): Unique identifier for the user
         """
-        while True:
-            try:
-                # Sleep for a while
-                time.sleep(60)  # Check every minute
-                
-                # Get current time
-                current_time = time.time()
-                
-                # Find inactive clients (no activity for 30 minutes)
-                inactive_users = []
-                for user_id, client_info in self.clients.items():
-                    if current_time - client_info['last_activity'] > 1800:  # 30 minutes
-                        inactive_users.append(user_id)
-                
-                # Disconnect inactive clients
-                for user_id in inactive_users:
-                    logger.info(f"Disconnecting inactive client for user {user_id}")
-                    self.disconnect_client(user_id)
-                    
-            except Exception as e:
-                logger.error(f"Error in cleanup thread: {e}")
\ No newline at end of file
+        client_info = self.clients.get(user_id)
+        if client_info is None:
+            return
+        
+        deadline = client_info.get('last_activity', time.time()) + self.idle_timeout
+        self.timers.schedule(('client', user_id), deadline, lambda: self._expire_idle(user_id, client_info))
+    
+    def _expire_idle(self, user_id, client_info):
+        """
+        Disconnect a client whose idle timer fired, unless it has been active since.
+        """
+        # The user may have disconnected and reconnected in the meantime
+        if self.clients.get(user_id) is not client_info:
+            return
+        
+        deadline = client_info.get('last_activity', 0) + self.idle_timeout
+        if deadline > time.time():
+            self.timers.schedule(('client', user_id), deadline, lambda: self._expire_idle(user_id, client_info))
+            return
+        
+        logger.info(f"Disconnecting inactive client for user {user_id}")
+        self.disconnect_client(user_id, client_info)
@@ -0,0 +1,342 @@
+"""
+Resumable, chunked uploads.
+
+A client creates an upload session for a file of known size, then PUTs
+the file in fixed-size chunks, each at its byte offset, in any order and
+in parallel. Chunks are written straight into a preallocated partial
+file, so a chunk costs no more memory than one read buffer, and the set
+of received chunks is saved next to it: after an interruption (or a
+server restart) the client asks which chunks are missing and sends only
+those. Once every chunk is in, the session is finalized into a regular
+UploadSpool and stored like any other upload. Sessions nobody writes to
+for the timeout are deleted, including those a restart left on disk.
+
+With an at-rest cipher the partial file is laid out as a sealed file of
+the announced size: the header is written when the session starts and
+every chunk is sealed in place as it arrives (upload chunks are whole
+multiples of the cipher's chunks), so no plaintext is ever written.
+
+Layout of the partial upload folder:
+    <upload id>.part   the file being assembled
+    <upload id>.json   session metadata and received chunks
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+import logging
+
+from at_rest import HEADER, read_full
+from upload_spool import UploadSpool, CHUNK_SIZE
+
+logger = logging.getLogger('noise_web_upload')
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class UploadError(Exception):
+    """A request that does not fit the upload session."""
+
+
+class UploadSession:
+    """
+    One file being uploaded in chunks.
+    """
+
+    def __init__(self, directory, upload_id, user_id, room_id, filename, size, chunk_size, received=(),
+                 cipher=None):
+        self.upload_id = upload_id
+        self.user_id = user_id
+        self.room_id = room_id
+        self.filename = filename
+        self.size = size
+        self.chunk_size = chunk_size
+        self.chunk_count = max(1, -(-size // chunk_size))
+        self.received = set(received)
+        self.part_path = os.path.join(directory, upload_id + '.part')
+        self.meta_path = os.path.join(directory, upload_id + '.json')
+        self.lock = threading.Lock()
+        self.finalizing = False
+        self.writers = 0  # Chunk writes in progress; finalize waits for them
+        self.writers_done = threading.Condition(self.lock)
+        self.cipher = cipher
+
+    def chunk_length(self, index):
+        """Expected length of a chunk; the last one may be shorter."""
+        if index == self.chunk_count - 1:
+            return self.size - index * self.chunk_size
+        return self.chunk_size
+
+    def missing(self):
+        """Indexes of the chunks not received yet, ascending."""
+        return [index for index in range(self.chunk_count) if index not in self.received]
+
+    def status(self):
+        """Session state as returned to the client."""
+        return {
+            'upload_id': self.upload_id,
+            'filename': self.filename,
+            'room_id': self.room_id,
+            'size': self.size,
+            'chunk_size': self.chunk_size,
+            'chunk_count': self.chunk_count,
+            'received': len(self.received),
+            'missing': self.missing()
+        }
+
+    def save(self):
+        """Write the session metadata atomically (lock held)."""
+        temp_path = self.meta_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({
+                'user_id': self.user_id,
+                'room_id': self.room_id,
+                'filename': self.filename,
+                'size': self.size,
+                'chunk_size': self.chunk_size,
+                'received': sorted(self.received)
+            }, f)
+        os.replace(temp_path, self.meta_path)
+
+    def write_chunk(self, offset, stream):
+        """
+        Write one chunk read from a stream at its offset.
+
+        Args:
+            offset (int): Byte offset of the chunk, a multiple of chunk_size
+            stream: Readable request body
+
+        Returns:
+            int: Index of the chunk
+
+        Raises:
+            UploadError: If the offset or the body length is wrong
+        """
+        if offset < 0 or offset % self.chunk_size or offset >= max(self.size, 1):
+            raise UploadError(f'Offset {offset} is not the start of a chunk')
+        index = offset // self.chunk_size
+        expected = self.chunk_length(index)
+
+        # Once finalize() has begun the partial file is no longer ours to write
+        with self.lock:
+            if self.finalizing:
+                raise UploadError('Upload is already being finalized')
+            self.writers += 1
+        written = 0
+        try:
+            # Chunks are disjoint, so parallel writers never need to coordinate
+            fd = os.open(self.part_path, os.O_RDWR)
+            try:
+                if self.cipher is not None:
+                    written = self._write_sealed(fd, offset, expected, stream)
+                else:
+                    while written <= expected:
+                        data = stream.read(min(CHUNK_SIZE, expected + 1 - written))
+                        if not data:
+                            break
+                        os.pwrite(fd, data, offset + written)
+                        written += len(data)
+            finally:
+                os.close(fd)
+        finally:
+            with self.lock:
+                # A failed write may have clobbered a chunk that was already in
+                if (written == expected) != (index in self.received):
+                    if written == expected:
+                        self.received.add(index)
+                    else:
+                        self.received.discard(index)
+                    self.save()
+                self.writers -= 1
+                if not self.writers:
+                    self.writers_done.notify_all()
+        if written != expected:
+            raise UploadError(f'Chunk {index} must be {expected} bytes, got {written}')
+        return index
+
+    def _write_sealed(self, fd, offset, expected, stream):
+        """Seal a chunk cipher chunk by cipher chunk into the partial file, returning the bytes read."""
+        sealer = self.cipher.sealer(os.pread(fd, HEADER.size, 0))
+        buffer = bytearray(sealer.chunk_size)
+        view = memoryview(buffer)
+        first = offset // sealer.chunk_size
+        last = self.cipher.chunk_count(self.size, sealer.chunk_size) - 1
+        written = 0
+        for index in range(first, first + self.cipher.chunk_count(expected, sealer.chunk_size)):
+            n = read_full(stream, view[:min(sealer.chunk_size, expected - written)])
+            written += n
+            if written < expected and n < sealer.chunk_size:
+                return written
+            os.pwrite(fd, sealer.seal(index, view[:n], index == last), sealer.offset(index))
+        # Anything past the chunk is an error
+        return written + len(stream.read(1))
+
+
+class UploadSessions:
+    """
+    Upload sessions of this process, backed by the partial upload folder.
+    """
+
+    def __init__(self, directory, timers=None, timeout=24 * 3600, max_size=1024 * 1024 * 1024,
+                 chunk_size=DEFAULT_CHUNK_SIZE, cipher=None):
+        """
+        Initialize the sessions.
+
+        Args:
+            directory (str): Folder holding partial uploads
+            timers (TimerWheel): Wheel expiring abandoned sessions, optional
+            timeout (float): Seconds a session may sit idle before it is deleted
+            max_size (int): Largest file accepted
+            chunk_size (int): Chunk size handed to clients
+            cipher (AtRestCipher): Seals partial files, optional; chunk_size
+                must be a multiple of its chunk size
+        """
+        if cipher is not None and chunk_size % cipher.chunk_size:
+            raise ValueError('Upload chunk size must be a multiple of the at-rest chunk size')
+        self.directory = directory
+        self.timers = timers
+        self.timeout = timeout
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.cipher = cipher
+        self._lock = threading.Lock()
+        self._sessions = {}
+        os.makedirs(directory, exist_ok=True)
+
+        # Sessions left by an earlier process expire like the ones started here
+        for upload_id in {name.split('.', 1)[0] for name in os.listdir(directory)}:
+            if upload_id.isalnum():
+                self._expire_stale(upload_id)
+
+    def create(self, user_id, room_id, filename, size):
+        """
+        Start an upload session and preallocate its partial file.
+
+        Raises:
+            UploadError: If the size is out of range
+        """
+        if size < 0 or size > self.max_size:
+            raise UploadError(f'File size must be between 0 and {self.max_size} bytes')
+        session = UploadSession(self.directory, uuid.uuid4().hex, user_id, room_id, filename, size,
+                                self.chunk_size, cipher=self.cipher)
+        with open(session.part_path, 'wb') as f:
+            if self.cipher is not None:
+                f.write(self.cipher.new_header())
+                f.truncate(self.cipher.sealed_size(size))
+            else:
+                f.truncate(size)
+        with session.lock:
+            session.save()
+        with self._lock:
+            self._sessions[session.upload_id] = session
+        self.touch(session)
+        logger.info(f"Upload session {session.upload_id} started for {filename} ({size} bytes)")
+        return session
+
+    def get(self, upload_id, user_id):
+        """
+        Find a session of a user, loading it from disk after a restart.
+
+        Returns:
+            UploadSession: The session, or None if there is none
+        """
+        if not upload_id.isalnum():
+            return None
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            if session is None:
+                session = self._load(upload_id)
+                if session is not None:
+                    self._sessions[upload_id] = session
+        if session is None or session.user_id != user_id:
+            return None
+        self.touch(session)
+        return session
+
+    def _load(self, upload_id):
+        meta_path = os.path.join(self.directory, upload_id + '.json')
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return UploadSession(self.directory, upload_id, meta['user_id'], meta['room_id'], meta['filename'],
+                             meta['size'], meta['chunk_size'], meta['received'], self.cipher)
+
+    def touch(self, session):
+        """Push back the expiry of a session."""
+        if self.timers is not None:
+            self.timers.schedule(('upload', session.upload_id), time.time() + self.timeout,
+                                 lambda: self.discard(session.upload_id))
+
+    def _expire_stale(self, upload_id):
+        """
+        Delete a session found on disk once its files have not been written
+        to for the timeout. Another process may still be receiving its
+        chunks, so the deadline follows the files' modification times.
+        """
+        last_write = None
+        for suffix in ('.json', '.part'):
+            try:
+                mtime = os.path.getmtime(os.path.join(self.directory, upload_id + suffix))
+            except OSError:
+                continue
+            last_write = mtime if last_write is None else max(last_write, mtime)
+        if last_write is None:
+            return
+        deadline = last_write + self.timeout
+        if deadline <= time.time():
+            logger.info(f"Deleting abandoned upload session {upload_id}")
+            self.discard(upload_id)
+        elif self.timers is not None:
+            self.timers.schedule(('upload', upload_id), deadline, lambda: self._expire_stale(upload_id))
+
+    def finalize(self, session):
+        """
+        Turn a complete session into a spool holding the assembled file.
+
+        Returns:
+            UploadSpool: The spool, owning the partial file from now on
+
+        Raises:
+            UploadError: If chunks are missing or the session is already being finalized
+        """
+        with session.lock:
+            if session.finalizing:
+                raise UploadError('Upload is already being finalized')
+            # Refuse new chunks, then let the ones being written finish
+            session.finalizing = True
+            while session.writers:
+                session.writers_done.wait()
+            missing = session.missing()
+            if missing:
+                session.finalizing = False
+                raise UploadError(f'{len(missing)} chunks are still missing')
+        try:
+            spool = UploadSpool.from_file(session.part_path, cipher=self.cipher)
+        except Exception:
+            with session.lock:
+                session.finalizing = False
+            raise
+        self._forget(session.upload_id, remove_part=False)
+        return spool
+
+    def discard(self, upload_id):
+        """Delete a session and its partial file."""
+        self._forget(upload_id, remove_part=True)
+
+    def _forget(self, upload_id, remove_part):
+        with self._lock:
+            self._sessions.pop(upload_id, None)
+        if self.timers is not None:
+            self.timers.cancel(('upload', upload_id))
+        paths = [os.path.join(self.directory, upload_id + '.json')]
+        if remove_part:
+            paths.append(os.path.join(self.directory, upload_id + '.part'))
+        for path in paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,308 @@
+"""
+Incremental full-text search over room messages.
+
+Messages are tokenized once, when they are posted, into a per-room
+inverted index. Each term's posting list is a byte string of varint
+encoded (sequence number delta, term frequency) pairs, cut into blocks of
+BLOCK_SIZE postings with a skip entry per block. A query decodes the
+posting list of its rarest term and only seeks into the blocks of the
+other terms that can still match, so its cost follows the rarest term
+rather than the size of the room. Queries made only of very common words
+consider the newest MAX_CANDIDATES matches. Matches are ranked with BM25,
+newer messages first on ties.
+
+Sequence numbers are contiguous within a room, which lets the index
+notice messages it has not seen (posted by another worker, or before a
+restart) and pull them from the room log before answering a query.
+"""
+
+import heapq
+import math
+import re
+import threading
+from array import array
+from bisect import bisect_right
+
+TOKEN_PATTERN = re.compile(r'\w+')
+MAX_TOKEN_LENGTH = 64
+BLOCK_SIZE = 128
+CATCH_UP_PAGE = 1000
+
+# Queries made only of very common words rank the newest this many matches of
+# their rarest word instead of every message in the room
+MAX_CANDIDATES = 4096
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    """
+    Split text into lowercase search terms.
+
+    Args:
+        text (str): Message text or query
+
+    Returns:
+        list: Terms in order of appearance
+    """
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if len(token) <= MAX_TOKEN_LENGTH]
+
+
+def message_text(message):
+    """Get the searchable text of a stored message: its content and file name."""
+    text = message.get('content') or ''
+    file_info = message.get('file_info')
+    if isinstance(file_info, dict) and file_info.get('filename'):
+        text = f"{text} {file_info['filename']}"
+    return str(text)
+
+
+def _write_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+class PostingList:
+    """
+    Ascending (seq, frequency) postings of one term, delta-encoded in blocks.
+    """
+
+    __slots__ = ('data', 'count', 'last_seq', 'block_seqs', 'block_offsets')
+
+    def __init__(self):
+        self.data = bytearray()
+        self.count = 0
+        self.last_seq = 0
+        self.block_seqs = array('Q')  # First seq of each block
+        self.block_offsets = array('Q')  # Byte offset of each block
+
+    def add(self, seq, frequency):
+        """Append a posting; `seq` must be above every seq already in the list."""
+        if self.count % BLOCK_SIZE == 0:
+            # Blocks start from zero so each one decodes on its own
+            self.block_seqs.append(seq)
+            self.block_offsets.append(len(self.data))
+            self.last_seq = 0
+        _write_varint(self.data, seq - self.last_seq)
+        _write_varint(self.data, frequency)
+        self.count += 1
+        self.last_seq = seq
+
+    def decode_block(self, block):
+        """Decode one block into a list of (seq, frequency) pairs."""
+        data = self.data
+        offset = self.block_offsets[block]
+        end = self.block_offsets[block + 1] if block + 1 < len(self.block_offsets) else len(data)
+        postings = []
+        seq = 0
+        while offset < end:
+            delta, offset = _read_varint(data, offset)
+            frequency, offset = _read_varint(data, offset)
+            seq += delta
+            postings.append((seq, frequency))
+        return postings
+
+    def __iter__(self):
+        for block in range(len(self.block_offsets)):
+            yield from self.decode_block(block)
+
+    def frequencies(self, seqs):
+        """
+        Look up the term frequency of some messages.
+
+        Args:
+            seqs (list): Ascending sequence numbers
+
+        Returns:
+            dict: seq -> frequency for the messages containing the term
+        """
+        found = {}
+        decoded_block = -1
+        postings = {}
+        for seq in seqs:
+            block = bisect_right(self.block_seqs, seq) - 1
+            if block < 0:
+                continue
+            if block != decoded_block:
+                postings = dict(self.decode_block(block))
+                decoded_block = block
+            frequency = postings.get(seq)
+            if frequency:
+                found[seq] = frequency
+        return found
+
+
+class RoomIndex:
+    """
+    Inverted index of one room's messages.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.source = None  # The room log the index was built from
+        self.reset()
+
+    def reset(self):
+        """Drop everything indexed so far."""
+        self.postings = {}  # term -> PostingList
+        self.lengths = array('I')  # Terms per message, by seq - base_seq
+        self.base_seq = None
+        self.last_seq = 0
+        self.documents = 0
+        self.total_length = 0
+
+    def add(self, seq, text):
+        """Index a message with a sequence number above last_seq (lock held)."""
+        tokens = tokenize(text)
+        if self.base_seq is None:
+            self.base_seq = seq
+        gap = seq - self.base_seq - len(self.lengths)
+        if gap > 0:
+            self.lengths.extend([0] * gap)  # Messages that were no longer available
+        self.lengths.append(len(tokens))
+        self.last_seq = seq
+        if not tokens:
+            return
+
+        self.documents += 1
+        self.total_length += len(tokens)
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for term, frequency in counts.items():
+            posting_list = self.postings.get(term)
+            if posting_list is None:
+                posting_list = self.postings[term] = PostingList()
+            posting_list.add(seq, frequency)
+
+    def search(self, terms, limit, after=0):
+        """
+        Rank the messages newer than `after` containing every term (lock held).
+
+        Returns:
+            list: (score, seq) pairs, best first
+        """
+        posting_lists = [self.postings.get(term) for term in terms]
+        if not terms or None in posting_lists:
+            return []
+        posting_lists.sort(key=lambda posting_list: posting_list.count)
+
+        rarest_list = posting_lists[0]
+        rarest = {}
+        for block in range(len(rarest_list.block_offsets) - 1, -1, -1):
+            rarest.update(rarest_list.decode_block(block))
+            if len(rarest) >= MAX_CANDIDATES:
+                break
+        seqs = sorted(seq for seq in rarest if seq > after)
+        if not seqs:
+            return []
+        term_frequencies = [rarest]
+        for posting_list in posting_lists[1:]:
+            found = posting_list.frequencies(seqs)
+            seqs = [seq for seq in seqs if seq in found]
+            if not seqs:
+                return []
+            term_frequencies.append(found)
+
+        documents = self.documents
+        average_length = self.total_length / documents
+        weights = [math.log(1 + (documents - pl.count + 0.5) / (pl.count + 0.5)) for pl in posting_lists]
+
+        def score(seq):
+            norm = K1 * (1 - B + B * self.lengths[seq - self.base_seq] / average_length)
+            total = 0.0
+            for weight, frequencies in zip(weights, term_frequencies):
+                frequency = frequencies[seq]
+                total += weight * frequency * (K1 + 1) / (frequency + norm)
+            return total
+
+        return heapq.nlargest(limit, ((score(seq), seq) for seq in seqs))
+
+
+class SearchIndex:
+    """
+    Full-text indexes of all rooms, keyed by room id.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rooms = {}
+
+    def _room(self, room_id, log):
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                room = self._rooms[room_id] = RoomIndex()
+        if room.source is not log:
+            # First use, or the room was removed and created again
+            with room.lock:
+                if room.source is not log:
+                    room.reset()
+                    room.source = log
+        return room
+
+    def add(self, room_id, log, record):
+        """
+        Index a message right after it was appended to a room log.
+        Records arriving out of order are skipped here and picked up from the
+        log by the next search.
+
+        Args:
+            room_id (str): Room the message was posted to
+            log (RoomLog): The room's log
+            record (RoomMessage): The appended record
+        """
+        room = self._room(room_id, log)
+        with room.lock:
+            if record.seq == room.last_seq + 1:
+                room.add(record.seq, message_text(record.incoming))
+
+    def forget(self, room_id):
+        """Drop the index of a removed room."""
+        with self._lock:
+            self._rooms.pop(room_id, None)
+
+    def search(self, room_id, log, query, limit=20, after=0):
+        """
+        Search a room's messages.
+
+        Args:
+            room_id (str): Room to search
+            log (RoomLog): The room's log, used to index messages missed so far
+            query (str): Words that must all appear in a message
+            limit (int): Maximum number of results
+            after (int): Only match messages with a higher sequence number
+
+        Returns:
+            list: (score, seq) pairs, best first
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        room = self._room(room_id, log)
+        with room.lock:
+            self._catch_up(room, log)
+            return room.search(terms, limit, after)
+
+    def _catch_up(self, room, log):
+        """Index the messages of the log the room index has not seen (lock held)."""
+        while room.last_seq < log.last_seq:
+            end = min(room.last_seq + CATCH_UP_PAGE, log.last_seq)
+            for record in log.history(end + 1, end - room.last_seq):
+                if record.seq > room.last_seq:
+                    room.add(record.seq, message_text(record.incoming))
+            # Messages the log no longer holds stay unindexed
+            room.last_seq = end
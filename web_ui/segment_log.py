@@ -0,0 +1,382 @@
+"""
+Durable, append-only message log for one room, split into segment files.
+
+Each segment is a pair of files named after the sequence number of its
+first record:
+    00000000000000000001.log   records, back to back
+    00000000000000000001.idx   sparse index: (seq, byte offset) every
+                               `index_interval` bytes of records
+
+Appends go straight to the active segment; fsync is batched by a shared
+background thread every `fsync_interval` seconds (group commit), so a burst
+of messages costs one fsync. Reads map segments into memory and use the
+sparse index to jump close to the requested sequence number, so serving a
+page of deep history touches only a few pages of one or two files.
+
+Open files are bounded per process, not per room: only the MAX_OPEN_LOGS
+most recently used logs keep their files and maps open (a map holds a file
+descriptor of its own), the others close them and reopen on their next
+append or read.
+"""
+
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+import zlib
+import logging
+from bisect import bisect_right
+from collections import OrderedDict
+
+from message_store import RoomMessage
+
+logger = logging.getLogger('noise_web_history')
+
+# seq, crc32 of the body, then the lengths of sender id, outgoing view and
+# incoming view; an incoming length of 0 means "same as outgoing"
+RECORD_HEADER = struct.Struct('>QIHII')
+INDEX_ENTRY = struct.Struct('>QQ')
+SEGMENT_NAME = '{:020d}'
+# Logs keeping their files open; each holds its two active files and the maps of its last read
+MAX_OPEN_LOGS = 128
+
+
+class _SyncThread:
+    """
+    Group commit: logs with unsynced appends register here and get fsynced
+    together after at most `interval` seconds.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._condition = threading.Condition()
+        self._dirty = set()
+        thread = threading.Thread(target=self._run, name='history-fsync')
+        thread.daemon = True
+        thread.start()
+
+    def mark(self, log):
+        with self._condition:
+            if not self._dirty:
+                self._condition.notify()
+            self._dirty.add(log)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._dirty:
+                    self._condition.wait()
+            time.sleep(self.interval)
+            with self._condition:
+                dirty, self._dirty = self._dirty, set()
+            for log in dirty:
+                try:
+                    log.sync()
+                except Exception as e:
+                    logger.error(f"Error syncing {log.directory}: {e}")
+
+
+_sync_threads = {}
+_sync_threads_lock = threading.Lock()
+
+
+def _sync_thread(interval):
+    with _sync_threads_lock:
+        thread = _sync_threads.get(interval)
+        if thread is None:
+            thread = _sync_threads[interval] = _SyncThread(interval)
+        return thread
+
+
+class _OpenLogs:
+    """
+    The logs holding open files, least recently used first.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._logs = OrderedDict()
+
+    def touch(self, log):
+        """Record that a log used its files; returns the logs that must now close theirs."""
+        with self._lock:
+            self._logs[log] = None
+            self._logs.move_to_end(log)
+            evicted = []
+            while len(self._logs) > self.capacity:
+                evicted.append(self._logs.popitem(last=False)[0])
+            return evicted
+
+    def discard(self, log):
+        with self._lock:
+            self._logs.pop(log, None)
+
+    def __len__(self):
+        return len(self._logs)
+
+
+_open_logs = _OpenLogs(MAX_OPEN_LOGS)
+
+
+class Segment:
+    """
+    One segment file with its sparse index.
+    """
+
+    def __init__(self, directory, base_seq):
+        self.base_seq = base_seq
+        name = SEGMENT_NAME.format(base_seq)
+        self.log_path = os.path.join(directory, name + '.log')
+        self.index_path = os.path.join(directory, name + '.idx')
+        self.index = []  # [(seq, offset)], ascending
+        self.size = 0
+        self.last_seq = base_seq - 1
+        self._map = None
+        self._mapped_size = 0
+
+    def load(self, recover=False):
+        """
+        Load the index and size of an existing segment. With `recover`, scan
+        the records after the last index entry and cut off a torn tail left
+        by a crash.
+        """
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                data = f.read()
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            self.index = [INDEX_ENTRY.unpack_from(data, offset) for offset in range(0, usable, INDEX_ENTRY.size)]
+        self.size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+
+        if not recover:
+            return
+
+        # Index entries pointing past the data belong to records that never made it to disk
+        self.index = [entry for entry in self.index if entry[1] < self.size]
+        offset = self.index[-1][1] if self.index else 0
+        last_seq = self.index[-1][0] - 1 if self.index else self.base_seq - 1
+        with open(self.log_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        position = 0
+        while position + RECORD_HEADER.size <= len(data):
+            seq, crc, sender_len, outgoing_len, incoming_len = RECORD_HEADER.unpack_from(data, position)
+            body_start = position + RECORD_HEADER.size
+            body_end = body_start + sender_len + outgoing_len + incoming_len
+            if body_end > len(data) or zlib.crc32(data[body_start:body_end]) != crc:
+                break
+            last_seq = seq
+            position = body_end
+
+        if offset + position < self.size:
+            logger.warning(f"Truncating torn tail of {self.log_path} at {offset + position} bytes")
+            with open(self.log_path, 'r+b') as f:
+                f.truncate(offset + position)
+            self.size = offset + position
+        with open(self.index_path, 'wb') as f:
+            f.write(b''.join(INDEX_ENTRY.pack(*entry) for entry in self.index))
+        self.last_seq = last_seq
+
+    def view(self):
+        """Memory map of the segment's records, remapped when the segment has grown."""
+        if self._map is None or self._mapped_size < self.size:
+            if self._map is not None:
+                self._map.close()
+            with open(self.log_path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), self.size, access=mmap.ACCESS_READ)
+            self._mapped_size = self.size
+        return self._map
+
+    def offset_for(self, seq):
+        """Byte offset of the last indexed record at or before `seq`."""
+        position = bisect_right(self.index, (seq, float('inf')))
+        return self.index[position - 1][1] if position else 0
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+class SegmentLog:
+    """
+    Durable log of a room's RoomMessage records, addressed by sequence number.
+    Sequence numbers must be appended in increasing order.
+    """
+
+    def __init__(self, directory, segment_bytes=8 * 1024 * 1024, index_interval=4096, fsync_interval=0.05):
+        """
+        Open (or create) the log stored in `directory`.
+
+        Args:
+            directory (str): Directory holding the room's segments
+            segment_bytes (int): Size at which a new segment is started
+            index_interval (int): Bytes of records between sparse index entries
+            fsync_interval (float): Longest time an append stays unsynced
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self._syncer = _sync_thread(fsync_interval)
+        self._lock = threading.Lock()
+        self._log_file = None
+        self._index_file = None
+        self._indexed_at = 0  # Offset of the last index entry in the active segment
+
+        os.makedirs(directory, exist_ok=True)
+        bases = sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith('.log'))
+        self._segments = [Segment(directory, base) for base in bases]
+        self._bases = bases
+        for segment in self._segments[:-1]:
+            segment.load()
+        if self._segments:
+            active = self._segments[-1]
+            active.load(recover=True)
+            self._indexed_at = active.index[-1][1] if active.index else 0
+            for segment, following in zip(self._segments, self._segments[1:]):
+                segment.last_seq = following.base_seq - 1
+
+    @property
+    def last_seq(self):
+        """Sequence number of the newest record, 0 if the log is empty."""
+        return self._segments[-1].last_seq if self._segments else 0
+
+    @property
+    def first_seq(self):
+        """Sequence number of the oldest record, 0 if the log is empty."""
+        return self._segments[0].base_seq if self._segments else 0
+
+    def _open_segment(self, base_seq):
+        """Start a new active segment (lock held)."""
+        self._close_files()
+        segment = Segment(self.directory, base_seq)
+        self._segments.append(segment)
+        self._bases.append(base_seq)
+        self._indexed_at = None
+        return segment
+
+    def _close_files(self):
+        for f in (self._log_file, self._index_file):
+            if f is not None:
+                os.fsync(f.fileno())
+                f.close()
+        self._log_file = self._index_file = None
+
+    def append(self, record):
+        """
+        Append a record. It is durable once the next group commit ran.
+
+        Args:
+            record (RoomMessage): Record with a sequence number above last_seq
+        """
+        sender = (record.sender_id or '').encode('utf-8')
+        outgoing = record.outgoing_json
+        incoming = b'' if record.incoming_json is record.outgoing_json else record.incoming_json
+        body = sender + outgoing + incoming
+        data = RECORD_HEADER.pack(record.seq, zlib.crc32(body), len(sender), len(outgoing), len(incoming)) + body
+
+        with self._lock:
+            if record.seq <= self.last_seq:
+                raise ValueError(f"Sequence number {record.seq} is not after {self.last_seq}")
+
+            segment = self._segments[-1] if self._segments else None
+            if segment is None or segment.size >= self.segment_bytes:
+                segment = self._open_segment(record.seq)
+            if self._log_file is None:
+                self._log_file = open(segment.log_path, 'ab', buffering=0)
+                self._index_file = open(segment.index_path, 'ab', buffering=0)
+
+            if self._indexed_at is None or segment.size - self._indexed_at >= self.index_interval:
+                self._index_file.write(INDEX_ENTRY.pack(record.seq, segment.size))
+                segment.index.append((record.seq, segment.size))
+                self._indexed_at = segment.size
+
+            self._log_file.write(data)
+            segment.size += len(data)
+            segment.last_seq = record.seq
+
+        self._syncer.mark(self)
+        self._used()
+
+    def _used(self):
+        """Move up in the open logs, closing the files of those pushed out (lock not held)."""
+        for log in _open_logs.touch(self):
+            log.release_files()
+
+    def release_files(self):
+        """Sync and close the open files and maps; they are reopened when next needed."""
+        with self._lock:
+            self._close_files()
+            for segment in self._segments:
+                segment.close()
+
+    def sync(self):
+        """Flush appended records to stable storage."""
+        with self._lock:
+            for f in (self._log_file, self._index_file):
+                if f is not None:
+                    os.fsync(f.fileno())
+
+    def read_before(self, before, limit):
+        """
+        Read the newest records older than a sequence number.
+
+        Args:
+            before (int): Exclusive upper bound, None for the newest records
+            limit (int): Maximum number of records
+
+        Returns:
+            list: RoomMessage records, oldest first
+        """
+        with self._lock:
+            end = self.last_seq + 1 if before is None else min(before, self.last_seq + 1)
+            start = max(self.first_seq, end - limit)
+            records = []
+            if limit <= 0 or start >= end:
+                return records
+
+            position = max(bisect_right(self._bases, start) - 1, 0)
+            read = set()
+            for index in range(position, len(self._segments)):
+                segment = self._segments[index]
+                if segment.base_seq >= end:
+                    break
+                if segment.size == 0:
+                    continue
+                self._read_segment(segment, start, end, records)
+                read.add(index)
+            # Only the segments of the latest read stay mapped
+            for index, segment in enumerate(self._segments):
+                if index not in read:
+                    segment.close()
+        self._used()
+        return records
+
+    def _read_segment(self, segment, start, end, records):
+        """Decode the records of a segment with start <= seq < end (lock held)."""
+        data = segment.view()
+        offset = segment.offset_for(start)
+        while offset + RECORD_HEADER.size <= segment.size:
+            seq, _, sender_len, outgoing_len, incoming_len = RECORD_HEADER.unpack_from(data, offset)
+            if seq >= end:
+                return
+            body = offset + RECORD_HEADER.size
+            offset = body + sender_len + outgoing_len + incoming_len
+            if seq < start:
+                continue
+            sender_id = data[body:body + sender_len].decode('utf-8') or None
+            outgoing = data[body + sender_len:body + sender_len + outgoing_len]
+            incoming = data[body + sender_len + outgoing_len:offset] or outgoing
+            records.append(RoomMessage.from_json(seq, sender_id, outgoing, incoming))
+
+    def close(self):
+        """Sync and close the log's files."""
+        _open_logs.discard(self)
+        self.release_files()
+
+    def delete(self):
+        """Close the log and delete its directory with every segment."""
+        self.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,170 @@
+"""
+Thread-safe registry of connected chat sessions.
+The registry is shared by the Flask app and the NoiseWebAdapter so both see
+the same user_id -> client_info mapping. Writers take one of several striped
+locks chosen by user_id, so unrelated users never contend; readers take no
+lock at all.
+"""
+
+import threading
+import time
+
+
+class SessionRegistry:
+    """
+    Striped, copy-on-write map of user_id -> client_info.
+    Each stripe is a plain dict that is never mutated once published: a writer
+    copies its stripe under the stripe lock, edits the copy and swaps it in.
+    Readers just pick up the current dict, so lookups and iteration never
+    block and never see a dict changing under them.
+    """
+
+    def __init__(self, stripes=32):
+        """
+        Initialize an empty registry.
+
+        Args:
+            stripes (int): Number of independent lock stripes
+        """
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._maps = [{} for _ in range(stripes)]
+
+    def _index(self, user_id):
+        return hash(user_id) % len(self._maps)
+
+    def get(self, user_id, default=None):
+        """
+        Get the client info of a user without locking.
+
+        Args:
+            user_id (str): Unique identifier for the user
+            default: Value returned when the user has no session
+
+        Returns:
+            dict: The client info, or `default`
+        """
+        return self._maps[self._index(user_id)].get(user_id, default)
+
+    def __getitem__(self, user_id):
+        return self._maps[self._index(user_id)][user_id]
+
+    def __contains__(self, user_id):
+        return user_id in self._maps[self._index(user_id)]
+
+    def __len__(self):
+        return sum(len(stripe) for stripe in self._maps)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        """Snapshot of the registered user ids."""
+        return [user_id for stripe in self._maps for user_id in stripe]
+
+    def items(self):
+        """Snapshot of the (user_id, client_info) pairs."""
+        return [item for stripe in self._maps for item in stripe.items()]
+
+    def __setitem__(self, user_id, client_info):
+        index = self._index(user_id)
+        with self._locks[index]:
+            stripe = dict(self._maps[index])
+            stripe[user_id] = client_info
+            self._maps[index] = stripe
+
+    def add(self, user_id, client_info):
+        """
+        Register a session unless the user already has one.
+
+        Args:
+            user_id (str): Unique identifier for the user
+            client_info (dict): Session state
+
+        Returns:
+            bool: True if the session was added, False if the user was already registered
+        """
+        index = self._index(user_id)
+        with self._locks[index]:
+            if user_id in self._maps[index]:
+                return False
+            stripe = dict(self._maps[index])
+            stripe[user_id] = client_info
+            self._maps[index] = stripe
+            return True
+
+    def pop(self, user_id, default=None):
+        """
+        Remove and return the session of a user.
+        Only one of several concurrent callers gets the session back.
+
+        Args:
+            user_id (str): Unique identifier for the user
+            default: Value returned when the user has no session
+
+        Returns:
+            dict: The removed client info, or `default`
+        """
+        index = self._index(user_id)
+        with self._locks[index]:
+            if user_id not in self._maps[index]:
+                return default
+            stripe = dict(self._maps[index])
+            client_info = stripe.pop(user_id)
+            self._maps[index] = stripe
+            return client_info
+
+    def __delitem__(self, user_id):
+        if self.pop(user_id) is None:
+            raise KeyError(user_id)
+
+    def remove(self, user_id, client_info):
+        """
+        Remove a session only if it is still the given one, so a sweep working
+        from a snapshot cannot drop a session that reconnected in the meantime.
+
+        Args:
+            user_id (str): Unique identifier for the user
+            client_info (dict): Session the caller expects to remove
+
+        Returns:
+            bool: True if the session was removed
+        """
+        index = self._index(user_id)
+        with self._locks[index]:
+            if self._maps[index].get(user_id) is not client_info:
+                return False
+            stripe = dict(self._maps[index])
+            del stripe[user_id]
+            self._maps[index] = stripe
+            return True
+
+    def touch(self, user_id):
+        """
+        Record activity for a user.
+
+        Args:
+            user_id (str): Unique identifier for the user
+
+        Returns:
+            bool: True if the user has a session
+        """
+        client_info = self.get(user_id)
+        if client_info is None:
+            return False
+        client_info['last_activity'] = time.time()
+        return True
+
+    def idle(self, max_idle, now=None):
+        """
+        Find sessions without activity for more than `max_idle` seconds.
+
+        Args:
+            max_idle (float): Idle time in seconds
+            now (float): Reference time, defaults to time.time()
+
+        Returns:
+            list: (user_id, client_info) pairs of the idle sessions
+        """
+        now = time.time() if now is None else now
+        return [(user_id, client_info) for user_id, client_info in self.items()
+                if now - client_info.get('last_activity', now) > max_idle]
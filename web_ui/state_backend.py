@@ -0,0 +1,738 @@
+"""
+Pluggable storage for the chat state that has to be visible to every worker:
+rooms, room membership, room message logs and session ownership.
+
+`InProcessState` keeps everything in the current process (the default,
+single-worker setup). `SQLiteState` keeps it in a SQLite database in WAL
+mode, so several worker processes on one host can share it. Both expose
+rooms the way app.py has always used them: `state.rooms[room_id]` is a
+dict-like room with 'name', 'description', 'created_at', 'created_by', a
+set-like 'members' entry and a RoomLog-like 'log' entry.
+
+Connected NoiseChatClient objects never leave the worker that created
+them; the state only records which worker owns each user's session, so
+requests can be routed there (see sticky_router.py).
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from collections import deque
+from datetime import datetime
+from itertools import islice
+from urllib.parse import quote
+
+from message_store import RoomLog, RoomMessage
+from segment_log import SegmentLog
+
+# Only used to keep processes out of each other's history directories
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger('noise_web_state')
+
+# Open lock files of the history directories this process claimed
+_history_locks = []
+
+
+def process_alive(pid):
+    """
+    Check whether a process on this host is still running.
+
+    Args:
+        pid (int): Process id
+
+    Returns:
+        bool: True if the process exists
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _lock_directory(directory):
+    """Take this process's lock on a directory, False if another process holds it."""
+    os.makedirs(directory, exist_ok=True)
+    lock = open(os.path.join(directory, '.lock'), 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return False
+    _history_locks.append(lock)
+    return True
+
+
+def claim_history_dir(base, node_id=None, per_node=False):
+    """
+    Pick the directory this process appends its durable room logs to and
+    lock it for the life of the process, so no two processes ever write
+    the same segment logs.
+
+    Args:
+        base (str): Configured history directory
+        node_id (str): Name of this node's subdirectory of `base`, optional
+        per_node (bool): Whether other processes keep their history next to
+            this one's (they share rooms over a message bus); each then
+            takes a subdirectory of its own, `node_id` or else the first
+            node-<n> that no running process holds
+
+    Returns:
+        str: The claimed directory
+
+    Raises:
+        RuntimeError: If the directory is held by another process
+    """
+    if not per_node and not node_id:
+        if fcntl is not None and not _lock_directory(base):
+            raise RuntimeError(f"History directory {base} is in use by another process; give each "
+                               f"process its own NOISE_WEB_HISTORY_DIR or NOISE_WEB_NODE_ID")
+        return base
+    if node_id:
+        directory = os.path.join(base, quote(node_id, safe=''))
+        if fcntl is not None and not _lock_directory(directory):
+            raise RuntimeError(f"History directory {directory} of node {node_id} is in use by another process")
+        return directory
+    if fcntl is None:
+        raise RuntimeError("Set NOISE_WEB_NODE_ID to give each process on the message bus its own history")
+    n = 0
+    while not _lock_directory(os.path.join(base, f'node-{n}')):
+        n += 1
+    return os.path.join(base, f'node-{n}')
+
+
+def create_state(url, history_limit=100, history_dir=None, node_id=None, per_node=False):
+    """
+    Create the state backend described by a URL.
+
+    Args:
+        url (str): 'memory' for in-process state, or 'sqlite:///<path>' for a
+            shared SQLite database (four slashes for an absolute path)
+        history_limit (int): Messages kept in memory per room
+        history_dir (str): Directory for the durable room logs of in-process
+            state (SQLite keeps the full history in its own database)
+        node_id (str), per_node (bool): Where in history_dir this process
+            keeps its logs, see claim_history_dir
+
+    Returns:
+        InProcessState or SQLiteState: The backend
+
+    Raises:
+        ValueError: If the URL names an unknown backend
+        RuntimeError: If another process holds the history directory
+    """
+    if not url or url == 'memory':
+        if history_dir:
+            history_dir = claim_history_dir(history_dir, node_id, per_node)
+            logger.info(f"Keeping room history in {history_dir}")
+        return InProcessState(history_limit=history_limit, history_dir=history_dir)
+    if url.startswith('sqlite:///'):
+        return SQLiteState(url[len('sqlite:///'):], history_limit=history_limit)
+    raise ValueError(f"Unknown state backend: {url}")
+
+
+# Metadata of a room, kept in its durable log directory so the room can be restored
+ROOM_META = 'room.json'
+
+
+class InProcessState:
+    """
+    State kept in plain dicts and sets of the current process. With a
+    history directory, the rooms whose logs it holds are restored (without
+    members) when the state is created.
+    """
+
+    shared = False
+
+    def __init__(self, history_limit=100, history_dir=None):
+        """
+        Initialize empty state.
+
+        Args:
+            history_limit (int): Messages kept in memory per room
+            history_dir (str): Directory for durable room logs, None to keep history in memory only
+        """
+        self.history_limit = history_limit
+        self.history_dir = history_dir
+        self.rooms = {}  # room_id -> room dict
+        self._on_trim = None
+        self._lock = threading.Lock()
+        self._user_rooms = {}  # user_id -> set of room ids the user belongs to
+        self._sessions = {}  # user_id -> (worker, username)
+        if history_dir:
+            self._restore_rooms()
+
+    def _room_dir(self, room_id):
+        # Room ids are user supplied, so escape them into a single path component
+        return os.path.join(self.history_dir, 'room-' + quote(room_id, safe=''))
+
+    def _restore_rooms(self):
+        """Bring back the rooms of the logs in the history directory."""
+        os.makedirs(self.history_dir, exist_ok=True)
+        for entry in os.scandir(self.history_dir):
+            if not entry.name.startswith('room-') or not entry.is_dir():
+                continue
+            try:
+                with open(os.path.join(entry.path, ROOM_META)) as f:
+                    meta = json.load(f)
+                if self._room_dir(meta['room_id']) != entry.path:
+                    raise ValueError('room id does not match the directory')
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                # Without its metadata nobody can tell whose history this is
+                self._quarantine(entry.path, f"no usable {ROOM_META} ({e})")
+                continue
+            self._add_room(meta['room_id'], meta, restore=True)
+            logger.info(f"Restored room {meta['room_id']} from {entry.path}")
+
+    def _quarantine(self, directory, reason):
+        """Move a room log nobody may reopen out of the way."""
+        target = os.path.join(self.history_dir, f"stale-{int(time.time())}-{os.path.basename(directory)}")
+        logger.warning(f"Moving {directory} to {target}: {reason}")
+        os.rename(directory, target)
+
+    def _add_room(self, room_id, meta, restore=False):
+        """Add a room (lock held, or during __init__)."""
+        durable = None
+        if self.history_dir:
+            directory = self._room_dir(room_id)
+            if not restore:
+                # A new room never inherits a log, e.g. one whose deletion was interrupted
+                if os.path.exists(directory):
+                    self._quarantine(directory, 'a new room was created under its id')
+                os.makedirs(directory)
+                temp_path = os.path.join(directory, ROOM_META + '.tmp')
+                with open(temp_path, 'w') as f:
+                    json.dump(dict(meta, room_id=room_id), f)
+                os.replace(temp_path, os.path.join(directory, ROOM_META))
+            durable = SegmentLog(directory)
+        self.rooms[room_id] = {
+            'name': meta['name'],
+            'description': meta['description'],
+            'members': set(),
+            'created_at': meta['created_at'],
+            'created_by': meta['created_by'],
+            # Shared, append-only message log
+            'log': RoomLog(limit=self.history_limit, durable=durable,
+                           on_drop=lambda record: self._trimmed(room_id, record))
+        }
+
+    def create_room(self, room_id, name, description, created_by):
+        """
+        Create a room unless one with the same id exists.
+
+        Args:
+            room_id (str): Room identifier
+            name (str): Display name
+            description (str): Room description
+            created_by (str): Creating user, 'system' for built-in rooms
+
+        Returns:
+            bool: True if the room was created
+        """
+        with self._lock:
+            if room_id in self.rooms:
+                return False
+            self._add_room(room_id, {'name': name, 'description': description,
+                                     'created_at': datetime.now().isoformat(), 'created_by': created_by})
+            return True
+
+    def delete_room(self, room_id):
+        """
+        Delete a room with its messages, including its durable log, so a
+        room created again under the same id starts empty.
+
+        Returns:
+            bool: True if the room existed
+        """
+        with self._lock:
+            room_data = self.rooms.pop(room_id, None)
+        if room_data is None:
+            return False
+        room_data['log'].delete()
+        return True
+
+    def on_trim(self, callback):
+        """
+        Call `callback(room_id, record)` for every message that falls out of
+        a room's history while the room lives on. Only history kept in
+        memory alone is trimmed; a durable log keeps every message.
+
+        Args:
+            callback (callable): Receives the room id and the RoomMessage
+        """
+        self._on_trim = callback
+
+    def _trimmed(self, room_id, record):
+        if self._on_trim is not None:
+            self._on_trim(room_id, record)
+
+    def add_member(self, room_id, user_id):
+        """Add a user to a room and to the reverse membership index."""
+        with self._lock:
+            self.rooms[room_id]['members'].add(user_id)
+            self._user_rooms.setdefault(user_id, set()).add(room_id)
+
+    def remove_member(self, room_id, user_id):
+        """Remove a user from a room and from the reverse membership index."""
+        with self._lock:
+            room_data = self.rooms.get(room_id)
+            if room_data:
+                room_data['members'].discard(user_id)
+            self._user_rooms.get(user_id, set()).discard(room_id)
+
+    def rooms_of(self, user_id):
+        """Get the ids of the rooms a user belongs to."""
+        return set(self._user_rooms.get(user_id, ()))
+
+    def remove_user(self, user_id):
+        """
+        Remove a user from all of their rooms.
+
+        Returns:
+            set: Ids of the rooms the user was removed from
+        """
+        with self._lock:
+            room_ids = self._user_rooms.pop(user_id, set())
+            for room_id in room_ids:
+                room_data = self.rooms.get(room_id)
+                if room_data:
+                    room_data['members'].discard(user_id)
+            return room_ids
+
+    def claim_session(self, user_id, username, worker):
+        """
+        Record that `worker` owns the user's session.
+
+        Args:
+            user_id (str): Unique identifier for the user
+            username (str): Chat username
+            worker (int): Owning worker (process id)
+
+        Returns:
+            bool: False if another live worker already owns the session
+        """
+        with self._lock:
+            owner = self._sessions.get(user_id)
+            if owner and owner[0] != worker:
+                return False
+            self._sessions[user_id] = (worker, username)
+            return True
+
+    def release_session(self, user_id, worker):
+        """Forget the user's session if `worker` owns it."""
+        with self._lock:
+            if self._sessions.get(user_id, (None,))[0] == worker:
+                del self._sessions[user_id]
+
+    def session_owner(self, user_id):
+        """Get the worker owning a user's session, or None."""
+        return self._sessions.get(user_id, (None,))[0]
+
+    def username(self, user_id):
+        """Get the username of a connected user, or None."""
+        return self._sessions.get(user_id, (None, None))[1]
+
+    def watch(self, callback):
+        """Every change is made in this process, so there is nothing to watch."""
+
+
+class SQLiteState:
+    """
+    State shared between worker processes through a SQLite database in WAL
+    mode: readers never block the single writer, and every worker sees
+    committed changes immediately.
+    """
+
+    shared = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS rooms (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room_id TEXT NOT NULL UNIQUE,
+            name TEXT NOT NULL,
+            description TEXT NOT NULL DEFAULT '',
+            created_at TEXT NOT NULL,
+            created_by TEXT
+        );
+        CREATE TABLE IF NOT EXISTS members (
+            room_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            PRIMARY KEY (room_id, user_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS members_by_user ON members (user_id, room_id);
+        CREATE TABLE IF NOT EXISTS messages (
+            room INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            sender_id TEXT,
+            outgoing BLOB NOT NULL,
+            incoming BLOB NOT NULL,
+            PRIMARY KEY (room, seq)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS sessions (
+            user_id TEXT PRIMARY KEY,
+            username TEXT,
+            worker INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path, history_limit=100, poll_interval=0.2):
+        """
+        Open (or create) the shared database. It keeps every message, so it
+        doubles as the durable history of all rooms.
+
+        Args:
+            path (str): Database file
+            history_limit (int): Messages each process keeps decoded in memory per room
+            poll_interval (float): Seconds between checks for other workers' writes
+        """
+        self.path = path
+        self.history_limit = history_limit
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._logs = {}  # rooms.id -> SQLiteRoomLog, caches decoded records per process
+        self._logs_lock = threading.Lock()
+        self._watcher = None
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(self.SCHEMA)
+        self.rooms = SQLiteRooms(self)
+
+    def _db(self):
+        """Get this thread's connection (sqlite3 connections are not shared across threads)."""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _transaction(self, work):
+        """Run `work(db)` in a write transaction and return its result."""
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(db)
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        return result
+
+    def _log(self, room_key):
+        with self._logs_lock:
+            log = self._logs.get(room_key)
+            if log is None:
+                log = SQLiteRoomLog(self, room_key, self.history_limit)
+                self._logs[room_key] = log
+            return log
+
+    def create_room(self, room_id, name, description, created_by):
+        """See InProcessState.create_room."""
+        cursor = self._db().execute(
+            "INSERT OR IGNORE INTO rooms (room_id, name, description, created_at, created_by) VALUES (?, ?, ?, ?, ?)",
+            (room_id, name, description, datetime.now().isoformat(), created_by))
+        return cursor.rowcount == 1
+
+    def delete_room(self, room_id):
+        """
+        Delete a room with its membership and messages.
+
+        Returns:
+            bool: True if the room existed
+        """
+        def work(db):
+            row = db.execute("SELECT id FROM rooms WHERE room_id = ?", (room_id,)).fetchone()
+            if row is None:
+                return None
+            db.execute("DELETE FROM rooms WHERE id = ?", (row[0],))
+            db.execute("DELETE FROM members WHERE room_id = ?", (room_id,))
+            db.execute("DELETE FROM messages WHERE room = ?", (row[0],))
+            return row[0]
+
+        room_key = self._transaction(work)
+        if room_key is None:
+            return False
+        with self._logs_lock:
+            self._logs.pop(room_key, None)
+        return True
+
+    def add_member(self, room_id, user_id):
+        """See InProcessState.add_member."""
+        self._db().execute("INSERT OR IGNORE INTO members (room_id, user_id) VALUES (?, ?)", (room_id, user_id))
+
+    def remove_member(self, room_id, user_id):
+        """See InProcessState.remove_member."""
+        self._db().execute("DELETE FROM members WHERE room_id = ? AND user_id = ?", (room_id, user_id))
+
+    def rooms_of(self, user_id):
+        """See InProcessState.rooms_of."""
+        rows = self._db().execute("SELECT room_id FROM members WHERE user_id = ?", (user_id,))
+        return {row[0] for row in rows}
+
+    def remove_user(self, user_id):
+        """See InProcessState.remove_user."""
+        def work(db):
+            room_ids = {row[0] for row in db.execute("SELECT room_id FROM members WHERE user_id = ?", (user_id,))}
+            db.execute("DELETE FROM members WHERE user_id = ?", (user_id,))
+            return room_ids
+
+        return self._transaction(work)
+
+    def claim_session(self, user_id, username, worker):
+        """See InProcessState.claim_session; sessions of dead workers are taken over."""
+        def work(db):
+            row = db.execute("SELECT worker FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+            if row and row[0] != worker and process_alive(row[0]):
+                return False
+            db.execute("INSERT OR REPLACE INTO sessions (user_id, username, worker) VALUES (?, ?, ?)",
+                       (user_id, username, worker))
+            return True
+
+        return self._transaction(work)
+
+    def release_session(self, user_id, worker):
+        """See InProcessState.release_session."""
+        self._db().execute("DELETE FROM sessions WHERE user_id = ? AND worker = ?", (user_id, worker))
+
+    def session_owner(self, user_id):
+        """See InProcessState.session_owner; sessions of dead workers have no owner."""
+        row = self._db().execute("SELECT worker FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None or not process_alive(row[0]):
+            return None
+        return row[0]
+
+    def username(self, user_id):
+        """See InProcessState.username."""
+        row = self._db().execute("SELECT username FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def on_trim(self, callback):
+        """The database keeps every message until its room is deleted, so nothing is trimmed."""
+
+    def watch(self, callback):
+        """
+        Call `callback(room_id)` from a background thread whenever another
+        worker appends to a room log.
+
+        Args:
+            callback (callable): Receives the id of the room that changed
+        """
+        if self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, args=(callback,), name='state-watcher')
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def _watch(self, callback):
+        db = self._db()
+        last_seqs = None
+        data_version = None
+        while True:
+            try:
+                # data_version only moves when another connection commits, so idle polls are one pragma
+                version = db.execute("PRAGMA data_version").fetchone()[0]
+                if version != data_version:
+                    data_version = version
+                    seqs = dict(db.execute(
+                        "SELECT r.room_id, MAX(m.seq) FROM messages m JOIN rooms r ON r.id = m.room GROUP BY m.room"))
+                    if last_seqs is not None:
+                        for room_id, seq in seqs.items():
+                            if last_seqs.get(room_id) != seq:
+                                callback(room_id)
+                    last_seqs = seqs
+            except Exception as e:
+                logger.error(f"Error watching shared state: {e}")
+            time.sleep(self.poll_interval)
+
+
+class SQLiteRooms:
+    """
+    Dict-like view of the rooms table, mirroring InProcessState.rooms.
+    """
+
+    def __init__(self, state):
+        self._state = state
+
+    def _row(self, room_id):
+        return self._state._db().execute(
+            "SELECT id, room_id, name, description, created_at, created_by FROM rooms WHERE room_id = ?",
+            (room_id,)).fetchone()
+
+    def get(self, room_id, default=None):
+        row = self._row(room_id)
+        return SQLiteRoom(self._state, row) if row else default
+
+    def __getitem__(self, room_id):
+        room = self.get(room_id)
+        if room is None:
+            raise KeyError(room_id)
+        return room
+
+    def __contains__(self, room_id):
+        return self._row(room_id) is not None
+
+    def __iter__(self):
+        return iter([room_id for room_id, _ in self.items()])
+
+    def __len__(self):
+        return self._state._db().execute("SELECT COUNT(*) FROM rooms").fetchone()[0]
+
+    def items(self):
+        rows = self._state._db().execute(
+            "SELECT id, room_id, name, description, created_at, created_by FROM rooms ORDER BY id").fetchall()
+        return [(row[1], SQLiteRoom(self._state, row)) for row in rows]
+
+    def pop(self, room_id, default=None):
+        room = self.get(room_id)
+        if room is None or not self._state.delete_room(room_id):
+            return default
+        return room
+
+
+class SQLiteRoom:
+    """
+    A row of the rooms table, read like the room dicts of InProcessState.
+    """
+
+    def __init__(self, state, row):
+        self._state = state
+        self._key, self.room_id = row[0], row[1]
+        self._fields = {'name': row[2], 'description': row[3], 'created_at': row[4], 'created_by': row[5]}
+
+    def __getitem__(self, key):
+        if key == 'members':
+            return SQLiteMembers(self._state, self.room_id)
+        if key == 'log':
+            return self._state._log(self._key)
+        return self._fields[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in ('members', 'log') or key in self._fields
+
+
+class SQLiteMembers:
+    """
+    Set-like view of a room's members.
+    """
+
+    def __init__(self, state, room_id):
+        self._state = state
+        self._room_id = room_id
+
+    def add(self, user_id):
+        self._state.add_member(self._room_id, user_id)
+
+    def discard(self, user_id):
+        self._state.remove_member(self._room_id, user_id)
+
+    def __contains__(self, user_id):
+        return self._state._db().execute(
+            "SELECT 1 FROM members WHERE room_id = ? AND user_id = ?", (self._room_id, user_id)).fetchone() is not None
+
+    def __iter__(self):
+        rows = self._state._db().execute("SELECT user_id FROM members WHERE room_id = ?", (self._room_id,))
+        return iter([row[0] for row in rows])
+
+    def __len__(self):
+        return self._state._db().execute(
+            "SELECT COUNT(*) FROM members WHERE room_id = ?", (self._room_id,)).fetchone()[0]
+
+    def __bool__(self):
+        return self._state._db().execute(
+            "SELECT 1 FROM members WHERE room_id = ? LIMIT 1", (self._room_id,)).fetchone() is not None
+
+
+class SQLiteRoomLog:
+    """
+    RoomLog stored in the messages table.
+    Records are immutable and sequence numbers contiguous, so each process
+    keeps the decoded tail of the log in memory and only fetches rows newer
+    than what it has already seen.
+    """
+
+    def __init__(self, state, room_key, limit=100):
+        self._state = state
+        self._room_key = room_key
+        self._limit = limit
+        self._lock = threading.Lock()
+        self._records = deque(maxlen=limit)
+        self._cached_seq = 0
+
+    def _sync(self):
+        """Pull rows appended since the last sync (lock held)."""
+        # Only the newest `limit` rows can end up in the cache
+        rows = self._state._db().execute(
+            "SELECT seq, sender_id, outgoing, incoming FROM messages WHERE room = ? AND seq > ? "
+            "ORDER BY seq DESC LIMIT ?", (self._room_key, self._cached_seq, self._limit)).fetchall()
+        for seq, sender_id, outgoing, incoming in reversed(rows):
+            self._records.append(RoomMessage.from_json(seq, sender_id, outgoing, incoming))
+            self._cached_seq = seq
+
+    @property
+    def last_seq(self):
+        with self._lock:
+            self._sync()
+            return self._cached_seq
+
+    def append(self, sender_id, outgoing, incoming=None):
+        """See RoomLog.append."""
+        if incoming is None:
+            incoming = outgoing
+
+        def work(db):
+            seq = db.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM messages WHERE room = ?",
+                             (self._room_key,)).fetchone()[0]
+            outgoing['seq'] = seq
+            incoming['seq'] = seq
+            record = RoomMessage(seq, sender_id, outgoing, incoming)
+            db.execute("INSERT INTO messages (room, seq, sender_id, outgoing, incoming) VALUES (?, ?, ?, ?, ?)",
+                       (self._room_key, seq, sender_id, record.outgoing_json, record.incoming_json))
+            return record
+
+        record = self._state._transaction(work)
+        with self._lock:
+            if record.seq == self._cached_seq + 1:
+                self._records.append(record)
+                self._cached_seq = record.seq
+        return record
+
+    def records_after(self, seq):
+        """See RoomLog.records_after."""
+        with self._lock:
+            self._sync()
+            count = min(self._cached_seq - seq, len(self._records))
+            if count <= 0:
+                return []
+            newer = list(islice(reversed(self._records), count))
+        newer.reverse()
+        return newer
+
+    def history(self, before, limit):
+        """See RoomLog.history."""
+        rows = self._state._db().execute(
+            "SELECT seq, sender_id, outgoing, incoming FROM messages WHERE room = ? AND seq < ? "
+            "ORDER BY seq DESC LIMIT ?", (self._room_key, before or 2 ** 62, max(limit, 0))).fetchall()
+        return [RoomMessage.from_json(*row) for row in reversed(rows)]
+
+    def __len__(self):
+        with self._lock:
+            self._sync()
+            return len(self._records)
@@ -3,7 +3,13 @@ $(document).ready(function() {
     // Initialize variables
     let connected = false;
     let messagePollingInterval = null;
+    let messageStream = null;
+    let chatSocket = null;
+    let chatSocketFailed = false;  // Set when the server has no WebSocket support
+    let chatSocketRef = 0;
+    const pendingSends = {};  // send frame ref -> message text
     let activeRoom = 'main';
+    let roomCursors = {};  // room_id -> last message sequence number seen
     let memberPollingInterval = null;
     let securityTestInterval = null;
     let performanceTestInterval = null;
@@ -567,6 +573,9 @@ $(document).ready(function() {
                         $.get(`/messages?room=${roomId}`)
                             .done(function(data) {
                                 if (data.success) {
+                                    // Incremental polling continues from here
+                                    roomCursors[roomId] = data.cursor || 0;
+                                    
                                     // Clear existing messages
                                     $chatMessages.html('<div class="system-message">Beginning of secure conversation</div>');
                                     
@@ -761,6 +770,16 @@ $(document).ready(function() {
                         // Stop any existing polling
                         stopMessagePolling();
                         
+                        // Prefer the WebSocket, then the push stream, polling is only a fallback
+                        if (window.WebSocket && !chatSocketFailed) {
+                            startChatSocket();
+                            return;
+                        }
+                        if (window.EventSource) {
+                            startMessageStream();
+                            return;
+                        }
+                        
                         // Start new polling interval
                         messagePollingInterval = setInterval(function() {
                             fetchMessages();
@@ -773,6 +792,95 @@ $(document).ready(function() {
                             clearInterval(messagePollingInterval);
                             messagePollingInterval = null;
                         }
+                        if (messageStream) {
+                            messageStream.close();
+                            messageStream = null;
+                        }
+                        if (chatSocket) {
+                            const socket = chatSocket;
+                            chatSocket = null;
+                            socket.close();
+                        }
+                    }
+                    
+                    // Handle a message pushed by the WebSocket or the event stream
+                    function handlePushedMessage(message) {
+                        const roomId = message.room_id || 'main';
+                        roomCursors[roomId] = Math.max(roomCursors[roomId] || 0, message.seq || 0);
+                        
+                        if (roomId === activeRoom) {
+                            displayNewMessages([message]);
+                        }
+                    }
+                    
+                    // Send and receive chat messages over a single WebSocket
+                    function startChatSocket() {
+                        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+                        const socket = new WebSocket(`${protocol}//${window.location.host}/ws`);
+                        let opened = false;
+                        chatSocket = socket;
+                        
+                        socket.onopen = function() {
+                            opened = true;
+                        };
+                        
+                        socket.onmessage = function(event) {
+                            const frame = JSON.parse(event.data);
+                            if (frame[0] === 'm') {
+                                handlePushedMessage(frame[1]);
+                            } else if (frame[0] === 'a') {
+                                const message = pendingSends[frame[1]];
+                                delete pendingSends[frame[1]];
+                                if (!frame[2]) {
+                                    showAlert(frame[3] || 'Failed to send message', 'danger');
+                                    $('#message-input').val(message);
+                                }
+                            } else if (frame[0] === 'st') {
+                                if (!frame[1].connected && connected) {
+                                    updateConnectionStatus();
+                                }
+                            }
+                        };
+                        
+                        socket.onclose = function() {
+                            // Closed by stopMessagePolling()
+                            if (chatSocket !== socket) return;
+                            chatSocket = null;
+                            
+                            // Never opened: no WebSocket support on the server, use the other transports
+                            if (!opened) {
+                                chatSocketFailed = true;
+                            }
+                            setTimeout(function() {
+                                if (connected && !chatSocket && !messageStream && !messagePollingInterval) {
+                                    startMessagePolling();
+                                }
+                            }, 1000);
+                        };
+                    }
+                    
+                    // Receive messages and status changes over Server-Sent Events
+                    function startMessageStream() {
+                        messageStream = new EventSource('/stream');
+                        
+                        messageStream.addEventListener('message', function(event) {
+                            handlePushedMessage(JSON.parse(event.data));
+                        });
+                        
+                        messageStream.addEventListener('status', function(event) {
+                            const status = JSON.parse(event.data);
+                            if (!status.connected && connected) {
+                                updateConnectionStatus();
+                            }
+                        });
+                        
+                        messageStream.onerror = function() {
+                            // The browser retries on its own unless the server refused the stream
+                            if (messageStream && messageStream.readyState === EventSource.CLOSED) {
+                                messageStream = null;
+                                updateConnectionStatus();
+                            }
+                        };
                     }
                 
                     // Function to add technical details to the page
@@ -860,14 +968,14 @@ $(document).ready(function() {
                     function fetchMessages() {
                         // Get the active room ID
                         const activeRoomName = $('#active-room').text().trim();
-                        let roomFilter = '';
+                        let roomId = activeRoom;
                         
                         // Use URL parameter if available
                         const urlParams = new URLSearchParams(window.location.search);
                         const roomParam = urlParams.get('room');
                         
                         if (roomParam) {
-                            roomFilter = `?room=${roomParam}`;
+                            roomId = roomParam;
                         } else if (activeRoomName !== 'Main Room') {
                             // Try to determine room ID from active room name
                             const rooms = Array.from(document.querySelectorAll('.room-item')).map(el => ({
@@ -877,52 +985,20 @@ $(document).ready(function() {
                             
                             const roomMatch = rooms.find(r => r.name === activeRoomName);
                             if (roomMatch) {
-                                roomFilter = `?room=${roomMatch.id}`;
+                                roomId = roomMatch.id;
                             }
                         }
                         
-                        $.get(`/messages${roomFilter}`)
+                        // Only ask for messages newer than the last one we have seen
+                        const since = roomCursors[roomId] || 0;
+                        
+                        $.get('/messages', { room: roomId, since: since })
                             .done(function(data) {
                                 if (data.success) {
+                                    roomCursors[data.room_id || roomId] = (data.cursor !== undefined) ? data.cursor : since;
+                                    
                                     // Process new messages
-                                    if (data.messages && data.messages.length > 0) {
-                                        // Clear messages area if this is the first batch
-                                        if ($chatMessages.find('.message').length === 0 && $chatMessages.find('.system-message').length <= 1) {
-                                            clearMessages();
-                                        }
-                                        
-                                        // Get the already displayed messages for deduplication
-                                        const displayedMessageContents = new Set();
-                                        $chatMessages.find('.message .message-content').each(function() {
-                                            displayedMessageContents.add($(this).text());
-                                        });
-                                        
-                                        // Get system messages for deduplication
-                                        const displayedSystemMessages = new Set();
-                                        $chatMessages.find('.system-message').each(function() {
-                                            displayedSystemMessages.add($(this).text());
-                                        });
-                                        
-                                        // Process all messages with deduplication
-                                        data.messages.forEach(message => {
-                                            if (message.type === 'system') {
-                                                // Only add if not already displayed
-                                                if (!displayedSystemMessages.has(message.content)) {
-                                                    addSystemMessage(message.content);
-                                                    displayedSystemMessages.add(message.content);
-                                                }
-                                            } else {
-                                                // For regular messages, check if we already have this exact content
-                                                const isDuplicate = message.type === 'outgoing' && 
-                                                                   displayedMessageContents.has(message.content);
-                                                
-                                                if (!isDuplicate) {
-                                                    addMessageToChat(message);
-                                                    displayedMessageContents.add(message.content);
-                                                }
-                                            }
-                                        });
-                                    }
+                                    displayNewMessages(data.messages);
                                     
                                     // Check connection status
                                     if (!data.connected && connected) {
@@ -935,6 +1011,48 @@ $(document).ready(function() {
                             });
                     }
                 
+                    // Render messages that have not been displayed yet, skipping duplicates
+                    function displayNewMessages(messages) {
+                        if (messages && messages.length > 0) {
+                            // Clear messages area if this is the first batch
+                            if ($chatMessages.find('.message').length === 0 && $chatMessages.find('.system-message').length <= 1) {
+                                clearMessages();
+                            }
+                            
+                            // Get the already displayed messages for deduplication
+                            const displayedMessageContents = new Set();
+                            $chatMessages.find('.message .message-content').each(function() {
+                                displayedMessageContents.add($(this).text());
+                            });
+                            
+                            // Get system messages for deduplication
+                            const displayedSystemMessages = new Set();
+                            $chatMessages.find('.system-message').each(function() {
+                                displayedSystemMessages.add($(this).text());
+                            });
+                            
+                            // Process all messages with deduplication
+                            messages.forEach(message => {
+                                if (message.type === 'system') {
+                                    // Only add if not already displayed
+                                    if (!displayedSystemMessages.has(message.content)) {
+                                        addSystemMessage(message.content);
+                                        displayedSystemMessages.add(message.content);
+                                    }
+                                } else {
+                                    // For regular messages, check if we already have this exact content
+                                    const isDuplicate = message.type === 'outgoing' && 
+                                                       displayedMessageContents.has(message.content);
+                                    
+                                    if (!isDuplicate) {
+                                        addMessageToChat(message);
+                                        displayedMessageContents.add(message.content);
+                                    }
+                                }
+                            });
+                        }
+                    }
+                
                     // Add system message with animation
                     function addSystemMessage(message) {
                         // Check if this exact message already exists
@@ -1084,20 +1202,21 @@ $(document).ready(function() {
                                                     <!-- Encryption Details -->
                                                     <div class="mb-3 pb-2 border-bottom">
                                                         <div class="text-success fw-bold">Encryption Details</div>
-                                                        <div><span class="fw-bold">Key ID:</span> <span class="mono">${encryption.key_id || (isFile ? `file-key-${message.file_info.stored_filename?.split('_')[0] || 'unknown'}` : 'N/A')}</span></div>
+                                                        <div><span class="fw-bold">Key ID:</span> <span class="mono key-id">${encryption.key_id || (isFile ? `file-key-${message.file_info.stored_filename?.split('_')[0] || 'unknown'}` : 'N/A')}</span></div>
                                                         <div><span class="fw-bold">Encrypted Bytes:</span></div>
                                                         <div class="encrypted-bytes mono">${encryption.encrypted_hex || (isFile ? '(file data encrypted, first 64 bytes)' : 'Not available')}</div>
                                                         <button class="btn btn-sm btn-outline-secondary mt-1 show-full-bytes">
                                                             Show Full
                                                         </button>
                                                         <div class="full-bytes mono mt-2" style="display: none;">
-                                                            ${encryption.full_encrypted_hex || (isFile ? '(Full encrypted file data - MD5: ' + (message.file_info.md5 || 'not available') + ')' : 'Not available')}
+                                                            ${encryption.full_encrypted_hex || (isFile ? '(Full encrypted file data - SHA-256: ' + (encryption.sha256 || 'not available') + ')' : 'Not available')}
                                                         </div>
                                                         <div><span class="fw-bold">Size Before:</span> ${encryption.original_size || (isFile ? message.file_info.size : 'N/A')} bytes</div>
                                                         <div><span class="fw-bold">Size After:</span> ${encryption.encrypted_size || (isFile ? message.file_info.size : 'N/A')} bytes</div>
                                                         <div><span class="fw-bold">Encryption Ratio:</span> ${encryption.original_size ? (encryption.encrypted_size / encryption.original_size).toFixed(2) + 'x' : '1.00x'}</div>
                                                         <div><span class="fw-bold">Nonce:</span> <span class="mono">${encryption.nonce || (isFile ? 'Generated for file encryption' : 'N/A')}</span></div>
                                                         <div><span class="fw-bold">Timestamp:</span> ${encryption.timestamp || timestamp}</div>
+                                                        ${encryption.transfer_id ? `<div><span class="fw-bold">Transfer:</span> <span class="transfer-state" data-transfer-id="${encryption.transfer_id}">${encryption.status || 'sending'}</span></div>` : ''}
                                                     </div>
                                                     
                                                     <!-- Protocol Information -->
@@ -1121,7 +1240,29 @@ $(document).ready(function() {
                             
                             // Add event listeners for technical details buttons
                             $chatMessages.find('.technical-details-btn').last().on('click', function() {
-                                $(this).next('.technical-details-panel').slideToggle();
+                                const $panel = $(this).next('.technical-details-panel');
+                                $panel.slideToggle();
+                                
+                                // File transfers run in the background, show how they went
+                                const $state = $panel.find('.transfer-state');
+                                if ($state.length) {
+                                    fetch(`/transfers/${$state.data('transfer-id')}`)
+                                        .then(response => response.json())
+                                        .then(data => {
+                                            if (!data.success) return;
+                                            const transfer = data.transfer;
+                                            if (transfer.state === 'sent') {
+                                                $state.text(`sent in ${transfer.frames} frames, ${formatFileSize(transfer.encrypted_size)} on the wire, ${transfer.throughput_mbps} Mbit/s`);
+                                                $panel.find('.key-id').text(transfer.key_id);
+                                                if (transfer.encrypted_hex) {
+                                                    $panel.find('.encrypted-bytes').text(transfer.encrypted_hex);
+                                                }
+                                            } else {
+                                                $state.text(`${transfer.state} (${transfer.frames_sent}/${transfer.frames} frames)`);
+                                            }
+                                        })
+                                        .catch(error => console.error('Error fetching transfer status:', error));
+                                }
                             });
                             
                             // Add event listeners for show full/less buttons
@@ -1218,6 +1359,14 @@ $(document).ready(function() {
                             }
                         }
                         
+                        // Use the WebSocket when it is open, the result arrives as an ack frame
+                        if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
+                            const ref = ++chatSocketRef;
+                            pendingSends[ref] = message;
+                            chatSocket.send(JSON.stringify(['s', ref, roomId, message]));
+                            return;
+                        }
+                        
                         $.ajax({
                             url: '/send',
                             type: 'POST',
@@ -2259,18 +2408,24 @@ $(document).ready(function() {
                                         clearInterval(performanceTestInterval);
                                     }
                                     
-                                    let progress = 0;
                                     performanceTestInterval = setInterval(() => {
-                                        // Update progress bar
-                                        if (progress < 100) {
-                                            progress += 2;
-                                            $('#performanceTestProgress').css('width', progress + '%');
-                                        }
-                                        
                                         // Check status
                                         $.get(`/performance_test_status?format=${outputFormat}`)
                                             .done(function(statusData) {
-                                                if (statusData.status === 'completed' || progress >= 100) {
+                                                // Update progress bar with the benchmark's own progress
+                                                $('#performanceTestProgress').css('width', (statusData.progress || 0) + '%');
+                                                
+                                                if (statusData.status === 'failed') {
+                                                    clearInterval(performanceTestInterval);
+                                                    performanceResults.html(`
+                                                        <div class="alert alert-danger">
+                                                            <i class="bi bi-x-circle-fill me-2"></i>
+                                                            Performance test failed: ${statusData.error || 'Unknown error'}
+                                                        </div>
+                                                    `);
+                                                    $('#runPerformanceTestBtn').prop('disabled', false);
+                                                    $('#runPerformanceTestBtn').html('<i class="bi bi-play-fill me-1"></i>Run Performance Test');
+                                                } else if (statusData.status === 'completed') {
                                                     // Tests completed
                                                     clearInterval(performanceTestInterval);
                                                     displayPerformanceResults(statusData.results, outputFormat);
@@ -2367,6 +2522,21 @@ $(document).ready(function() {
                                                         ${Object.keys(results).map(protocol => 
                                                             `<td class="text-center">${(results[protocol].max_latency * 1000).toFixed(2)}</td>`).join('')}
                                                     </tr>
+                                                    <tr>
+                                                        <td>P50 Latency (ms)</td>
+                                                        ${Object.keys(results).map(protocol => 
+                                                            `<td class="text-center">${((results[protocol].p50_latency || 0) * 1000).toFixed(3)}</td>`).join('')}
+                                                    </tr>
+                                                    <tr>
+                                                        <td>P95 Latency (ms)</td>
+                                                        ${Object.keys(results).map(protocol => 
+                                                            `<td class="text-center">${((results[protocol].p95_latency || 0) * 1000).toFixed(3)}</td>`).join('')}
+                                                    </tr>
+                                                    <tr>
+                                                        <td>P99 Latency (ms)</td>
+                                                        ${Object.keys(results).map(protocol => 
+                                                            `<td class="text-center">${((results[protocol].p99_latency || 0) * 1000).toFixed(3)}</td>`).join('')}
+                                                    </tr>
                                                     <tr>
                                                         <td>Throughput (msg/s)</td>
                                                         ${Object.keys(results).map(protocol => 
@@ -0,0 +1,195 @@
+"""
+Sticky routing for multi-worker deployments.
+A user's NoiseChatClient lives in the worker process that handled /connect.
+Every worker also serves the app on a private Unix socket; when a request
+lands on a worker that does not own the user's session, StickyRouter
+forwards it over that socket to the owning worker and streams the response
+back (event streams included). The private socket serves the app without
+the router and only the workers' own user can connect to it, so routing
+never depends on anything a client sends: a client-supplied routed header
+is stripped, not trusted.
+"""
+
+import os
+import socket
+import threading
+import logging
+import http.client
+from http.cookies import SimpleCookie
+from urllib.parse import quote
+
+from werkzeug.serving import make_server
+from werkzeug.wsgi import get_input_stream
+
+logger = logging.getLogger('noise_web_router')
+
+# Set on forwarded requests for the owning worker; stripped from client requests
+ROUTED_HEADER = 'X-Noise-Routed'
+WORKER_SOCKET_MODE = 0o600
+
+# Headers that only describe a single connection and must not be forwarded
+HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+              'te', 'trailers', 'transfer-encoding', 'upgrade'}
+
+# Request bodies are relayed in blocks of this size, never read whole
+RELAY_BLOCK_SIZE = 64 * 1024
+
+
+def session_user_id(flask_app, cookie_header):
+    """
+    Get the user id stored in a Flask session cookie without a request context.
+
+    Args:
+        flask_app (Flask): App whose secret key signed the cookie
+        cookie_header (str): Raw Cookie header
+
+    Returns:
+        str: The user id, or None if there is no valid session
+    """
+    cookie = SimpleCookie(cookie_header or '')
+    name = flask_app.config['SESSION_COOKIE_NAME']
+    if name not in cookie:
+        return None
+
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    if serializer is None:
+        return None
+    max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+    try:
+        return serializer.loads(cookie[name].value, max_age=max_age).get('user_id')
+    except Exception:
+        return None
+
+
+def worker_socket_path(socket_dir, worker):
+    """Path of the private socket of a worker process."""
+    return os.path.join(socket_dir, f'worker-{worker}.sock')
+
+
+def serve_worker_socket(wsgi_app, path):
+    """
+    Serve a WSGI app on a Unix socket from a daemon thread.
+
+    Args:
+        wsgi_app (callable): The app, without the router in front of it
+        path (str): Socket path
+
+    Returns:
+        BaseWSGIServer: The running server
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    server = make_server(f'unix://{path}', 0, wsgi_app, threaded=True)
+    os.chmod(path, WORKER_SOCKET_MODE)
+    thread = threading.Thread(target=server.serve_forever, name='worker-socket')
+    thread.daemon = True
+    thread.start()
+    logger.info(f"Worker {os.getpid()} serving routed requests on {path}")
+    return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection over a Unix domain socket."""
+
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout, blocksize=RELAY_BLOCK_SIZE)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+class StickyRouter:
+    """
+    WSGI middleware sending each request to the worker that owns the user's session.
+    """
+
+    def __init__(self, wsgi_app, flask_app, state, socket_dir):
+        """
+        Initialize the router.
+
+        Args:
+            wsgi_app (callable): The app handling requests owned by this worker
+            flask_app (Flask): App used to decode session cookies
+            state: Shared state backend recording session owners
+            socket_dir (str): Directory holding the workers' private sockets
+        """
+        self.wsgi_app = wsgi_app
+        self.flask_app = flask_app
+        self.state = state
+        self.socket_dir = socket_dir
+
+    def __call__(self, environ, start_response):
+        # Routed requests arrive on the private socket, which has no router in
+        # front of it; on the public listener the header is a client's claim
+        environ.pop('HTTP_X_NOISE_ROUTED', None)
+
+        user_id = session_user_id(self.flask_app, environ.get('HTTP_COOKIE'))
+        owner = self.state.session_owner(user_id) if user_id else None
+        if owner is None or owner == os.getpid():
+            return self.wsgi_app(environ, start_response)
+
+        if environ.get('HTTP_UPGRADE', '').lower() == 'websocket':
+            # Upgrades cannot be relayed; the browser falls back to the event stream
+            start_response('409 Conflict', [('Content-Type', 'application/json')])
+            return [b'{"success": false, "message": "Session is owned by another worker"}']
+
+        # Only a request whose body is still unread can be handled here instead
+        connection = UnixHTTPConnection(worker_socket_path(self.socket_dir, owner))
+        try:
+            connection.connect()
+        except OSError as e:
+            logger.warning(f"Could not route request of user {user_id} to worker {owner}: {str(e)}")
+            connection.close()
+            return self.wsgi_app(environ, start_response)
+
+        try:
+            return self.forward(environ, start_response, connection)
+        except OSError as e:
+            logger.error(f"Routed request of user {user_id} to worker {owner} failed: {str(e)}")
+            connection.close()
+            start_response('502 Bad Gateway', [('Content-Type', 'application/json')])
+            return [b'{"success": false, "message": "Worker owning the session did not respond"}']
+
+    def forward(self, environ, start_response, connection):
+        """
+        Relay a request over a connection to the owning worker and stream its
+        response back. The request body is streamed too, a block at a time.
+        """
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = get_input_stream(environ) if length else None
+
+        headers = {ROUTED_HEADER: '1'}
+        for key, value in environ.items():
+            if key.startswith('HTTP_'):
+                name = key[5:].replace('_', '-').title()
+                if name.lower() not in HOP_BY_HOP:
+                    headers[name] = value
+        if environ.get('CONTENT_TYPE'):
+            headers['Content-Type'] = environ['CONTENT_TYPE']
+        if length:
+            headers['Content-Length'] = str(length)
+
+        path = quote(environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', ''))
+        if environ.get('QUERY_STRING'):
+            path += '?' + environ['QUERY_STRING']
+
+        connection.request(environ['REQUEST_METHOD'], path, body=body, headers=headers)
+        response = connection.getresponse()
+
+        start_response(f'{response.status} {response.reason}',
+                       [(name, value) for name, value in response.getheaders() if name.lower() not in HOP_BY_HOP])
+
+        def relay():
+            try:
+                # read1 returns as soon as data arrives, so streamed events are not held back
+                while True:
+                    chunk = response.read1(65536)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                connection.close()
+
+        return relay()
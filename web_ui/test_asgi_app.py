@@ -0,0 +1,155 @@
+"""
+Tests for the ASGI serving mode: /stream resuming from Last-Event-ID and
+chat over /ws, driven straight through the ASGI interface. They need the
+app's own dependencies (the Noise client and asgiref) and are skipped
+without them.
+"""
+import asyncio
+import json
+import uuid
+
+import pytest
+
+from chat_socket import FRAME_ACK, FRAME_MESSAGE, FRAME_PING
+from event_stream import decode_cursors
+
+
+class ConnectedClient:
+    """Noise client whose handshake already completed."""
+
+    connected = True
+
+    def send_chat_message(self, message):
+        return {'success': True, 'metadata': {'key_id': 'test'}}
+
+    def disconnect(self):
+        self.connected = False
+
+
+@pytest.fixture(scope='module')
+def asgi(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('asgi')
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('NOISE_WEB_HISTORY_DIR', str(directory / 'history'))
+        mp.setenv('NOISE_WEB_AT_REST_KEY_FILE', str(directory / 'at_rest.key'))
+        return pytest.importorskip('asgi_app')
+
+
+def connect(asgi):
+    """Connect a new user and get their id and session cookie."""
+    web = asgi.web
+    user_id = uuid.uuid4().hex
+    assert web.register_client(user_id, ConnectedClient(), 'alice', 'localhost', 8000)
+    cookie = web.app.session_interface.get_signing_serializer(web.app).dumps({'user_id': user_id})
+    return user_id, f"{web.app.config['SESSION_COOKIE_NAME']}={cookie}".encode()
+
+
+def run(asgi, scope, messages, done):
+    """
+    Serve one ASGI connection, feeding it `messages` and disconnecting once
+    done(sent) holds for the messages it sent.
+    """
+    scope = {'headers': [], 'query_string': b'', **scope}
+    disconnect = {'type': 'websocket.disconnect' if scope['type'] == 'websocket' else 'http.disconnect'}
+    sent = []
+
+    async def main():
+        queue = asyncio.Queue()
+        for message in messages:
+            queue.put_nowait(message)
+
+        async def receive():
+            await asyncio.sleep(0)
+            return await queue.get()
+
+        async def send(message):
+            sent.append(message)
+            if done(sent):
+                queue.put_nowait(disconnect)
+
+        await asyncio.wait_for(asgi.application(scope, receive, send), 10)
+
+    asyncio.run(main())
+    return sent
+
+
+def events(sent):
+    """Server-Sent Events sent so far, as dicts of their fields."""
+    body = b''.join(message.get('body', b'') for message in sent if message['type'] == 'http.response.body')
+    parsed = []
+    for block in body.decode().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if ': ' in line and line[0] != ':')
+        if fields:
+            parsed.append(fields)
+    return parsed
+
+
+def test_stream_needs_connection(asgi):
+    sent = run(asgi, {'type': 'http', 'method': 'GET', 'path': '/stream'}, [], lambda sent: False)
+    assert sent[0]['status'] == 409
+    assert json.loads(sent[1]['body'])['success'] is False
+
+
+def test_stream_resumes_from_last_event_id(asgi):
+    """A reconnecting stream only gets the messages after its Last-Event-ID."""
+    user_id, cookie = connect(asgi)
+    log = asgi.web.state.rooms['main']['log']
+    seqs = [log.append(None, {'type': 'system', 'content': f'm{n}', 'room_id': 'main'}).seq for n in range(3)]
+
+    def received(sent):
+        return [event for event in events(sent) if event.get('event') == 'message']
+
+    sent = run(asgi, {'type': 'http', 'method': 'GET', 'path': '/stream',
+                      'headers': [(b'cookie', cookie), (b'last-event-id', f'main:{seqs[0]}'.encode())]},
+               [], lambda sent: len(received(sent)) == 2)
+    assert sent[0]['status'] == 200
+    messages = received(sent)
+    assert [json.loads(event['data'])['content'] for event in messages] == ['m1', 'm2']
+    assert decode_cursors(messages[-1]['id']) == {'main': seqs[2]}
+
+
+def test_socket_chat(asgi):
+    """Pings are answered, bad frames dropped, and a send is acknowledged and delivered."""
+    user_id, cookie = connect(asgi)
+    last_seq = asgi.web.state.rooms['main']['log'].last_seq
+
+    def frames(sent):
+        return [json.loads(message['text']) for message in sent if message['type'] == 'websocket.send']
+
+    def delivered(sent):
+        return any(frame[0] == FRAME_MESSAGE and frame[1].get('content') == 'hello' for frame in frames(sent))
+
+    sent = run(asgi, {'type': 'websocket', 'path': '/ws', 'headers': [(b'cookie', cookie)],
+                      'query_string': f'cursors=main:{last_seq}'.encode()},
+               [{'type': 'websocket.connect'},
+                {'type': 'websocket.receive', 'text': '["p"]'},
+                {'type': 'websocket.receive', 'text': 'not a frame'},
+                {'type': 'websocket.receive', 'text': '["s",7,"main","  hello "]'}],
+               delivered)
+    assert sent[0] == {'type': 'websocket.accept'}
+    assert [FRAME_PING] in frames(sent)
+    assert [FRAME_ACK, 7, True, None] in frames(sent)
+    message = next(frame[1] for frame in frames(sent) if frame[0] == FRAME_MESSAGE)
+    assert message['type'] == 'outgoing' and message['room_id'] == 'main' and message['seq'] > last_seq
+
+
+def test_other_workers_sessions_are_routed(asgi, monkeypatch):
+    """Sessions owned by another worker go through the router; their upgrades are refused."""
+    user_id, cookie = connect(asgi)
+    monkeypatch.setattr(asgi.web.state, 'shared', True)
+    monkeypatch.setattr(asgi.web.state, 'session_owner', lambda owner_id: 1 if owner_id == user_id else None)
+    bridged = []
+
+    async def wsgi(scope, receive, send):
+        bridged.append(scope['path'])
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+
+    monkeypatch.setattr(asgi.application, 'wsgi', wsgi)
+    for path, method in (('/stream', 'GET'), ('/connect', 'POST')):
+        run(asgi, {'type': 'http', 'method': method, 'path': path, 'headers': [(b'cookie', cookie)]},
+            [], lambda sent: False)
+    assert bridged == ['/stream', '/connect']
+
+    sent = run(asgi, {'type': 'websocket', 'path': '/ws', 'headers': [(b'cookie', cookie)]},
+               [{'type': 'websocket.connect'}], lambda sent: False)
+    assert sent == [{'type': 'websocket.close', 'code': 1013}]
@@ -0,0 +1,166 @@
+"""
+Tests for encryption at rest: sealing while spooling, random access,
+tamper and truncation detection, sealed resumable uploads and ranged
+responses from sealed files.
+"""
+import hashlib
+import io
+import os
+import threading
+
+import pytest
+from flask import Flask, request
+from at_rest import AtRestCipher, AtRestError, HEADER, TAG_SIZE
+from upload_spool import UploadSpool
+from resumable_upload import UploadSessions, UploadError
+from file_response import send_stored_file
+
+CHUNK = 1024
+
+
+def sealed_file(directory, cipher, data, pieces=700):
+    """Spool data through a sealing UploadSpool in odd-sized writes."""
+    spool = UploadSpool(directory, cipher=cipher)
+    for offset in range(0, len(data), pieces):
+        spool.write(data[offset:offset + pieces])
+    path = os.path.join(directory, spool.sha256.hexdigest())
+    spool.commit(path)
+    assert spool.size == len(data) and spool.sha256.hexdigest() == hashlib.sha256(data).hexdigest()
+    return path
+
+
+def test_round_trip(tmp_path):
+    """Files of every size around chunk boundaries read back unchanged, and only sealed."""
+    cipher = AtRestCipher(os.urandom(32), chunk_size=CHUNK)
+    for size in (0, 1, CHUNK - 1, CHUNK, CHUNK + 1, 3 * CHUNK, 3 * CHUNK + 5):
+        data = os.urandom(size)
+        path = sealed_file(str(tmp_path), cipher, data)
+        assert os.path.getsize(path) == cipher.sealed_size(size), size
+        assert cipher.plaintext_size(path) == size
+        with open(path, 'rb') as f:
+            assert size < 16 or data[:16] not in f.read(), "plaintext on disk"
+        with cipher.open(path) as f:
+            assert f.read() == data, size
+
+    # Files stored before encryption was enabled are read as they are
+    plain = os.path.join(tmp_path, 'old')
+    with open(plain, 'wb') as f:
+        f.write(b'legacy upload')
+    with cipher.open(plain) as f:
+        assert f.read() == b'legacy upload'
+
+
+def test_key_file_race(tmp_path):
+    """Workers creating the key at the same time all end up with the same full key."""
+    path = str(tmp_path / 'at_rest.key')
+    start = threading.Barrier(16)
+    keys = []
+
+    def load():
+        start.wait()
+        keys.append(AtRestCipher.from_key_file(path).key)
+
+    threads = [threading.Thread(target=load) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(keys) == 16 and len(set(keys)) == 1
+    assert os.listdir(tmp_path) == ['at_rest.key'], "temporary key file left behind"
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert AtRestCipher.from_key_file(path).key == keys[0]
+
+
+def test_random_access(tmp_path):
+    """Reads at any offset decrypt only the chunks they cover."""
+    cipher = AtRestCipher(os.urandom(32), chunk_size=CHUNK)
+    data = os.urandom(10 * CHUNK + 77)
+    with cipher.open(sealed_file(str(tmp_path), cipher, data)) as f:
+        assert f.seek(0, io.SEEK_END) == len(data)
+        for start, length in ((0, 10), (CHUNK - 3, 6), (5 * CHUNK, CHUNK), (len(data) - 50, 500), (len(data), 10)):
+            f.seek(start)
+            assert f.read(length) == data[start:start + length], (start, length)
+        buffer = bytearray(100)
+        f.seek(2 * CHUNK + 1000)
+        n = f.readinto(buffer)
+        assert bytes(buffer[:n]) == data[2 * CHUNK + 1000:2 * CHUNK + 1000 + n] and n == 24
+
+
+def test_tampering(tmp_path):
+    """Modified, truncated or transplanted chunks fail authentication."""
+    cipher = AtRestCipher(os.urandom(32), chunk_size=CHUNK)
+    data = os.urandom(4 * CHUNK)
+    path = sealed_file(str(tmp_path), cipher, data)
+    with open(path, 'rb') as f:
+        sealed = f.read()
+
+    def read_back(content):
+        broken = os.path.join(tmp_path, 'broken')
+        with open(broken, 'wb') as f:
+            f.write(content)
+        with cipher.open(broken) as f:
+            return f.read()
+
+    flipped = bytearray(sealed)
+    flipped[HEADER.size + CHUNK + 100] ^= 1
+    other = sealed_file(str(tmp_path), cipher, os.urandom(4 * CHUNK))
+    with open(other, 'rb') as f:
+        transplanted = sealed[:HEADER.size] + f.read()[HEADER.size:]
+    for content in (bytes(flipped), sealed[:-(CHUNK + TAG_SIZE)], transplanted):
+        with pytest.raises(AtRestError):
+            read_back(content)
+
+    with pytest.raises(AtRestError):
+        AtRestCipher(os.urandom(32), chunk_size=CHUNK).open(path).read()
+
+
+def test_sealed_resumable_upload(tmp_path):
+    """Resumable chunks are sealed in place and finalize into the plaintext's digest."""
+    directory = str(tmp_path)
+    cipher = AtRestCipher(os.urandom(32), chunk_size=CHUNK)
+    sessions = UploadSessions(directory, chunk_size=4 * CHUNK, cipher=cipher)
+    data = os.urandom(4 * CHUNK * 5 + 300)
+    upload = sessions.create('alice', 'main', 'big.zip', len(data))
+
+    for offset, body in ((0, data[:100]), (0, data[:4 * CHUNK] + b'x')):
+        with pytest.raises(UploadError):
+            upload.write_chunk(offset, io.BytesIO(body))
+
+    offsets = list(range(0, len(data), 4 * CHUNK))[::-1]
+    threads = [threading.Thread(target=upload.write_chunk,
+                                args=(offset, io.BytesIO(data[offset:offset + 4 * CHUNK])))
+               for offset in offsets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    spool = sessions.finalize(upload)
+    assert spool.size == len(data) and spool.sha256.hexdigest() == hashlib.sha256(data).hexdigest()
+    path = os.path.join(directory, 'done')
+    spool.commit(path)
+    with cipher.open(path) as f:
+        assert f.read() == data
+
+    with pytest.raises(ValueError):
+        UploadSessions(directory, chunk_size=CHUNK + 1, cipher=cipher)
+
+
+def test_sealed_response(tmp_path):
+    """Ranges of sealed files are decrypted, never sent from disk as they are."""
+    cipher = AtRestCipher(os.urandom(32), chunk_size=CHUNK)
+    data = os.urandom(50 * CHUNK + 10)
+    path = sealed_file(str(tmp_path), cipher, data)
+    app = Flask(__name__)
+
+    @app.route('/file')
+    def serve():
+        return send_stored_file(request, path, 'abc123', 'a.bin', 'application/octet-stream', cipher=cipher)
+
+    client = app.test_client()
+    response = client.get('/file')
+    assert response.status_code == 200 and response.data == data
+    assert response.headers['Content-Length'] == str(len(data))
+    for header, expected in (('bytes=1000-4999', data[1000:5000]), ('bytes=-10', data[-10:])):
+        response = client.get('/file', headers={'Range': header})
+        assert response.status_code == 206 and response.data == expected, header
@@ -0,0 +1,118 @@
+"""
+Tests for the loopback benchmark: histogram percentiles, the baseline
+transports, driving a Noise server process and the result files.
+"""
+import json
+import os
+import random
+import textwrap
+
+from benchmark import LatencyHistogram, run_benchmark, write_results
+
+# Stand-in for the Noise implementation: a server that drains its
+# clients and quits on command, and a client speaking plain TCP
+STUB_SERVER = '''
+import argparse, socket, sys, threading
+parser = argparse.ArgumentParser()
+parser.add_argument('--port', type=int)
+sock = socket.socket()
+sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+sock.bind(('0.0.0.0', parser.parse_args().port))
+sock.listen()
+def drain(conn):
+    while conn.recv(65536):
+        pass
+def accept():
+    while True:
+        threading.Thread(target=drain, args=(sock.accept()[0],), daemon=True).start()
+threading.Thread(target=accept, daemon=True).start()
+for line in sys.stdin:
+    if line.strip() == 'quit':
+        break
+'''
+
+STUB_CLIENT = '''
+import socket
+class NoiseChatClient:
+    def __init__(self, host, port, username):
+        self.address = (host, port)
+        self.connected = False
+    def connect(self):
+        self.sock = socket.create_connection(self.address)
+        self.connected = True
+        return True
+    def send_chat_message(self, message):
+        self.sock.sendall(message.encode())
+        return {'success': True}
+    def disconnect(self):
+        self.sock.close()
+'''
+
+
+def stub_implementation(root):
+    implementation = os.path.join(root, 'noiseprotocol', 'Implementation')
+    os.makedirs(implementation)
+    for path, content in (('noiseprotocol/__init__.py', ''), ('noiseprotocol/Implementation/__init__.py', ''),
+                          ('noiseprotocol/Implementation/noise_chat_server.py', STUB_SERVER),
+                          ('noiseprotocol/Implementation/noise_chat_client.py', STUB_CLIENT)):
+        with open(os.path.join(root, path), 'w') as f:
+            f.write(textwrap.dedent(content))
+    return implementation
+
+
+def test_histogram():
+    """Percentiles are within the bucket precision of the exact ones."""
+    histogram = LatencyHistogram()
+    samples = [random.lognormvariate(-9, 1) for _ in range(20000)]
+    for sample in samples:
+        histogram.record(sample)
+    samples.sort()
+    for percent in (50, 95, 99):
+        exact = samples[int(percent / 100 * len(samples)) - 1]
+        assert abs(histogram.percentile(percent) - exact) <= exact * 0.04, percent
+    assert histogram.percentile(100) == histogram.max == samples[-1]
+    assert histogram.min == samples[0] and histogram.count == len(samples)
+    assert LatencyHistogram().percentile(99) == 0.0
+
+
+def test_baselines():
+    """The socket transports send every message and report consistent figures."""
+    progress = []
+    results, errors = run_benchmark(['tls13', 'plain_tls', 'unencrypted', 'carrier_pigeon'], 500, 256,
+                                    progress=lambda percent, protocol: progress.append(percent))
+    assert set(results) == {'tls13', 'plain_tls', 'unencrypted'} and set(errors) == {'carrier_pigeon'}
+    assert progress == [0, 25, 50, 75, 100]
+    for result in results.values():
+        assert result['messages'] == 500 and result['throughput'] > 0
+        assert result['min_latency'] <= result['p50_latency'] <= result['p95_latency'] <= \
+            result['p99_latency'] <= result['max_latency']
+        assert result['handshake_time'] > 0 and result['cpu_usage'] >= 0
+
+
+def test_noise_server(tmp_path):
+    """The Noise server is started on a free port, driven and shut down."""
+    implementation = stub_implementation(str(tmp_path / 'stub'))
+    results, errors = run_benchmark(['noise'], 300, 100, implementation)
+    assert not errors, errors
+    assert results['noise']['messages'] == 300 and results['noise']['throughput'] > 0
+
+    # A missing implementation is reported, not faked
+    results, errors = run_benchmark(['noise'], 10, 10, str(tmp_path / 'missing'))
+    assert not results and 'noise_chat_server.py' in errors['noise']
+
+
+def test_result_files(tmp_path):
+    """Results are written in the dashboard's CSV and JSON schema."""
+    directory = str(tmp_path)
+    results, _ = run_benchmark(['unencrypted', 'tls13'], 100, 64)
+    csv_path, json_path = write_results(results, directory, {'messages': 100, 'message_size': 64})
+    with open(csv_path) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == "Protocol,HandshakeTime,Latency,Throughput,CPUUsage,MemoryUsage"
+    assert [line.split(',')[0] for line in lines[1:]] == ['TLS 1.3', 'Unencrypted']
+    with open(json_path) as f:
+        data = json.load(f)
+    assert data['protocols'] == ['TLS 1.3', 'Unencrypted']
+    assert set(data['metrics']) == {'handshake_time', 'latency', 'throughput', 'cpu_usage', 'memory_usage'}
+    assert data['metrics']['latency']['values'][1] == results['unencrypted']['avg_latency'] * 1000
+    assert data['details']['TLS 1.3']['p99_latency'] == results['tls13']['p99_latency']
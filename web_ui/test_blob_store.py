@@ -0,0 +1,147 @@
+"""
+Tests for the content-addressed upload store: deduplication, reference
+counts, releasing a room's references as its history goes, sharding and
+quota collection.
+"""
+import hashlib
+import io
+import os
+import sqlite3
+
+from blob_store import BlobStore, file_digest
+from state_backend import create_state
+from upload_spool import UploadSpool
+
+
+def spool(directory, data):
+    return UploadSpool.from_stream(io.BytesIO(data), directory)
+
+
+def test_deduplication(tmp_path):
+    """The same content is written once, however often it is uploaded."""
+    directory = str(tmp_path)
+    store = BlobStore(os.path.join(directory, 'objects'))
+
+    digest, duplicate = store.store(spool(directory, b'report' * 1000), 'main')
+    assert not duplicate
+    again, duplicate = store.store(spool(directory, b'report' * 1000), 'dev')
+    assert again == digest and duplicate
+    store.store(spool(directory, b'report' * 1000), 'dev')
+
+    with open(store.path(digest), 'rb') as f:
+        assert f.read() == b'report' * 1000
+    assert store.references(digest) == 3
+    assert not [name for name in os.listdir(directory) if name.endswith('.part')], "temporary file left behind"
+
+
+def test_release_room(tmp_path):
+    """Blobs are deleted once no room references them."""
+    directory = str(tmp_path)
+    store = BlobStore(os.path.join(directory, 'objects'))
+    shared, _ = store.store(spool(directory, b'shared'), 'main')
+    store.store(spool(directory, b'shared'), 'dev')
+    private, _ = store.store(spool(directory, b'only in dev'), 'dev')
+
+    assert store.release_room('dev') == 1
+    assert not os.path.exists(store.path(private))
+    assert os.path.exists(store.path(shared)) and store.references(shared) == 1
+
+    # Re-uploading released content stores it again
+    again, duplicate = store.store(spool(directory, b'only in dev'), 'main')
+    assert again == private and not duplicate and os.path.exists(store.path(private))
+
+
+def test_release_unknown_rooms(tmp_path):
+    """At startup, rooms the state no longer knows give up their blobs."""
+    directory = str(tmp_path)
+    store = BlobStore(os.path.join(directory, 'objects'))
+    shared, _ = store.store(spool(directory, b'shared'), 'main')
+    store.store(spool(directory, b'shared'), 'lost')
+    lost, _ = store.store(spool(directory, b'only in lost'), 'lost')
+    kept, _ = store.store(spool(directory, b'only in dev'), 'dev')
+
+    assert store.release_unknown_rooms(lambda room_id: room_id in ('main', 'dev')) == 1
+    assert not os.path.exists(store.path(lost))
+    assert store.references(shared) == 1 and store.references(kept) == 1
+    assert store.release_unknown_rooms(lambda room_id: True) == 0
+
+
+def post_file(store, state, room_id, data):
+    """Store an upload and post its file message, the way app.py does."""
+    digest, _ = store.store(spool(store.directory, data), room_id)
+    state.rooms[room_id]['log'].append('alice', {'type': 'file', 'file_info': {'stored_filename': f'{digest}_a.bin'}})
+    return digest
+
+
+def test_release_with_deleted_room(tmp_path):
+    """With the default durable history, deleting a room deletes its messages and releases their blobs."""
+    store = BlobStore(str(tmp_path / 'objects'))
+    state = create_state('memory', history_dir=str(tmp_path / 'history'))
+    state.create_room('dev', 'Dev', '', 'alice')
+    digest = post_file(store, state, 'dev', b'design notes')
+    assert file_digest(state.rooms['dev']['log'].history(None, 10)[0].incoming) == digest
+
+    assert state.delete_room('dev')
+    store.release_room('dev')
+    assert not os.path.exists(store.path(digest))
+    assert os.listdir(tmp_path / 'history') == ['.lock'], "deleted room's log left on disk"
+    state.create_room('dev', 'Dev', '', 'alice')
+    assert state.rooms['dev']['log'].history(None, 10) == []
+
+
+def test_release_trimmed_messages(tmp_path):
+    """History kept in memory alone releases each file message it drops."""
+    store = BlobStore(str(tmp_path / 'objects'))
+    state = create_state('memory', history_limit=2)
+    state.on_trim(lambda room_id, record: store.release(room_id, file_digest(record.incoming)))
+    state.create_room('dev', 'Dev', '', 'alice')
+    first = post_file(store, state, 'dev', b'first')
+    second = post_file(store, state, 'dev', b'second')
+    assert post_file(store, state, 'dev', b'second') == second
+    assert not os.path.exists(store.path(first))
+    assert store.references(second) == 2
+
+    post_file(store, state, 'dev', b'third')
+    assert os.path.exists(store.path(second)) and store.references(second) == 1
+
+
+def test_sharding(tmp_path):
+    """Blobs live in hash-prefixed subdirectories, flat ones are moved there."""
+    directory = str(tmp_path)
+    objects = os.path.join(directory, 'objects')
+    digest, _ = BlobStore(objects).store(spool(directory, b'sharded'), 'main')
+    assert os.path.isfile(os.path.join(objects, digest[:2], digest[2:4], digest))
+
+    # A blob left flat by an older release
+    flat = hashlib.sha256(b'flat').hexdigest()
+    with open(os.path.join(objects, flat), 'wb') as f:
+        f.write(b'flat')
+    store = BlobStore(objects)
+    assert not os.path.exists(os.path.join(objects, flat))
+    with store.open(flat) as f:
+        assert f.read() == b'flat'
+
+
+def test_collect(tmp_path):
+    """Orphans are deleted, then the least recently used blobs until the quota fits."""
+    directory = str(tmp_path)
+    store = BlobStore(os.path.join(directory, 'objects'))
+    digests = [store.store(spool(directory, bytes([i]) * 1000), 'main')[0] for i in range(5)]
+    db = sqlite3.connect(os.path.join(directory, 'objects', 'blobs.db'))
+    with db:
+        for age, digest in enumerate(digests):
+            db.execute("UPDATE blobs SET last_access = ? WHERE digest = ?", (1000 + age, digest))
+        db.execute("DELETE FROM refs WHERE digest = ?", (digests[4],))
+
+    store.touch(digests[0])  # Read just now, so the most recently used
+    assert store.collect(quota=2500, grace=0) == {'orphans': 1, 'evicted': 2, 'freed': 3000}
+    remaining = {digest for digest in digests if os.path.exists(store.path(digest))}
+    assert remaining == {digests[0], digests[3]}
+    assert store.usage() == (2, 2000)
+    # Evicted blobs keep their references and come back when uploaded again
+    assert store.references(digests[1]) == 1
+    assert store.store(spool(directory, bytes([1]) * 1000), 'main') == (digests[1], False)
+
+    # Recently used blobs are protected by the grace period
+    assert store.collect(quota=0, grace=3600)['evicted'] == 1
+    assert os.path.exists(store.path(digests[0])) and os.path.exists(store.path(digests[1]))
@@ -0,0 +1,32 @@
+"""
+Tests for the WebSocket chat framing.
+"""
+import json
+
+import pytest
+
+from chat_socket import (encode_frame, encode_json_frame, decode_frame, FrameError,
+                         FRAME_ACK, FRAME_MESSAGE, FRAME_PING, FRAME_SEND)
+
+
+def test_encode_frames():
+    assert encode_frame(FRAME_ACK, 7, False, 'Not a member') == '["a",7,false,"Not a member"]'
+    assert encode_frame(FRAME_PING) == '["p"]'
+    # Cached message JSON is spliced in as is
+    payload = json.dumps({'content': 'hé', 'seq': 3}).encode('utf-8')
+    frame = encode_json_frame(FRAME_MESSAGE, payload)
+    assert json.loads(frame) == [FRAME_MESSAGE, {'content': 'hé', 'seq': 3}]
+
+
+def test_decode_frames():
+    assert decode_frame('["s",1,"main","hello"]') == [FRAME_SEND, 1, 'main', 'hello']
+    assert decode_frame(b'["p"]') == [FRAME_PING]
+
+
+@pytest.mark.parametrize('raw', [
+    'not json', None, '{"s": 1}', '[]', '[1]', '["x"]',
+    '["s",1,"main"]', '["s",1,"main",42]', '["s",1,"main","hi","extra"]'
+])
+def test_malformed_frames(raw):
+    with pytest.raises(FrameError):
+        decode_frame(raw)
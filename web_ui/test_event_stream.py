@@ -0,0 +1,53 @@
+"""
+Tests for the Server-Sent Events helpers: change notifications, event
+encoding and resuming from Last-Event-ID cursors.
+"""
+import asyncio
+import threading
+
+from event_stream import ChangeNotifier, format_event, encode_cursors, decode_cursors
+
+
+def test_wait_wakes_on_notify():
+    """A waiting stream wakes when its user is notified, and times out otherwise."""
+    notifier = ChangeNotifier()
+    version = notifier.version('alice')
+    assert notifier.wait('alice', version, timeout=0.01) == version
+
+    timer = threading.Timer(0.05, notifier.notify, args=('alice',))
+    timer.start()
+    assert notifier.wait('alice', version, timeout=5) == version + 1
+    # A change made before waiting is not missed
+    notifier.notify('alice')
+    assert notifier.wait('alice', version + 1, timeout=0) == version + 2
+    assert notifier.version('bob') == 0
+
+
+def test_wait_async():
+    """Coroutines are woken from other threads."""
+    notifier = ChangeNotifier()
+
+    async def main():
+        version = notifier.version('alice')
+        assert await notifier.wait_async('alice', version, timeout=0.01) == version
+        threading.Timer(0.05, notifier.notify, args=('alice',)).start()
+        return await notifier.wait_async('alice', version, timeout=5)
+
+    assert asyncio.run(main()) == 1
+    assert not notifier._async_waiters
+
+
+def test_format_event():
+    assert format_event({'a': 1}, event='status', event_id='main:3', retry=3000) == \
+        b'id: main:3\nevent: status\nretry: 3000\ndata: {"a": 1}\n\n'
+    assert format_event(b'{"seq":1}', event='message') == b'event: message\ndata: {"seq":1}\n\n'
+    assert format_event('two\nlines') == b'data: two\ndata: lines\n\n'
+
+
+def test_resume_from_last_event_id():
+    """Cursors survive the round trip through an event id, whatever the room ids."""
+    cursors = {'main': 12, 'dev,ops': 3, 'a:b': 0, 'ünï': 7}
+    assert decode_cursors(encode_cursors(cursors)) == cursors
+    # A damaged header only loses the entries it damaged
+    assert decode_cursors('main:12,garbage,dev:x,:4') == {'main': 12}
+    assert decode_cursors(None) == {} and decode_cursors('') == {}
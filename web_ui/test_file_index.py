@@ -0,0 +1,82 @@
+"""
+Tests for the per-user file index: visibility, pagination across rooms and
+catching up with records it was not handed.
+"""
+from message_store import RoomLog
+from file_index import FileIndex
+
+MEMBERS = {'alice', 'bob'}
+
+
+def make_index(logs, joined):
+    def recipients(room_id, record):
+        return [user for user in MEMBERS
+                if user != record.sender_id and joined.get((user, room_id), record.seq) < record.seq]
+    return FileIndex(recipients, logs.get)
+
+
+def share(log, index, room_id, sender, name):
+    outgoing = {'type': 'outgoing_file', 'room_id': room_id, 'file_info': {'filename': name}}
+    incoming = dict(outgoing, type='file')
+    record = log.append(sender, outgoing, incoming)
+    index.add(room_id, log, record)
+    return record
+
+
+def names(files):
+    return [entry['file_info']['filename'] for entry in files]
+
+
+def test_visibility():
+    """Only other members who had joined before the file was shared see it."""
+    logs = {'main': RoomLog(limit=100)}
+    joined = {('alice', 'main'): 0}
+    index = make_index(logs, joined)
+
+    share(logs['main'], index, 'main', 'alice', 'a.txt')
+    logs['main'].append('alice', {'type': 'outgoing', 'content': 'hi'})
+    joined[('bob', 'main')] = logs['main'].last_seq
+    share(logs['main'], index, 'main', 'alice', 'b.txt')
+    share(logs['main'], index, 'main', 'bob', 'c.txt')
+
+    assert names(index.files('bob', ['main'])[0]) == ['b.txt']
+    assert names(index.files('alice', ['main'])[0]) == ['c.txt']
+
+    index.forget_room('bob', 'main')
+    assert index.files('bob', ['main'])[0] == []
+
+
+def test_pagination_across_rooms():
+    """Pages interleave rooms newest first and never repeat a file."""
+    logs = {'main': RoomLog(limit=1000), 'dev': RoomLog(limit=1000)}
+    joined = {('bob', 'main'): 0, ('bob', 'dev'): 0}
+    index = make_index(logs, joined)
+    for n in range(250):
+        room_id = 'dev' if n % 3 == 0 else 'main'
+        share(logs[room_id], index, room_id, 'alice', f'{n}.bin')
+
+    listed = []
+    before = None
+    while True:
+        files, before = index.files('bob', ['main', 'dev'], before, limit=40)
+        listed.extend(names(files))
+        if before is None:
+            break
+    assert listed == [f'{n}.bin' for n in reversed(range(250))]
+
+    dev_files, _ = index.files('bob', ['dev'], limit=5)
+    assert names(dev_files) == ['249.bin', '246.bin', '243.bin', '240.bin', '237.bin']
+
+
+def test_catch_up():
+    """Files appended to the log without add() are picked up on listing."""
+    logs = {'main': RoomLog(limit=100)}
+    index = make_index(logs, {('bob', 'main'): 0})
+    share(logs['main'], index, 'main', 'alice', 'first.txt')
+    log = logs['main']
+    log.append('alice', {'type': 'outgoing_file', 'file_info': {'filename': 'remote.txt'}},
+               {'type': 'file', 'file_info': {'filename': 'remote.txt'}})
+
+    assert names(index.files('bob', ['main'])[0]) == ['remote.txt', 'first.txt']
+    share(log, index, 'main', 'alice', 'third.txt')
+    assert names(index.files('bob', ['main'])[0]) == ['third.txt', 'remote.txt', 'first.txt']
@@ -0,0 +1,46 @@
+"""
+Tests for stored file responses: ETag revalidation and byte ranges.
+"""
+import os
+
+import pytest
+
+from flask import Flask, request
+from file_response import send_stored_file
+
+DATA = os.urandom(200000)
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = os.path.join(tmp_path, 'blob')
+    with open(path, 'wb') as f:
+        f.write(DATA)
+    app = Flask(__name__)
+
+    @app.route('/file')
+    def serve():
+        return send_stored_file(request, path, 'abc123', 'song.mp3', 'audio/mpeg')
+
+    return app.test_client()
+
+
+def test_etag(client):
+    response = client.get('/file')
+    assert response.status_code == 200 and response.data == DATA
+    assert response.headers['ETag'] == '"abc123"'
+    assert client.get('/file', headers={'If-None-Match': '"abc123"'}).status_code == 304
+    assert client.get('/file', headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_ranges(client):
+    cases = {'bytes=0-99': DATA[:100], 'bytes=150000-': DATA[150000:], 'bytes=-500': DATA[-500:]}
+    for header, expected in cases.items():
+        response = client.get('/file', headers={'Range': header})
+        assert response.status_code == 206, header
+        assert response.data == expected, header
+        assert response.headers['Content-Length'] == str(len(expected))
+
+    assert client.get('/file', headers={'Range': 'bytes=300000-'}).status_code == 416
+    stale = client.get('/file', headers={'Range': 'bytes=0-9', 'If-Range': '"old"'})
+    assert stale.status_code == 200 and stale.data == DATA
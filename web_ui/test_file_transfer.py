@@ -0,0 +1,141 @@
+"""
+Tests for the framed file transfer: the messages a file is sent as, their
+size limit, the read-ahead window, aborting on a refused message and
+transfers running in the background.
+"""
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+
+import pytest
+
+from file_transfer import FileTransferSender, FileTransfers, TransferError, FRAME_SIZE
+
+
+def recorded_transfer(source, frame_size=1024, filename='report.pdf'):
+    """Send a file into a list of decoded messages."""
+    sent = []
+    sender = FileTransferSender(lambda text: sent.append(text) or {'success': True}, frame_size=frame_size)
+    details = sender.send_file(source, filename)
+    return [json.loads(text) for text in sent], sent, details
+
+
+@pytest.mark.parametrize('size', [0, 1024, 10 * 1024 + 17])
+def test_round_trip(tmp_path, size):
+    """The frames of a transfer reassemble into the file, in order and flagged final."""
+    data = os.urandom(size)
+    path = tmp_path / 'source.bin'
+    path.write_bytes(data)
+    messages, _, details = recorded_transfer(str(path))
+
+    start, frames, end = messages[0], messages[1:-1], messages[-1]
+    assert start['noise_file'] == 'start' and start['filename'] == 'report.pdf' and start['size'] == size
+    assert len(frames) == start['frames'] == details['frames'] == max(1, -(-size // 1024))
+    assert [frame['index'] for frame in frames] == list(range(len(frames)))
+    assert [frame['final'] for frame in frames] == [False] * (len(frames) - 1) + [True]
+    assert {m['transfer_id'] for m in messages} == {details['transfer_id']}
+    assert b''.join(base64.b64decode(frame['data']) for frame in frames) == data
+    assert end == {'noise_file': 'end', 'transfer_id': details['transfer_id'],
+                   'sha256': hashlib.sha256(data).hexdigest()}
+    assert 'key' not in start, "transfer must rely on the channel's encryption"
+
+
+def test_file_object_and_frame_limit():
+    """File objects are sent from the start and left open; frames fit a Noise message."""
+    source = io.BytesIO(os.urandom(3 * FRAME_SIZE))
+    source.seek(100)
+    messages, sent, details = recorded_transfer(source, frame_size=FRAME_SIZE)
+    assert not source.closed and details['original_size'] == 3 * FRAME_SIZE
+    assert max(len(text.encode()) for text in sent) < 65535 - 16
+    assert len(base64.b64decode(messages[1]['data'])) == FRAME_SIZE
+
+
+def test_channel_metadata():
+    """The channel's own report of the first frame is shown as the transfer's encryption."""
+    def send(text):
+        return {'success': True, 'metadata': {'key_id': 'session-7', 'encrypted_hex': 'ab' * 200}}
+
+    details = FileTransferSender(send).send_file(io.BytesIO(b'hello'), 'a.txt')
+    assert details['key_id'] == 'session-7' and details['algorithm'] == 'Noise transport'
+    assert details['encrypted_hex'] == 'ab' * 64 + '...'
+
+
+def test_refused_channel():
+    """A send the channel refuses aborts the transfer."""
+    sent = []
+
+    def flaky_send(text):
+        sent.append(text)
+        return {'success': len(sent) < 3}
+
+    with pytest.raises(TransferError):
+        FileTransferSender(flaky_send, frame_size=1024).send_file(io.BytesIO(os.urandom(8192)))
+    assert len(sent) == 3
+
+
+class CountingReader(io.BytesIO):
+    """Source that remembers how many frames were read."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
+def test_read_ahead_window():
+    """Frames are read ahead of the channel, but never more than the window."""
+    source = CountingReader(os.urandom(64 * 1024))
+    ahead = []
+
+    def send(text):
+        message = json.loads(text)
+        if message['noise_file'] == 'frame':
+            ahead.append(source.reads - message['index'])
+        return {'success': True}
+
+    details = FileTransferSender(send, frame_size=1024, window=4).send_file(source, 'a.bin')
+    assert details['frames'] == 64 and max(ahead) <= 4 + 2
+    assert details['encrypted_size'] > 64 * 1024
+
+
+def test_refused_channel_stops_reader():
+    """A refused frame aborts the transfer without leaving the reader blocked."""
+    sent = []
+
+    def send(text):
+        sent.append(text)
+        return {'success': len(sent) < 3}
+
+    with pytest.raises(TransferError):
+        FileTransferSender(send, frame_size=1024, window=2).send_file(io.BytesIO(os.urandom(64 * 1024)))
+    assert not [thread for thread in threading.enumerate() if thread.name == 'noise-transfer-read']
+
+
+def test_background_transfers():
+    """A transfer runs on a worker and reports its progress and result."""
+    transfers = FileTransfers(max_workers=1)
+    release = threading.Event()
+
+    def send(transfer_id, progress):
+        progress(1)
+        release.wait(5)
+        sender = FileTransferSender(lambda text: {'success': True}, frame_size=1024)
+        return sender.send_file(io.BytesIO(b'x' * 3000), 'a.bin', transfer_id=transfer_id, progress=progress)
+
+    status = transfers.start('alice', 'main', 'a.bin', 3000, 1024, send)
+    assert status['state'] == 'queued' and status['frames'] == 3
+    failed = transfers.start('alice', 'main', 'b.bin', 10, 1024, lambda transfer_id, progress: False)
+    release.set()
+    transfers._executor.shutdown(wait=True)
+
+    done = transfers.get(status['transfer_id'])
+    assert done['state'] == 'sent' and done['frames_sent'] == 3 and done['transfer_id'] == status['transfer_id']
+    assert done['sha256'] == hashlib.sha256(b'x' * 3000).hexdigest()
+    assert transfers.get(failed['transfer_id'])['state'] == 'failed'
+    assert transfers.get('unknown') is None
@@ -0,0 +1,115 @@
+"""
+Tests for the message bus: delivery between nodes, publish batching, the
+socket broker and frame authentication.
+"""
+import socket
+import threading
+import time
+
+import pytest
+
+from message_bus import (MessageBus, InMemoryHub, InMemoryBus, SocketBus, BusBroker,
+                         FRAME_HEADER, seal_frame, bus_key)
+
+EVENTS = 5000
+
+
+def collect(bus, expected):
+    """Subscribe to a bus and return (received list, event set when `expected` arrived)."""
+    received = []
+    done = threading.Event()
+
+    def handler(event):
+        received.append(event)
+        if len(received) == expected:
+            done.set()
+
+    bus.subscribe(handler)
+    return received, done
+
+
+def check_delivery(sender, receivers):
+    inboxes = [collect(receiver, EVENTS) for receiver in receivers]
+    own, _ = collect(sender, EVENTS)
+
+    for i in range(EVENTS):
+        sender.publish({'type': 'message', 'room_id': 'main', 'n': i})
+    assert sender.flush(timeout=10), "publish queue did not drain"
+
+    for received, done in inboxes:
+        assert done.wait(10), f"only {len(received)} of {EVENTS} events arrived"
+        assert [event['n'] for event in received] == list(range(EVENTS)), "events out of order"
+    assert not own, "a node received its own events"
+
+    # Batching: far fewer bus writes than events
+    assert sender.events_sent == EVENTS
+    assert sender.batches_sent < EVENTS / 10, f"{sender.batches_sent} batches for {EVENTS} events"
+
+
+def test_in_memory_bus():
+    """Events reach every other node on the hub, in order and batched."""
+    hub = InMemoryHub()
+    nodes = [InMemoryBus(hub) for _ in range(3)]
+    check_delivery(nodes[0], nodes[1:])
+
+
+def test_single_node_is_silent():
+    """Alone on its hub, a node publishes into the void without errors."""
+    bus = InMemoryBus(InMemoryHub())
+    bus.publish({'type': 'room', 'room_id': 'dev'})
+    assert bus.flush(timeout=2)
+
+
+def test_socket_bus(tmp_path):
+    """Events are relayed through the broker to the other connected nodes."""
+    url = f'unix://{tmp_path}/bus.sock'
+    BusBroker(url).start()
+    nodes = [SocketBus(url, reconnect_delay=0.05) for _ in range(3)]
+    for node in nodes:
+        assert node.wait_connected(5), "node did not connect to the broker"
+    time.sleep(0.1)  # Let the broker's accept loop register every node
+    check_delivery(nodes[0], nodes[1:])
+
+
+def test_authenticated_bus(tmp_path):
+    """With a secret, forged and replayed frames never reach the nodes."""
+    url = f'unix://{tmp_path}/bus.sock'
+    BusBroker(url, secret='s3cret').start()
+    sender, receiver = (SocketBus(url, reconnect_delay=0.05, secret='s3cret') for _ in range(2))
+    for node in (sender, receiver):
+        assert node.wait_connected(5), "node did not connect to the broker"
+    received, done = collect(receiver, 2)
+
+    def connect():
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(f'{tmp_path}/bus.sock')
+        return sock
+
+    def send(sock, payload):
+        sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+    # A frame under the wrong key gets its sender disconnected
+    forger = connect()
+    time.sleep(0.1)
+    send(forger, seal_frame(bus_key(url, 'guess'), b'f' * 16, 0, b'[{"type":"forged"}]'))
+    assert forger.recv(1) == b'', "broker kept a peer sending forged frames"
+
+    # A frame that verifies is relayed, but only the first time
+    replayer = connect()
+    time.sleep(0.1)
+    frame = seal_frame(bus_key(url, 's3cret'), b'r' * 16, 0, b'[{"type":"first"}]')
+    send(replayer, frame)
+    send(replayer, frame)
+    sender.publish({'type': 'second'})
+    assert done.wait(5), f"only {len(received)} events arrived"
+    time.sleep(0.1)
+    assert [event['type'] for event in received] == ['first', 'second']
+
+    with pytest.raises(ValueError):
+        SocketBus('tcp://127.0.0.1:1')
+
+
+def test_transport_is_abstract():
+    """A bus without a transport cannot be created."""
+    with pytest.raises(TypeError):
+        MessageBus()
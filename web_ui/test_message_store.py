@@ -0,0 +1,167 @@
+"""
+Tests for the shared room message log (sequence numbers, cursor reads, the
+per-reader views of a shared record and their cached JSON, the bounded
+ring), for the recent event index, and for how the app fills messages in
+when they are posted and reads them back from /messages. The app tests
+need its own dependencies (the Noise client) and are skipped without them.
+"""
+import copy
+import json
+import uuid
+
+import pytest
+
+import message_store
+from message_store import RoomLog, RoomMessage, RecentEvents
+
+
+def test_cursor_reads():
+    """Sequence numbers count up from 1 and a cursor returns only what is newer."""
+    log = RoomLog()
+    for n in range(5):
+        log.append('alice', {'content': f'm{n}'})
+
+    assert log.last_seq == 5
+    assert [record.seq for record in log.records_after(0)] == [1, 2, 3, 4, 5]
+    assert [record.view('bob')['content'] for record in log.records_after(3)] == ['m3', 'm4']
+    assert [record.view('bob')['seq'] for record in log.records_after(3)] == [4, 5]
+    assert log.records_after(5) == [] and log.records_after(9) == []
+
+
+def test_cursor_rooms_are_independent():
+    """Every room numbers its own messages."""
+    main, dev = RoomLog(), RoomLog()
+    main.append('alice', {'content': 'hello'})
+    main.append('alice', {'content': 'again'})
+    assert dev.append('bob', {'content': 'first'}).seq == 1
+    assert [record.view('alice')['content'] for record in dev.records_after(0)] == ['first']
+
+
+def test_shared_record_views():
+    """One record serves every member: the sender sees its own view, everyone else the other."""
+    log = RoomLog()
+    record = log.append('alice', {'type': 'outgoing', 'content': 'hi'}, {'type': 'incoming', 'content': 'hi'})
+    assert record.view('alice') is record.outgoing and record.view('bob') is record.incoming
+    assert record.view(None)['type'] == 'incoming'
+    assert json.loads(record.view_json('alice')) == {'type': 'outgoing', 'content': 'hi', 'seq': 1}
+
+    # A message with a single view is stored once
+    system = log.append(None, {'type': 'system', 'content': 'bob joined'})
+    assert system.outgoing is system.incoming and system.outgoing_json is system.incoming_json
+
+
+def test_cached_json():
+    """Views are serialized once at append; reads splice the cached bytes."""
+    log = RoomLog()
+    record = log.append('alice', {'content': 'hé', 'type': 'outgoing'}, {'content': 'hé', 'type': 'incoming'})
+    fragments = [stored.view_json('bob') for stored in log.records_after(0)]
+    assert fragments[0] is record.incoming_json
+    assert json.loads(b'[' + b','.join(fragments) + b']') == [record.view('bob')]
+
+    # Records rebuilt from storage reuse the stored bytes
+    again = RoomMessage.from_json(record.seq, 'alice', record.outgoing_json, record.incoming_json)
+    assert again.outgoing_json == record.outgoing_json and again.incoming == record.incoming
+    same = RoomMessage.from_json(2, None, b'{"seq":2}', b'{"seq":2}')
+    assert same.outgoing is same.incoming
+
+
+def test_ring_is_bounded():
+    """Past its limit the log drops its oldest records; cursors keep reading the newest."""
+    dropped = []
+    log = RoomLog(limit=3, on_drop=dropped.append)
+    for n in range(1, 6):
+        log.append('alice', {'content': f'm{n}'})
+
+    assert len(log) == 3 and log.last_seq == 5
+    assert [record.seq for record in dropped] == [1, 2]
+    # A cursor older than the ring gets everything still in it
+    assert [record.seq for record in log.records_after(0)] == [3, 4, 5]
+    assert [record.seq for record in log.records_after(4)] == [5]
+    assert [record.seq for record in log.history(5, 10)] == [3, 4]
+
+
+def test_recent_events_ttl(monkeypatch):
+    """An event is a duplicate within the TTL of its first posting and new again after it."""
+    now = [1000.0]
+    monkeypatch.setattr(message_store.time, 'monotonic', lambda: now[0])
+    events = RecentEvents(ttl=10)
+    assert events.record(('main', 'alice', 'join'))
+    assert not events.record(('main', 'alice', 'join'))
+    assert events.record(('main', 'alice', 'leave')) and events.record(('dev', 'alice', 'join'))
+
+    now[0] += 9.9
+    assert not events.record(('main', 'alice', 'join')), "a duplicate must not extend the TTL either"
+    now[0] += 0.1
+    assert events.record(('main', 'alice', 'join'))
+    # Expired entries are dropped as time moves on
+    now[0] += 10
+    events.record(('main', 'bob', 'join'))
+    assert list(events._deadlines) == [('main', 'bob', 'join')]
+
+
+class ConnectedClient:
+    """Noise client whose handshake already completed."""
+
+    connected = True
+
+    def send_chat_message(self, message):
+        return {'success': True, 'metadata': {'key_id': 'test'}}
+
+    def disconnect(self):
+        self.connected = False
+
+
+@pytest.fixture(scope='module')
+def web(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('app')
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('NOISE_WEB_HISTORY_DIR', str(directory / 'history'))
+        mp.setenv('NOISE_WEB_AT_REST_KEY_FILE', str(directory / 'at_rest.key'))
+        return pytest.importorskip('app')
+
+
+def test_normalize_message(web):
+    """Posted messages get their room, id and decryption details once, at ingest."""
+    message = web.normalize_message({'type': 'incoming', 'content': 'hello'}, 'main')
+    assert message['room_id'] == 'main' and message['room_name'] == 'Main Room'
+    assert uuid.UUID(message['message_id'])
+    assert message['decryption']['decrypted_size'] == 5
+
+    # What the sender already filled in is kept
+    given = {'type': 'outgoing', 'content': 'hi', 'room_name': 'Lobby', 'message_id': 'm1'}
+    message = web.normalize_message(given, 'main')
+    assert message is given and message['room_name'] == 'Lobby' and message['message_id'] == 'm1'
+    assert 'decryption' not in message
+
+    # Stored records come out of the log complete
+    log = web.state.rooms['main']['log']
+    web.post_system_message('main', {'type': 'system', 'content': 'carol joined'}, 'join', uuid.uuid4().hex)
+    stored = log.records_after(log.last_seq - 1)[0].incoming
+    assert stored['room_id'] == 'main' and stored['room_name'] == 'Main Room' and 'message_id' in stored
+
+
+def test_messages_is_a_pure_read(web):
+    """Reading /messages neither moves the member's cursor nor changes the stored records."""
+    user_id = uuid.uuid4().hex
+    assert web.register_client(user_id, ConnectedClient(), 'alice', 'localhost', 8000)
+    log = web.state.rooms['main']['log']
+    for n in range(3):
+        log.append(user_id, web.normalize_message({'type': 'outgoing', 'content': f'm{n}'}, 'main'),
+                   web.normalize_message({'type': 'incoming', 'content': f'm{n}'}, 'main'))
+    records = log.records_after(0)
+    before = ([copy.deepcopy((record.outgoing, record.incoming)) for record in records],
+              [record.view_json(user_id) for record in records],
+              dict(web.clients[user_id]['room_cursors']), log.last_seq)
+
+    client = web.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    first = client.get('/messages?room=main&since=0').get_json()
+    assert [message['content'] for message in first['messages']][-3:] == ['m0', 'm1', 'm2']
+    assert client.get('/messages?room=main&since=0').get_json() == first
+    client.get('/messages')
+
+    after = ([copy.deepcopy((record.outgoing, record.incoming)) for record in records],
+             [record.view_json(user_id) for record in records],
+             dict(web.clients[user_id]['room_cursors']), log.last_seq)
+    assert after == before
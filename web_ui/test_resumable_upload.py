@@ -0,0 +1,164 @@
+"""
+Tests for resumable uploads: out-of-order and parallel chunks, rejected
+partial chunks, resuming after a restart, finalizing into a spool while
+chunks are still arriving and expiring sessions left on disk.
+"""
+import hashlib
+import io
+import os
+import threading
+import time
+
+import pytest
+
+from resumable_upload import UploadSessions, UploadError
+
+CHUNK = 64 * 1024
+
+
+def test_parallel_chunks(tmp_path):
+    """Chunks sent concurrently in any order assemble into the original file."""
+    directory = str(tmp_path)
+    sessions = UploadSessions(directory, chunk_size=CHUNK)
+    data = os.urandom(CHUNK * 20 + 123)
+    upload = sessions.create('alice', 'main', 'big.zip', len(data))
+    assert upload.chunk_count == 21
+
+    offsets = list(range(0, len(data), CHUNK))[::-1]
+    threads = [threading.Thread(target=upload.write_chunk, args=(offset, io.BytesIO(data[offset:offset + CHUNK])))
+               for offset in offsets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert upload.missing() == []
+
+    spool = sessions.finalize(upload)
+    assert spool.size == len(data)
+    assert spool.sha256.hexdigest() == hashlib.sha256(data).hexdigest()
+    spool.commit(os.path.join(directory, 'done'))
+    assert sorted(os.listdir(directory)) == ['done'], "session files left behind"
+
+
+def test_bad_chunks(tmp_path):
+    """Misaligned offsets and short bodies are rejected and stay missing."""
+    sessions = UploadSessions(str(tmp_path), chunk_size=CHUNK)
+    upload = sessions.create('alice', 'main', 'a.zip', CHUNK * 2)
+    for offset, body in ((10, b'x' * CHUNK), (0, b'x' * 100), (0, b'x' * (CHUNK + 1)), (CHUNK * 2, b'')):
+        with pytest.raises(UploadError):
+            upload.write_chunk(offset, io.BytesIO(body))
+    assert upload.missing() == [0, 1]
+    with pytest.raises(UploadError):
+        sessions.finalize(upload)
+
+
+def test_resume_after_restart(tmp_path):
+    """A new process picks up the received chunks from disk."""
+    directory = str(tmp_path)
+    data = os.urandom(CHUNK * 3)
+    upload = UploadSessions(directory, chunk_size=CHUNK).create('alice', 'main', 'a.zip', len(data))
+    upload.write_chunk(CHUNK, io.BytesIO(data[CHUNK:CHUNK * 2]))
+
+    sessions = UploadSessions(directory, chunk_size=CHUNK)
+    assert sessions.get(upload.upload_id, 'mallory') is None, "another user can see the upload"
+    resumed = sessions.get(upload.upload_id, 'alice')
+    assert resumed.missing() == [0, 2]
+    for index in resumed.missing():
+        resumed.write_chunk(index * CHUNK, io.BytesIO(data[index * CHUNK:(index + 1) * CHUNK]))
+    spool = sessions.finalize(resumed)
+    assert spool.sha256.hexdigest() == hashlib.sha256(data).hexdigest()
+    spool.close()
+    assert os.listdir(directory) == []
+
+
+class GatedStream(io.BytesIO):
+    """Request body that stalls on its first read until released."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.reading = threading.Event()
+        self.release = threading.Event()
+
+    def read(self, size=-1):
+        self.reading.set()
+        self.release.wait(10)
+        return super().read(size)
+
+
+def test_finalize_waits_for_writers(tmp_path):
+    """A chunk being rewritten holds finalize back, and no chunk starts after it."""
+    directory = str(tmp_path)
+    sessions = UploadSessions(directory, chunk_size=CHUNK)
+    data = os.urandom(CHUNK * 2)
+    upload = sessions.create('alice', 'main', 'a.zip', len(data))
+    upload.write_chunk(0, io.BytesIO(data[:CHUNK]))
+    upload.write_chunk(CHUNK, io.BytesIO(data[CHUNK:]))
+
+    # The client retries a chunk while another request completes the upload
+    retry = GatedStream(data[:CHUNK])
+    writer = threading.Thread(target=upload.write_chunk, args=(0, retry))
+    writer.start()
+    assert retry.reading.wait(5)
+    finalized = []
+    finalizer = threading.Thread(target=lambda: finalized.append(sessions.finalize(upload)))
+    finalizer.start()
+    finalizer.join(0.2)
+    assert finalizer.is_alive(), "finalize did not wait for the chunk being written"
+    with pytest.raises(UploadError):
+        upload.write_chunk(CHUNK, io.BytesIO(data[CHUNK:]))
+
+    retry.release.set()
+    writer.join(5)
+    finalizer.join(5)
+    spool = finalized[0]
+    assert spool.sha256.hexdigest() == hashlib.sha256(data).hexdigest()
+    spool.close()
+    assert os.listdir(directory) == [], "session metadata recreated after finalize"
+
+
+def test_failed_rewrite_marks_chunk_missing(tmp_path):
+    """A chunk whose rewrite breaks off has to be sent again."""
+    sessions = UploadSessions(str(tmp_path), chunk_size=CHUNK)
+    upload = sessions.create('alice', 'main', 'a.zip', CHUNK * 2)
+    upload.write_chunk(0, io.BytesIO(b'x' * CHUNK))
+    with pytest.raises(UploadError):
+        upload.write_chunk(0, io.BytesIO(b'x' * 100))
+    assert upload.missing() == [0, 1]
+    assert UploadSessions(str(tmp_path), chunk_size=CHUNK).get(upload.upload_id, 'alice').missing() == [0, 1]
+
+
+class RecordingTimers:
+    def __init__(self):
+        self.scheduled = {}
+
+    def schedule(self, key, deadline, callback):
+        self.scheduled[key] = (deadline, callback)
+
+    def cancel(self, key):
+        return self.scheduled.pop(key, None) is not None
+
+
+def test_expiry_after_restart(tmp_path):
+    """Sessions left on disk expire from their last write, without being asked for again."""
+    directory = str(tmp_path)
+    old = UploadSessions(directory, chunk_size=CHUNK).create('alice', 'main', 'old.zip', CHUNK)
+    recent = UploadSessions(directory, chunk_size=CHUNK).create('bob', 'main', 'new.zip', CHUNK)
+    stale = time.time() - 7200
+    for suffix in ('.json', '.part'):
+        os.utime(os.path.join(directory, old.upload_id + suffix), (stale, stale))
+
+    timers = RecordingTimers()
+    UploadSessions(directory, timers=timers, timeout=3600, chunk_size=CHUNK)
+    assert sorted(os.listdir(directory)) == [recent.upload_id + '.json', recent.upload_id + '.part']
+    deadline, expire = timers.scheduled[('upload', recent.upload_id)]
+    assert deadline == pytest.approx(os.path.getmtime(recent.part_path) + 3600, abs=1)
+
+    # Still written to (by another process), so the deadline moves on
+    os.utime(recent.part_path, (time.time() + 60, time.time() + 60))
+    expire()
+    assert timers.scheduled[('upload', recent.upload_id)][0] > deadline
+
+    for suffix in ('.json', '.part'):
+        os.utime(os.path.join(directory, recent.upload_id + suffix), (stale, stale))
+    timers.scheduled[('upload', recent.upload_id)][1]()
+    assert os.listdir(directory) == []
@@ -0,0 +1,81 @@
+"""
+Tests for the full-text search index: ranking, catching up with messages
+it missed and query speed on a large room.
+"""
+import random
+import time
+
+from message_store import RoomLog
+from search_index import SearchIndex, PostingList, tokenize
+
+WORDS = ['noise', 'protocol', 'handshake', 'cipher', 'key', 'server', 'client', 'room',
+         'message', 'hello', 'world', 'chat', 'secure', 'session', 'nonce', 'upload']
+
+
+def post(log, index, text, room_id='main'):
+    record = log.append('alice', {'content': text})
+    index.add(room_id, log, record)
+    return record
+
+
+def test_tokenize():
+    assert tokenize("Hello, Noise-Protocol world!") == ['hello', 'noise', 'protocol', 'world']
+
+
+def test_posting_list_round_trip():
+    """Delta-encoded blocks decode back to the postings that went in."""
+    postings = PostingList()
+    expected = [(seq, seq % 7 + 1) for seq in range(5, 100000, 3)]
+    for seq, frequency in expected:
+        postings.add(seq, frequency)
+    assert list(postings) == expected
+    assert len(postings.data) < len(expected) * 3, "postings are not compressed"
+    assert postings.frequencies([5, 6, 99998, 99999]) == {5: 6, 99998: 4}
+
+
+def test_ranking():
+    """Every query word must match; denser matches rank first."""
+    log, index = RoomLog(limit=100), SearchIndex()
+    post(log, index, 'the handshake failed')
+    post(log, index, 'handshake handshake key')
+    post(log, index, 'rotate the key')
+
+    assert [seq for _, seq in index.search('main', log, 'handshake')] == [2, 1]
+    assert [seq for _, seq in index.search('main', log, 'KEY handshake')] == [2]
+    assert index.search('main', log, 'missing') == []
+    # Members who joined later only find what was posted since
+    assert [seq for _, seq in index.search('main', log, 'handshake', after=1)] == [2]
+    assert index.search('main', log, 'handshake', after=2) == []
+
+
+def test_catch_up():
+    """Messages appended without going through add() are found anyway."""
+    log, index = RoomLog(limit=100), SearchIndex()
+    post(log, index, 'first secure message')
+    log.append('bob', {'content': 'posted by another worker'})
+    post(log, index, 'third secure message')
+
+    assert [seq for _, seq in index.search('main', log, 'worker')] == [2]
+    assert sorted(seq for _, seq in index.search('main', log, 'secure')) == [1, 3]
+
+    # A recreated room starts from scratch
+    log = RoomLog(limit=100)
+    post(log, index, 'fresh room')
+    assert index.search('main', log, 'secure') == []
+
+
+def test_large_room():
+    """Queries stay fast on a room with many messages."""
+    random.seed(7)
+    log, index = RoomLog(limit=100), SearchIndex()
+    for n in range(200000):
+        text = ' '.join(random.choice(WORDS) for _ in range(8))
+        if n % 5000 == 0:
+            text += ' needle'
+        post(log, index, text)
+
+    started = time.perf_counter()
+    results = index.search('main', log, 'needle handshake', limit=20)
+    elapsed = time.perf_counter() - started
+    assert results and all(seq % 5000 == 1 for _, seq in results)
+    assert elapsed < 0.05, f"query took {elapsed * 1000:.1f}ms"
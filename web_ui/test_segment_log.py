@@ -0,0 +1,101 @@
+"""
+Tests for the durable room history: paging, segment rolling, reopening a
+log, recovering from a torn write and bounding the open files.
+"""
+import os
+
+import segment_log
+from message_store import RoomLog
+from segment_log import SegmentLog
+
+MESSAGES = 2000
+
+
+def fill(log, count, start=1):
+    for n in range(start, start + count):
+        outgoing = {'text': f'message {n}', 'type': 'outgoing'}
+        incoming = {'text': f'message {n}', 'type': 'incoming'} if n % 2 else outgoing
+        log.append('alice', outgoing, incoming)
+
+
+def small_log(directory):
+    # Tiny segments and index intervals so every code path gets exercised
+    return SegmentLog(directory, segment_bytes=16 * 1024, index_interval=512)
+
+
+def test_paging(tmp_path):
+    """Pages walk back through the whole history without gaps or overlap."""
+    directory = str(tmp_path)
+    log = RoomLog(limit=10, durable=small_log(directory))
+    fill(log, MESSAGES)
+
+    assert len(os.listdir(directory)) > 4, "log did not roll over to new segments"
+    assert len(log) == 10, "memory log is not bounded"
+
+    seen = []
+    before = None
+    while True:
+        page = log.history(before, 64)
+        if not page:
+            break
+        seen[:0] = [record.seq for record in page]
+        before = page[0].seq
+    assert seen == list(range(1, MESSAGES + 1)), "history pages are not contiguous"
+
+    record = log.history(6, 1)[0]
+    assert record.seq == 5 and record.view('alice')['text'] == 'message 5'
+    assert record.view('bob')['type'] == 'incoming', "incoming view not stored"
+    assert log.history(MESSAGES + 50, 3)[-1].seq == MESSAGES
+
+
+def test_reopen(tmp_path):
+    """A reopened log resumes its sequence numbers and in-memory tail."""
+    directory = str(tmp_path)
+    log = RoomLog(limit=10, durable=small_log(directory))
+    fill(log, 500)
+    log.close()
+
+    log = RoomLog(limit=10, durable=small_log(directory))
+    assert log.last_seq == 500
+    assert [record.seq for record in log.records_after(495)] == [496, 497, 498, 499, 500]
+    fill(log, 10, start=501)
+    assert log.history(None, 1)[0].seq == 510
+
+
+def test_torn_tail(tmp_path):
+    """A partially written last record is cut off when the log is reopened."""
+    directory = str(tmp_path)
+    log = small_log(directory)
+    room = RoomLog(limit=10, durable=log)
+    fill(room, 100)
+    room.close()
+
+    active = sorted(name for name in os.listdir(directory) if name.endswith('.log'))[-1]
+    path = os.path.join(directory, active)
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 7)
+
+    room = RoomLog(limit=10, durable=small_log(directory))
+    assert room.last_seq == 99, f"expected to recover up to seq 99, got {room.last_seq}"
+    fill(room, 1, start=100)
+    assert [record.seq for record in room.history(None, 3)] == [98, 99, 100]
+
+
+def test_open_files_are_bounded(tmp_path, monkeypatch):
+    """However many rooms are busy, only the most recently used logs keep files open."""
+    monkeypatch.setattr(segment_log._open_logs, 'capacity', 4)
+    before = len(os.listdir('/proc/self/fd'))
+    logs = [RoomLog(limit=5, durable=small_log(str(tmp_path / f'room-{n}'))) for n in range(40)]
+    for log in logs:
+        fill(log, 300)
+        log.history(20, 10)
+    # Two files per log and at most a few maps of its last read
+    assert len(os.listdir('/proc/self/fd')) - before <= 4 * 4
+
+    # Logs that closed their files reopen them transparently
+    fill(logs[0], 5, start=301)
+    assert [record.seq for record in logs[0].history(None, 3)] == [303, 304, 305]
+    assert [record.seq for record in logs[0].history(3, 10)] == [1, 2]
+    for log in logs:
+        log.close()
+    assert len(segment_log._open_logs) == 0
@@ -0,0 +1,86 @@
+"""
+Multi-threaded stress test for the session registry.
+Many threads register, read, touch, sweep and remove sessions at the same
+time; afterwards the registry must hold exactly the sessions that were
+registered and never removed.
+"""
+import random
+import threading
+import time
+
+from session_registry import SessionRegistry
+
+THREADS = 16
+USERS = 200
+OPERATIONS = 20000
+
+
+def test_concurrent_add_and_pop():
+    """Every user ends up registered by exactly one thread and removed by at most one."""
+    registry = SessionRegistry(stripes=8)
+    added = [0] * USERS
+    popped = [0] * USERS
+    counts_lock = threading.Lock()
+    errors = []
+    start = threading.Barrier(THREADS)
+
+    def worker(seed):
+        rng = random.Random(seed)
+        start.wait()
+        try:
+            for _ in range(OPERATIONS):
+                user = rng.randrange(USERS)
+                user_id = f"user-{user}"
+                action = rng.random()
+                if action < 0.4:
+                    if registry.add(user_id, {'user': user, 'last_activity': time.time()}):
+                        with counts_lock:
+                            added[user] += 1
+                elif action < 0.55:
+                    if registry.pop(user_id) is not None:
+                        with counts_lock:
+                            popped[user] += 1
+                elif action < 0.75:
+                    client_info = registry.get(user_id)
+                    if client_info is not None and client_info['user'] != user:
+                        errors.append(f"{user_id} mapped to user {client_info['user']}")
+                    registry.touch(user_id)
+                elif action < 0.9:
+                    # Iterating a snapshot while other threads write must never raise
+                    for seen_id, client_info in registry.items():
+                        if seen_id != f"user-{client_info['user']}":
+                            errors.append(f"{seen_id} holds the session of user {client_info['user']}")
+                else:
+                    for idle_id, client_info in registry.idle(0, now=time.time() + 1):
+                        if registry.remove(idle_id, client_info):
+                            with counts_lock:
+                                popped[client_info['user']] += 1
+        except Exception as e:
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors, errors[:5]
+    for user in range(USERS):
+        registered = f"user-{user}" in registry
+        assert added[user] - popped[user] == int(registered), f"user-{user}: {added[user]} adds, {popped[user]} removals"
+    assert len(registry) == sum(added) - sum(popped)
+    assert sorted(registry.keys()) == sorted(user_id for user_id, _ in registry.items())
+
+
+def test_remove_only_matching_session():
+    """A sweep holding a stale session must not remove the user's new one."""
+    registry = SessionRegistry()
+    old = {'last_activity': 0}
+    new = {'last_activity': time.time()}
+    registry['alice'] = old
+    assert registry.idle(60) == [('alice', old)]
+    registry['alice'] = new
+    assert not registry.remove('alice', old)
+    assert registry.get('alice') is new
+    assert registry.remove('alice', new)
+    assert 'alice' not in registry
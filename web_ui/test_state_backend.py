@@ -0,0 +1,128 @@
+"""
+Tests for the state backends: room membership and its reverse index,
+claiming the durable history directory of in-process state, and SQLite
+state shared between workers.
+"""
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from state_backend import InProcessState, claim_history_dir, create_state
+
+
+def test_membership_index():
+    """Every member is indexed by user, so leaving all rooms never scans them."""
+    state = create_state('memory')
+    for room_id in ('main', 'dev', 'ops'):
+        state.create_room(room_id, room_id.title(), '', 'system')
+    state.add_member('main', 'alice')
+    state.add_member('dev', 'alice')
+    state.add_member('dev', 'alice')
+    state.add_member('dev', 'bob')
+    assert state.rooms_of('alice') == {'main', 'dev'}
+    assert set(state.rooms['dev']['members']) == {'alice', 'bob'}
+
+    state.remove_member('main', 'alice')
+    assert state.rooms_of('alice') == {'dev'} and not state.rooms['main']['members']
+    assert state.remove_user('alice') == {'dev'}
+    assert state.rooms_of('alice') == set() and set(state.rooms['dev']['members']) == {'bob'}
+    assert state.remove_user('carol') == set()
+
+
+def test_history_dir_is_exclusive(tmp_path):
+    """A second process on the same history directory refuses to start."""
+    base = str(tmp_path / 'history')
+    state = create_state('memory', history_dir=base)
+    assert state.history_dir == base
+    with pytest.raises(RuntimeError):
+        create_state('memory', history_dir=base)
+
+
+def test_history_dir_per_node(tmp_path):
+    """On a message bus every process appends to a directory of its own."""
+    base = str(tmp_path / 'history')
+    claimed = [claim_history_dir(base, per_node=True) for _ in range(3)]
+    assert claimed == [str(tmp_path / 'history' / f'node-{n}') for n in range(3)]
+
+    assert claim_history_dir(base, node_id='eu/1', per_node=True) == str(tmp_path / 'history' / 'eu%2F1')
+    with pytest.raises(RuntimeError):
+        claim_history_dir(base, node_id='eu/1', per_node=True)
+
+
+def test_rooms_survive_restart(tmp_path):
+    """A restart brings rooms back with their history; it never hands an old log to a new room."""
+    history = tmp_path / 'history'
+    state = InProcessState(history_dir=str(history))
+    state.create_room('secret', 'Secret', 'Plans', 'alice')
+    state.rooms['secret']['log'].append('alice', {'content': 'top secret'})
+    state.rooms['secret']['log'].close()
+
+    restarted = InProcessState(history_dir=str(history))
+    room = restarted.rooms['secret']
+    assert (room['name'], room['created_by'], set(room['members'])) == ('Secret', 'alice', set())
+    assert [record.incoming['content'] for record in room['log'].history(None, 10)] == ['top secret']
+    assert not restarted.create_room('secret', 'Mine', '', 'mallory')
+    room['log'].close()
+
+    # A log whose room is unknown is moved away, never reopened
+    os.remove(history / 'room-secret' / 'room.json')
+    restarted = InProcessState(history_dir=str(history))
+    assert 'secret' not in restarted.rooms
+    assert restarted.create_room('secret', 'Mine', '', 'mallory')
+    assert restarted.rooms['secret']['log'].history(None, 10) == []
+    assert [name for name in os.listdir(history) if name.startswith('stale-')]
+
+
+def test_sqlite_state_is_shared(tmp_path):
+    """Two workers on one database see each other's rooms, members and messages."""
+    url = f"sqlite:///{tmp_path / 'state.db'}"
+    first, second = create_state(url, history_limit=2), create_state(url, history_limit=2)
+    assert first.create_room('dev', 'Dev', 'Developers', 'alice')
+    assert not second.create_room('dev', 'Other', '', 'bob')
+    second.add_member('dev', 'bob')
+    assert first.rooms['dev']['name'] == 'Dev' and 'bob' in first.rooms['dev']['members']
+    assert first.rooms_of('bob') == {'dev'}
+
+    # Sequence numbers stay contiguous whichever worker appends
+    for n in range(5):
+        (first, second)[n % 2].rooms['dev']['log'].append('bob', {'content': f'm{n}'})
+    log = first.rooms['dev']['log']
+    assert log.last_seq == 5 and len(log) == 2
+    assert [record.view('alice')['content'] for record in log.records_after(2)] == ['m3', 'm4']
+    assert [record.seq for record in second.rooms['dev']['log'].history(4, 10)] == [1, 2, 3]
+
+    # The watcher reports appends made after it started
+    changed = threading.Event()
+    first.poll_interval = 0.01
+    first.watch(lambda room_id: room_id == 'dev' and changed.set())
+    for _ in range(100):
+        second.rooms['dev']['log'].append('bob', {'content': 'more'})
+        if changed.wait(0.05):
+            break
+    assert changed.is_set(), "watcher missed another worker's append"
+
+    assert second.delete_room('dev') and 'dev' not in first.rooms
+    first.create_room('dev', 'Dev', '', 'alice')
+    assert first.rooms['dev']['log'].last_seq == 0 and not first.rooms['dev']['members']
+
+
+def test_sqlite_sessions(tmp_path):
+    """A session belongs to one live worker; those of dead workers are taken over."""
+    state = create_state(f"sqlite:///{tmp_path / 'state.db'}")
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+
+    assert state.claim_session('alice', 'Alice', os.getpid())
+    assert not state.claim_session('alice', 'Alice', dead.pid)
+    assert state.session_owner('alice') == os.getpid() and state.username('alice') == 'Alice'
+    state.release_session('alice', dead.pid)
+    assert state.session_owner('alice') == os.getpid()
+
+    assert state.claim_session('bob', 'Bob', dead.pid)
+    assert state.session_owner('bob') is None
+    assert state.claim_session('bob', 'Bob', os.getpid()) and state.session_owner('bob') == os.getpid()
+    state.release_session('bob', os.getpid())
+    assert state.session_owner('bob') is None and state.username('bob') is None
@@ -0,0 +1,106 @@
+"""
+Tests for sticky routing: requests of sessions owned by another worker are
+relayed over its socket with their bodies streamed, and handled locally
+only when that worker cannot be reached before the body is read.
+"""
+import hashlib
+import io
+import os
+
+import pytest
+from flask import Flask, request, jsonify
+from werkzeug.test import Client
+
+from sticky_router import StickyRouter, serve_worker_socket, worker_socket_path, RELAY_BLOCK_SIZE
+
+OWNER = 4242
+
+
+class OwnerState:
+    def session_owner(self, user_id):
+        return OWNER if user_id == 'alice' else None
+
+
+def echo_app(name):
+    app = Flask(name)
+    app.secret_key = 'test'
+
+    @app.route('/upload', methods=['POST'])
+    def upload():
+        data = request.get_data()
+        return jsonify({'worker': name, 'size': len(data), 'sha256': hashlib.sha256(data).hexdigest(),
+                        'routed': request.headers.get('X-Noise-Routed')})
+
+    return app
+
+
+class RecordingInput(io.BytesIO):
+    """wsgi.input that remembers the largest read."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.largest = 0
+
+    def read(self, size=-1):
+        self.largest = max(self.largest, len(self.getbuffer()) if size is None or size < 0 else size)
+        return super().read(size)
+
+
+@pytest.fixture
+def client(tmp_path):
+    local = echo_app('local')
+    return Client(StickyRouter(local.wsgi_app, local, OwnerState(), str(tmp_path)), use_cookies=False)
+
+
+def alice_cookie():
+    """Session cookie of the user whose session the other worker owns."""
+    app = echo_app('cookie')
+    return 'session=' + app.session_interface.get_signing_serializer(app).dumps({'user_id': 'alice'})
+
+
+def post(client, data, headers=None):
+    body = RecordingInput(data)
+    response = client.post('/upload', input_stream=body, content_length=len(data),
+                           content_type='application/octet-stream',
+                           headers={'Cookie': alice_cookie(), **(headers or {})})
+    return response, body
+
+
+def test_forward_streams_body(client, tmp_path):
+    """A large body reaches the owning worker intact without being read whole."""
+    server = serve_worker_socket(echo_app('owner').wsgi_app, worker_socket_path(str(tmp_path), OWNER))
+    try:
+        data = os.urandom(5 * 1024 * 1024 + 3)
+        response, body = post(client, data)
+        assert response.json == {'worker': 'owner', 'size': len(data), 'routed': '1',
+                                 'sha256': hashlib.sha256(data).hexdigest()}
+        assert body.largest <= RELAY_BLOCK_SIZE, f"read {body.largest} bytes at once"
+        assert os.stat(worker_socket_path(str(tmp_path), OWNER)).st_mode & 0o777 == 0o600
+    finally:
+        server.shutdown()
+
+
+def test_routed_header_is_not_trusted(client, tmp_path):
+    """A client claiming its request was routed is still sent to the owner."""
+    server = serve_worker_socket(echo_app('owner').wsgi_app, worker_socket_path(str(tmp_path), OWNER))
+    try:
+        response, _ = post(client, b'abc', headers={'X-Noise-Routed': '1'})
+        assert response.json['worker'] == 'owner'
+    finally:
+        server.shutdown()
+    response = client.post('/upload', data=b'abc', headers={'X-Noise-Routed': '1'})
+    assert response.json['worker'] == 'local' and response.json['routed'] is None
+
+
+def test_unreachable_owner_falls_back(client):
+    """Without the owner's socket the request is served here, body and all."""
+    data = os.urandom(100000)
+    response, _ = post(client, data)
+    assert response.json['worker'] == 'local' and response.json['size'] == len(data)
+
+
+def test_local_and_websocket_requests(client):
+    """Sessions owned by nobody stay local; upgrades for another worker are refused."""
+    assert client.post('/upload', data=b'abc').json['worker'] == 'local'
+    response = client.get('/upload', headers={'Cookie': alice_cookie(), 'Upgrade': 'websocket'})
+    assert response.status_code == 409
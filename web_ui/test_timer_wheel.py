@@ -0,0 +1,56 @@
+"""
+Tests for the timing wheel, driven with explicit timestamps instead of sleeping.
+"""
+from timer_wheel import TimerWheel
+
+
+def test_timers_fire_within_a_tick():
+    """Timers on every level fire on the first tick at or after their deadline."""
+    wheel = TimerWheel(tick=1.0, slots=8, levels=3)
+    start = wheel._origin
+    fired = {}
+    delays = [0.5, 3, 7.2, 8, 30, 63.9, 64, 65, 400, 1000]
+    for delay in delays:
+        wheel.schedule(delay, start + delay, lambda delay=delay: fired.setdefault(delay, now))
+
+    for step in range(1, 1101):
+        now = start + step
+        wheel.advance(now)
+
+    assert sorted(fired) == delays, sorted(fired)
+    for delay, at in fired.items():
+        assert start + delay <= at < start + delay + 1, (delay, at - start)
+    assert len(wheel) == 0
+
+
+def test_pushed_back_deadline():
+    """Rescheduling to a later deadline moves the expiry, an earlier one too."""
+    wheel = TimerWheel(tick=1.0, slots=8, levels=2)
+    start = wheel._origin
+    fired = []
+    wheel.schedule('idle', start + 5, lambda: fired.append(('idle', now)))
+    wheel.schedule('idle', start + 20, lambda: fired.append(('idle', now)))
+    wheel.schedule('room', start + 10, lambda: fired.append(('room', now)))
+    wheel.schedule('room', start + 2, lambda: fired.append(('room', now)))
+    wheel.schedule('gone', start + 3, lambda: fired.append(('gone', now)))
+    assert wheel.cancel('gone')
+
+    for step in range(1, 30):
+        now = start + step
+        wheel.advance(now)
+
+    assert fired == [('room', start + 2), ('idle', start + 20)], fired
+
+
+def test_long_deadline_beyond_wheel():
+    """Deadlines past the wheel's range are parked and re-placed until due."""
+    wheel = TimerWheel(tick=1.0, slots=4, levels=2)
+    start = wheel._origin
+    fired = []
+    wheel.schedule('far', start + 50, lambda: fired.append(now))
+
+    for step in range(1, 60):
+        now = start + step
+        wheel.advance(now)
+
+    assert fired == [start + 50], [at - start for at in fired]
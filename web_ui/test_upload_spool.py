@@ -0,0 +1,61 @@
+"""
+Tests for single-pass upload storage: spooling a multipart body straight
+from the form parser, committing and discarding spools.
+"""
+import hashlib
+import io
+import os
+
+import pytest
+from werkzeug.formparser import parse_form_data
+from werkzeug.test import EnvironBuilder
+
+from upload_spool import UploadSpool
+
+
+def test_form_parser_writes_through(tmp_path):
+    """The parser streams the file part into the spool, hashed in the same pass."""
+    data = os.urandom(300 * 1024 + 5)
+    environ = EnvironBuilder(method='POST', data={'file': (io.BytesIO(data), 'big.bin')}).get_environ()
+    spools = []
+
+    def stream_factory(total_content_length, content_type, filename=None, content_length=None):
+        spools.append(UploadSpool(str(tmp_path)))
+        return spools[0]
+
+    _, _, files = parse_form_data(environ, stream_factory=stream_factory)
+    spool = files['file'].stream
+    assert spool is spools[0]
+    assert spool.size == len(data)
+    assert spool.sha256.hexdigest() == hashlib.sha256(data).hexdigest()
+
+    spool.commit(str(tmp_path / 'stored'))
+    assert (tmp_path / 'stored').read_bytes() == data
+    assert os.listdir(tmp_path) == ['stored'], "temporary file left behind"
+
+
+def test_close_discards(tmp_path):
+    """A spool closed without being committed removes its temporary file."""
+    spool = UploadSpool.from_stream(io.BytesIO(b'abandoned'), str(tmp_path))
+    assert os.path.exists(spool.temp_path)
+    spool.close()
+    assert os.listdir(tmp_path) == []
+
+    class Broken(io.RawIOBase):
+        def readinto(self, b):
+            raise OSError('client went away')
+
+    with pytest.raises(OSError):
+        UploadSpool.from_stream(Broken(), str(tmp_path))
+    assert os.listdir(tmp_path) == [], "failed upload left its temporary file"
+
+
+def test_from_file(tmp_path):
+    """An assembled file is hashed in place and committed by rename."""
+    path = tmp_path / 'assembled.part'
+    path.write_bytes(b'chunk' * 10000)
+    spool = UploadSpool.from_file(str(path))
+    assert spool.size == 50000
+    assert spool.sha256.hexdigest() == hashlib.sha256(b'chunk' * 10000).hexdigest()
+    spool.commit(str(tmp_path / 'done'))
+    assert os.listdir(tmp_path) == ['done']
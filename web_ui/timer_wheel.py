@@ -0,0 +1,180 @@
+"""
+Hierarchical timing wheel for idle timeouts.
+Timers are hashed into slots by their deadline, so each tick only looks at
+the timers that are due (plus an occasional cascade of a coarser slot)
+instead of scanning every client or room.
+"""
+
+import math
+import threading
+import time
+import logging
+
+logger = logging.getLogger('noise_web_timers')
+
+
+class _Timer:
+    __slots__ = ('key', 'deadline', 'callback', 'cancelled')
+
+    def __init__(self, key, deadline, callback):
+        self.key = key
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+
+
+class TimerWheel:
+    """
+    Hierarchical timing wheel keyed by arbitrary hashable keys.
+    Level 0 has `slots` slots of `tick` seconds each; every further level
+    is `slots` times coarser and is cascaded into the finer levels as the
+    wheel turns. With the defaults (1s ticks, 64 slots, 3 levels) timers up
+    to ~73 hours away are placed directly, longer ones are re-placed when
+    their slot comes up.
+
+    Pushing a deadline back (the common case for idle timeouts, where every
+    bit of activity extends it) is O(1): the timer keeps its slot and is
+    simply re-placed when that slot fires.
+    """
+
+    def __init__(self, tick=1.0, slots=64, levels=3):
+        """
+        Initialize an empty wheel.
+
+        Args:
+            tick (float): Resolution in seconds
+            slots (int): Slots per level
+            levels (int): Number of levels
+        """
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._lock = threading.Lock()
+        self._wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._timers = {}  # key -> _Timer
+        self._origin = time.time()
+        self._ticks = 0  # Ticks processed since _origin
+        self._thread = None
+
+    def __len__(self):
+        return len(self._timers)
+
+    def _place(self, timer, cascading=False):
+        """Put a timer into the slot matching its deadline (lock held)."""
+        # While cascading, the level 0 slot of the current tick has not been processed yet
+        earliest = self._ticks if cascading else self._ticks + 1
+        expires = max(earliest, math.ceil((timer.deadline - self._origin) / self.tick))
+        delta = expires - self._ticks
+
+        for level in range(self.levels):
+            span = self.slots ** (level + 1)
+            if delta < span or level == self.levels - 1:
+                if delta >= span:
+                    # Beyond the wheel's range: park it in the furthest slot and re-place later
+                    expires = self._ticks + span - 1
+                slot = (expires // self.slots ** level) % self.slots
+                self._wheels[level][slot].append(timer)
+                return
+
+    def schedule(self, key, deadline, callback):
+        """
+        Schedule (or reschedule) a timer.
+
+        Args:
+            key: Hashable timer identifier, replaces any timer with the same key
+            deadline (float): time.time() at which the timer fires
+            callback (callable): Called without arguments from the wheel's thread
+        """
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is not None and deadline >= timer.deadline:
+                # Later deadline: the timer is re-placed when its current slot fires
+                timer.deadline = deadline
+                timer.callback = callback
+                return
+
+            if timer is not None:
+                timer.cancelled = True
+            timer = _Timer(key, deadline, callback)
+            self._timers[key] = timer
+            self._place(timer)
+
+    def cancel(self, key):
+        """
+        Cancel a timer.
+
+        Args:
+            key: Timer identifier
+
+        Returns:
+            bool: True if a timer was pending
+        """
+        with self._lock:
+            timer = self._timers.pop(key, None)
+            if timer is None:
+                return False
+            timer.cancelled = True
+            return True
+
+    def advance(self, now=None):
+        """
+        Turn the wheel up to `now` and run the callbacks of expired timers.
+
+        Args:
+            now (float): Current time, defaults to time.time()
+
+        Returns:
+            int: Number of timers that fired
+        """
+        now = time.time() if now is None else now
+        due = []
+
+        with self._lock:
+            target = math.floor((now - self._origin) / self.tick)
+            while self._ticks < target:
+                self._ticks += 1
+
+                # Cascade coarser slots whose range starts at this tick, coarsest first
+                for level in range(self.levels - 1, 0, -1):
+                    size = self.slots ** level
+                    if self._ticks % size == 0:
+                        slot = self._wheels[level][(self._ticks // size) % self.slots]
+                        self._wheels[level][(self._ticks // size) % self.slots] = []
+                        for timer in slot:
+                            if not timer.cancelled:
+                                self._place(timer, cascading=True)
+
+                index = self._ticks % self.slots
+                slot = self._wheels[0][index]
+                self._wheels[0][index] = []
+                tick_time = self._origin + self._ticks * self.tick
+                for timer in slot:
+                    if timer.cancelled:
+                        continue
+                    if timer.deadline > tick_time:
+                        self._place(timer)
+                    else:
+                        del self._timers[timer.key]
+                        due.append(timer)
+
+        # Callbacks may schedule or cancel timers, so run them without the lock
+        for timer in due:
+            try:
+                timer.callback()
+            except Exception as e:
+                logger.error(f"Error in timer {timer.key}: {e}")
+        return len(due)
+
+    def start(self):
+        """Start turning the wheel from a daemon thread (no-op if already running)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='timer-wheel')
+            self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            self.advance()
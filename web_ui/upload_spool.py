@@ -0,0 +1,138 @@
+"""
+Single-pass storage of uploaded files.
+
+An UploadSpool is handed to werkzeug's multipart parser as the stream a
+file part is written to. Every chunk the parser writes is hashed with
+SHA-256 (the content address), counted and written to a temporary file in
+the upload folder, so an upload is read once, never held in memory and
+never copied. With an at-rest cipher the chunks are sealed on
+their way to the temporary file, so the plaintext never touches the disk.
+commit() moves the temporary file to its final name with an atomic
+rename; a spool that is closed without being committed deletes its
+temporary file.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import logging
+
+logger = logging.getLogger('noise_web_upload')
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadSpool:
+    """
+    Write-through file object that hashes and stores an upload.
+    """
+
+    def __init__(self, directory, cipher=None):
+        """
+        Create the temporary file the upload is written to.
+
+        Args:
+            directory (str): Upload folder; the temporary file lives there so
+                the final rename never crosses file systems
+            cipher (AtRestCipher): Seals the file as it is written, optional
+        """
+        os.makedirs(directory, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-', suffix='.part')
+        self._file = os.fdopen(fd, 'wb', buffering=CHUNK_SIZE)
+        self._reset()
+        self._writer = cipher.writer(self._file) if cipher is not None else self._file
+
+    def _reset(self):
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.path = None  # Final path once committed
+
+    @classmethod
+    def from_stream(cls, stream, directory, cipher=None):
+        """
+        Spool an already parsed upload, e.g. one werkzeug buffered itself.
+
+        Args:
+            stream: Readable file object
+            directory (str): Upload folder
+            cipher (AtRestCipher): Seals the file as it is written, optional
+
+        Returns:
+            UploadSpool: The filled spool
+        """
+        spool = cls(directory, cipher)
+        try:
+            shutil.copyfileobj(stream, spool, CHUNK_SIZE)
+        except Exception:
+            spool.close()
+            raise
+        return spool
+
+    @classmethod
+    def from_file(cls, path, cipher=None):
+        """
+        Take over a file assembled elsewhere (e.g. from resumable upload
+        chunks), hashing it in one sequential read.
+
+        Args:
+            path (str): The file, in the upload folder
+            cipher (AtRestCipher): Cipher the file was sealed with, optional
+
+        Returns:
+            UploadSpool: Spool owning the file
+        """
+        spool = cls.__new__(cls)
+        spool.temp_path = path
+        spool._reset()
+        with (cipher.open(path) if cipher is not None else open(path, 'rb')) as f:
+            spool._file = spool._writer = f
+            buffer = bytearray(CHUNK_SIZE)
+            view = memoryview(buffer)
+            for n in iter(lambda: f.readinto(view), 0):
+                spool._consume(view[:n])
+        return spool
+
+    def _consume(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+
+    def write(self, data):
+        self._consume(data)
+        self._writer.write(data)
+        return len(data)
+
+    def seek(self, offset, whence=0):
+        # The form parser rewinds finished parts; the data is already stored
+        return 0
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        self._file.flush()
+
+    def commit(self, path):
+        """
+        Move the stored upload to its final path.
+
+        Args:
+            path (str): Destination in the upload folder
+        """
+        if self._writer is not self._file:
+            self._writer.finish()
+        self._file.close()
+        os.replace(self.temp_path, path)
+        self.path = path
+
+    def close(self):
+        """Close the spool, deleting the temporary file unless it was committed."""
+        if not self._file.closed:
+            self._file.close()
+        if self.path is None:
+            try:
+                os.unlink(self.temp_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not remove temporary upload {self.temp_path}: {e}")